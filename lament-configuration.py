@@ -4,3 +4,6 @@ import lc.model
 
 lc.config.app.init_db()
 lc.model.create_tables()
+# requests open their own connections, so don't leave this one open
+# to be inherited by forked workers (e.g. under gunicorn --preload)
+lc.config.app.close_db()
@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+import datetime
+import re
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import lc.config as c
+import lc.model as m
+import lc.request as r
+
+# A query plan step that reads every row of a table, e.g. `SCAN t1`.
+# Walking an index (`SCAN t1 USING INDEX ...`) is fine, since that's
+# how an ORDER BY ... LIMIT gets answered without sorting.
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+# A step that sorts every matching row before any can be returned
+FULL_SORT = re.compile(r"^USE TEMP B-TREE FOR ORDER BY$")
+# A step that runs a virtual table's own search, e.g. the full-text
+# index's MATCH. That's fine as the outermost loop of a join, but
+# nested inside another loop it runs again for every row of that one.
+VIRTUAL_SCAN = re.compile(r"^SCAN (\w+) VIRTUAL TABLE\b")
+# A step that loops over the rows of a table or index
+LOOP = re.compile(r"^(SCAN|SEARCH) ")
+# A loop that can only ever find a single row
+ONE_ROW = re.compile(r"^SEARCH \w+ USING INTEGER PRIMARY KEY \(rowid=\?\)$")
+TABLE_ALIAS = re.compile(r'"(\w+)" AS "(\w+)"')
+
+# Problems we expect and are happy with, for each query method
+ALLOWED = {
+    # the total for the front page adds up the public link counter of
+    # every user, and there are few enough users for that to be cheap
+    ("Link.get_all", "scan user"),
+    # a tag's links are found through `hastag`, which knows nothing
+    # about dates, so the links then have to be sorted. That's only
+    # as many as have the tag, though.
+    ("Tag.get_links", "sort"),
+    # likewise for the matches that the full-text index finds, when
+    # they're sorted by rank
+    ("User.get_string_search", "sort"),
+}
+
+Statement = Tuple[str, tuple]
+
+
+@contextmanager
+def recording() -> Iterator[List[Statement]]:
+    """Collect the SQL and parameters of every statement run inside the block"""
+    statements: List[Statement] = []
+    execute_sql = c.app.db.execute_sql
+
+    def recording_execute_sql(sql, params=None, *args, **kwargs):
+        statements.append((sql, tuple(params or ())))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    c.app.db.execute_sql = recording_execute_sql  # type: ignore
+    try:
+        yield statements
+    finally:
+        c.app.db.execute_sql = execute_sql  # type: ignore
+
+
+def plan_steps(sql: str, params: tuple) -> List[Tuple[int, int, str]]:
+    """The (id, parent id, detail) of each step of SQLite's plan for a statement"""
+    cursor = c.app.db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [(id, parent, detail) for (id, parent, _unused, detail) in cursor.fetchall()]
+
+
+def query_plan(sql: str, params: tuple) -> List[str]:
+    """The steps of SQLite's plan for running a statement"""
+    return [detail for (_id, _parent, detail) in plan_steps(sql, params)]
+
+
+def problems(name: str, sql: str, params: tuple) -> List[str]:
+    """
+    The steps of a statement's plan that read or sort a whole table, or
+    that run a virtual table's search once per row of another, apart
+    from those we've decided to allow for the query method `name`
+    """
+    if not re.match(r"\s*(SELECT|UPDATE|DELETE|INSERT|WITH)\b", sql, re.I):
+        return []
+    aliases = {alias: table for table, alias in TABLE_ALIAS.findall(sql)}
+    found = []
+    # the loops of each join seen so far, outermost first, by parent step
+    loops: Dict[int, List[str]] = {}
+    for _id, parent, step in plan_steps(sql, params):
+        outer = loops.setdefault(parent, [])
+        problem = None
+        if match := FULL_SCAN.match(step):
+            problem = f"scan {aliases.get(match.group(1), match.group(1))}"
+        elif FULL_SORT.match(step):
+            problem = "sort"
+        elif (match := VIRTUAL_SCAN.match(step)) and not all(
+            ONE_ROW.match(loop) for loop in outer
+        ):
+            problem = f"search {aliases.get(match.group(1), match.group(1))} per row"
+        if LOOP.match(step):
+            outer.append(step)
+        if problem is not None and (name, problem) not in ALLOWED:
+            found.append(f"{problem}: {step}")
+    return found
+
+
+def seed() -> Dict[str, m.Model]:
+    """
+    Fill an empty database with enough users, links and tags for
+    every query below to have something to find
+    """
+    owner = m.User.from_request(r.User(name="owner", password="owner"))
+    other = m.User.from_request(r.User(name="other", password="other"))
+    for user in (owner, other):
+        for i in range(20):
+            m.Link.from_request(
+                user,
+                r.Link(
+                    f"http://example.com/{user.name}/{i}",
+                    f"link {i}",
+                    f"link number {i}",
+                    i % 3 == 0,
+                    ["food/bread/rye", f"tag{i % 4}"],
+                ),
+            )
+    links = m.Link.select().where(m.Link.user == owner).order_by(m.Link.id)
+    tag = m.Tag.get((m.Tag.user == owner) & (m.Tag.name == "food/bread"))
+    return {
+        "owner": owner,
+        "other": other,
+        "link": links.first(),
+        # one for a batch to delete
+        "spare": links.order_by(-m.Link.id).first(),
+        "tag": tag,
+    }
+
+
+def cursor(link: m.Link, before: bool = False) -> r.Cursor:
+    return r.Cursor(before=before, created=link.created, id=link.id)
+
+
+def batch(sample: dict) -> r.LinkBatch:
+    """A batch that creates, updates and deletes a link each"""
+    return r.LinkBatch(
+        operations=[
+            r.LinkOperation(
+                "create",
+                link=r.Link("http://example.com/batch", "batch", "", False, ["b/c"]),
+            ),
+            r.LinkOperation(
+                "update",
+                id=sample["link"].id,
+                link=r.Link(sample["link"].url, "batched", "", False, ["tag2"]),
+            ),
+            r.LinkOperation("delete", id=sample["spare"].id),
+        ]
+    )
+
+
+# The app's query methods, each run against the seeded data
+QUERIES: List[Tuple[str, Callable[[dict], object]]] = [
+    ("User.by_slug", lambda s: m.User.by_slug("owner")),
+    ("User.get_link", lambda s: s["owner"].get_link(s["link"].id)),
+    ("User.get_tag", lambda s: s["owner"].get_tag("food")),
+    ("User.get_tags", lambda s: s["owner"].get_tags()),
+    ("User.get_links", lambda s: s["owner"].get_links(as_user=s["owner"])),
+    ("User.get_links", lambda s: s["owner"].get_links(as_user=s["other"])),
+    (
+        "User.get_links",
+        lambda s: s["owner"].get_links(as_user=None, cursor=cursor(s["link"])),
+    ),
+    (
+        "User.get_links",
+        lambda s: s["owner"].get_links(
+            as_user=s["owner"], cursor=cursor(s["link"], before=True)
+        ),
+    ),
+    ("User.get_changes", lambda s: s["owner"].get_changes(r.ChangeToken(1, 1))),
+    ("User.get_related_tags", lambda s: s["owner"].get_related_tags(s["tag"])),
+    (
+        "User.get_string_search",
+        lambda s: s["owner"].get_string_search("bread", as_user=s["owner"]),
+    ),
+    (
+        "User.get_string_search",
+        lambda s: s["owner"].get_string_search("link", as_user=None, ranked=True),
+    ),
+    (
+        "User.import_links",
+        lambda s: s["other"].import_links(
+            [
+                r.PinboardLink(
+                    href="http://example.com/imported",
+                    description="imported",
+                    extended="",
+                    time=datetime.datetime(2020, 1, 1),
+                    shared=True,
+                    tags=["food/cheese"],
+                )
+            ]
+        ),
+    ),
+    ("Link.get_all", lambda s: m.Link.get_all(as_user=None)),
+    ("Link.get_all", lambda s: m.Link.get_all(as_user=s["owner"])),
+    (
+        "Link.get_all",
+        lambda s: m.Link.get_all(as_user=s["other"], cursor=cursor(s["link"])),
+    ),
+    ("Link.by_id", lambda s: m.Link.by_id(s["link"].id)),
+    (
+        "Link.from_request",
+        lambda s: m.Link.from_request(
+            s["owner"], r.Link("http://example.com/new", "new", "", False, ["new"])
+        ),
+    ),
+    (
+        "Link.update_from_request",
+        lambda s: s["link"].update_from_request(
+            s["owner"],
+            r.Link(s["link"].url, "renamed", "", True, ["food/cheese", "tag1"]),
+        ),
+    ),
+    ("Tag.get_links", lambda s: s["tag"].get_links(as_user=s["owner"])),
+    ("Tag.get_links", lambda s: s["tag"].get_links(as_user=None)),
+    ("Tag.get_family", lambda s: list(s["tag"].get_family())),
+    ("Tag.get_or_create_tag", lambda s: m.Tag.get_or_create_tag(s["owner"], "a/b")),
+    (
+        "Tag.get_or_create_tags",
+        lambda s: m.Tag.get_or_create_tags(s["owner"], ["food/bread", "x/y/z"]),
+    ),
+    ("Tag.clean", lambda s: m.Tag.clean([s["tag"].id])),
+    ("User.export_links", lambda s: list(s["owner"].export_links())),
+    ("User.apply_batch", lambda s: s["owner"].apply_batch(batch(s))),
+    ("Link.full_delete", lambda s: s["link"].full_delete()),
+]
+
+
+def advise() -> Dict[str, List[str]]:
+    """
+    Run every query method against a freshly seeded database and
+    collect the plan steps that read or sort a whole table, keyed by
+    query method and statement
+    """
+    found: Dict[str, List[str]] = {}
+    sample = seed()
+    for name, run in QUERIES:
+        with recording() as statements:
+            run(sample)
+        for sql, params in statements:
+            if steps := problems(name, sql, params):
+                found.setdefault(f"{name}: {sql}", []).extend(steps)
+    return found
@@ -1,4 +1,5 @@
 import flask
+from typing import Iterator
 
 import lc.config as c
 import lc.error as e
@@ -6,27 +7,41 @@ import lc.model as m
 import lc.request as r
 import lc.view as v
 from lc.web import Endpoint, endpoint, render
+from lc.worker import worker
 
 app = c.app.app
 
 
+@app.before_request
+def start_worker():
+    # which also runs any import jobs that were queued before we started
+    worker.ensure_started()
+
+
 @endpoint("/")
 class Index(Endpoint):
-    def html(self):
+    def version(self):
+        return m.User.all_versions()
 
-        pg = int(flask.request.args.get("page", 1))
-        links, pages = m.Link.get_all(as_user=self.user, page=pg)
-        linklist = v.LinkList(links=links, pages=pages, user="", tags=[])
+    def html(self):
+        def content():
+            links, pages = m.Link.get_all(as_user=self.user, cursor=self.cursor())
+            linklist = v.LinkList(links=links, pages=pages, user="", tags=[])
+            return render("linklist", linklist)
 
         return render(
             "main",
             v.Page(
                 title="main",
-                content=render("linklist", linklist),
+                content=self.fragment(content),
                 user=self.user,
             ),
         )
 
+    def api_get(self):
+        links, pages = m.Link.get_all(as_user=self.user, cursor=self.cursor())
+        return self.api_ok("/", v.LinkList(links, [], user="", pages=pages).to_dict())
+
 
 @endpoint("/auth")
 class Auth(Endpoint):
@@ -52,11 +67,15 @@ class Login(Endpoint):
 @endpoint("/logout")
 class Logout(Endpoint):
     def html(self):
+        if token := self.token():
+            m.User.forget_token(token)
         if "auth" in flask.session:
             del flask.session["auth"]
         raise e.LCRedirect("/")
 
     def api_post(self):
+        if token := self.token():
+            m.User.forget_token(token)
         if "auth" in flask.session:
             del flask.session["auth"]
         return self.api_ok("/")
@@ -92,23 +111,31 @@ class CreateUser(Endpoint):
 
 @endpoint("/u/<string:slug>")
 class GetUser(Endpoint):
+    def version(self, slug: str):
+        return m.User.version_of(slug)
+
     def html(self, slug: str):
-        u = m.User.by_slug(slug)
-        pg = int(flask.request.args.get("page", 1))
-        tags = u.get_tags()
-        links, pages = u.get_links(as_user=self.user, page=pg)
-        linklist = v.LinkList(links=links, user=slug, pages=pages, tags=tags)
+        def content():
+            u = m.User.by_slug(slug)
+            tags = u.get_tags()
+            links, pages = u.get_links(as_user=self.user, cursor=self.cursor())
+            linklist = v.LinkList(links=links, user=slug, pages=pages, tags=tags)
+            return render("linklist", linklist)
+
         return render(
             "main",
             v.Page(
-                title=f"user {u.name}",
-                content=render("linklist", linklist),
+                title=f"user {slug}",
+                content=self.fragment(content),
                 user=self.user,
             ),
         )
 
     def api_get(self, slug: str):
-        return m.User.by_slug(slug).to_dict()
+        u = m.User.by_slug(slug)
+        links, pages = u.get_links(as_user=self.user, cursor=self.cursor())
+        linklist = v.LinkList(links, [], user=slug, pages=pages)
+        return self.api_ok(u.base_url(), {**u.to_dict(), **linklist.to_dict()})
 
 
 @endpoint("/u/<string:user>/config")
@@ -182,8 +209,19 @@ class CreateLink(Endpoint):
         return self.api_ok(link.link_url(), link.to_dict())
 
 
+@endpoint("/u/<string:user>/links/batch")
+class ApplyLinkBatch(Endpoint):
+    def api_post(self, user: str):
+        u = self.require_authentication(user)
+        results = u.apply_batch(self.request_data(r.LinkBatch))
+        return self.api_ok(u.base_url(), results.to_dict())
+
+
 @endpoint("/u/<string:user>/l/<string:link_id>")
 class GetLink(Endpoint):
+    def version(self, user: str, link_id: str):
+        return m.User.version_of(user)
+
     def api_get(self, user: str, link_id: str):
         u = self.require_authentication(user)
         link = u.get_link(int(link_id))
@@ -233,29 +271,47 @@ class EditLink(Endpoint):
 
 @endpoint("/u/<string:user>/t/<path:tag>")
 class GetTaggedLinks(Endpoint):
+    def version(self, user: str, tag: str):
+        return m.User.version_of(user)
+
     def html(self, user: str, tag: str):
-        u = m.User.by_slug(user)
-        pg = int(flask.request.args.get("page", 1))
-        t = u.get_tag(tag)
-        links, pages = t.get_links(as_user=self.user, page=pg)
-        tags = u.get_related_tags(t)
-        linklist = v.LinkList(links=links, pages=pages, tags=tags, user=user)
+        def content():
+            u = m.User.by_slug(user)
+            t = u.get_tag(tag)
+            links, pages = t.get_links(as_user=self.user, cursor=self.cursor())
+            tags = u.get_related_tags(t)
+            linklist = v.LinkList(links=links, pages=pages, tags=tags, user=user)
+            return render("linklist", linklist)
+
         return render(
             "main",
             v.Page(
                 title=f"tag {tag}",
-                content=render("linklist", linklist),
+                content=self.fragment(content),
                 user=self.user,
             ),
         )
 
+    def api_get(self, user: str, tag: str):
+        t = m.User.by_slug(user).get_tag(tag)
+        links, pages = t.get_links(as_user=self.user, cursor=self.cursor())
+        linklist = v.LinkList(links, [], user=user, pages=pages)
+        return self.api_ok(t.url(), linklist.to_dict())
+
 
 @endpoint("/u/<string:user>/search/<string:needle>")
 class GetStringSearch(Endpoint):
+    def version(self, user: str, needle: str):
+        return m.User.version_of(user)
+
     def html(self, user: str, needle: str):
         u = m.User.by_slug(user)
-        pg = int(flask.request.args.get("page", 1))
-        links, pages = u.get_string_search(needle=needle, as_user=self.user, page=pg)
+        links, pages = u.get_string_search(
+            needle=needle,
+            as_user=self.user,
+            cursor=self.cursor(),
+            ranked=flask.request.args.get("order") == "rank",
+        )
         tags = u.get_tags()
         linklist = v.LinkList(links=links, pages=pages, tags=tags, user=user)
         return render(
@@ -267,6 +323,16 @@ class GetStringSearch(Endpoint):
             ),
         )
 
+    def api_get(self, user: str, needle: str):
+        links, pages = m.User.by_slug(user).get_string_search(
+            needle=needle,
+            as_user=self.user,
+            cursor=self.cursor(),
+            ranked=flask.request.args.get("order") == "rank",
+        )
+        linklist = v.LinkList(links, [], user=user, pages=pages)
+        return self.api_ok(f"/u/{user}/search/{needle}", linklist.to_dict())
+
 
 @endpoint("/u/<string:user>/import")
 class PinboardImport(Endpoint):
@@ -288,8 +354,74 @@ class PinboardImport(Endpoint):
         file = flask.request.files["file"]
         if file.filename == "":
             raise e.BadFileUpload("no file selected")
-        u.import_pinboard_data(file.stream)
-        return self.api_ok(u.base_url())
+        job = m.ImportJob.enqueue(u, file.stream)
+        worker.wake()
+        return self.api_ok(job.url(), job.to_view().to_dict())
+
+
+@endpoint("/u/<string:user>/import/<int:job_id>")
+class GetImportJob(Endpoint):
+    def html(self, user: str, job_id: int):
+        u = self.require_authentication(user)
+        job = m.ImportJob.by_id(u, job_id)
+        return render(
+            "main",
+            v.Page(
+                title="import pinboard data",
+                content=render("import_job", job.to_view()),
+                user=self.user,
+            ),
+        )
+
+    def api_get(self, user: str, job_id: int):
+        u = self.require_authentication(user)
+        job = m.ImportJob.by_id(u, job_id)
+        return self.api_ok(job.url(), job.to_view().to_dict())
+
+
+@endpoint("/u/<string:user>/changes")
+class GetChanges(Endpoint):
+    def version(self, user: str):
+        return m.User.version_of(user)
+
+    def api_get(self, user: str):
+        u = self.require_authentication(user)
+        changes = u.get_changes(r.ChangeToken.from_args(flask.request.args))
+        return self.api_ok(f"/u/{user}/changes", changes.to_dict())
+
+
+def export(user: str, chunks: Iterator[str], mimetype: str, filename: str):
+    """
+    Stream an export as a download. The request (and its database
+    connection) lasts until the last chunk has been sent.
+    """
+    return flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{user}-{filename}"'},
+    )
+
+
+@endpoint("/u/<string:user>/export.json")
+class ExportJson(Endpoint):
+    def html(self, user: str):
+        u = self.require_authentication(user)
+        chunks = r.json_export(u.export_links())
+        return export(user, chunks, "application/json", "links.json")
+
+    def api_get(self, user: str):
+        return self.html(user)
+
+
+@endpoint("/u/<string:user>/export.html")
+class ExportHtml(Endpoint):
+    def html(self, user: str):
+        u = self.require_authentication(user)
+        chunks = r.netscape_export(u.export_links())
+        return export(user, chunks, "text/html", "bookmarks.html")
+
+    def api_get(self, user: str):
+        return self.html(user)
 
 
 @endpoint("/service-worker.js")
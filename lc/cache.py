@@ -0,0 +1,61 @@
+import collections
+import threading
+import time
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class LRUCache(Generic[K, T]):
+    """
+    A bounded mapping which forgets its least recently used entry
+    whenever it grows past `size`, and (if `ttl` is given) forgets
+    any entry that's more than `ttl` seconds old. It's safe to share
+    between threads.
+    """
+
+    def __init__(self, size: int, ttl: Optional[float] = None):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: collections.OrderedDict[K, Tuple[float, T]] = (
+            collections.OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> Optional[T]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None:
+                if time.monotonic() - entry[0] > self.ttl:
+                    del self.entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: K, value: T):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key: K):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def pop_where(self, matches: Callable[[T], bool]):
+        """Forget every entry whose value `matches`"""
+        with self.lock:
+            for key in [k for k, (_, value) in self.entries.items() if matches(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -1,11 +1,17 @@
 from dataclasses import dataclass
+import functools
+import json
 import os
+import re
 import sys
-from typing import Any
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import environ
 import flask
 import itsdangerous
+import playhouse.pool
 import playhouse.sqlite_ext
 
 
@@ -15,6 +21,163 @@ class Config:
     app_path = environ.var()
     db_path = environ.var()
     static_path = environ.var("static")
+    # the largest request body we accept (e.g. for imports), in megabytes
+    max_upload_mb = environ.var(16, converter=int)
+    # SQLite settings for every connection. WAL lets readers carry on
+    # while a write is in progress, and is safe to pair with NORMAL
+    # syncing. A negative cache size is in KiB, mmap size is in bytes,
+    # and the busy timeout is how long to wait for a lock, in ms.
+    db_journal_mode = environ.var("wal")
+    db_synchronous = environ.var("normal")
+    db_cache_size = environ.var(-64000, converter=int)
+    db_mmap_size = environ.var(256 * 1024 * 1024, converter=int)
+    db_temp_store = environ.var("memory")
+    db_busy_timeout = environ.var(5000, converter=int)
+    # if this is more than zero, keep up to this many connections open
+    # for requests to reuse (e.g. for threaded or gevent workers),
+    # waiting up to `db_pool_timeout` seconds for one to come free
+    db_pool_size = environ.var(0, converter=int)
+    db_pool_timeout = environ.var(10, converter=int)
+    # how many times to retry a write that couldn't get the write lock,
+    # and the delay to start backing off from, in ms
+    db_write_retries = environ.var(5, converter=int)
+    db_write_backoff_ms = environ.var(25, converter=int)
+    # how many verified session tokens to remember, and for how long
+    # (in seconds) before checking them and their user again
+    token_cache_size = environ.var(1024, converter=int)
+    token_cache_ttl = environ.var(300, converter=int)
+    # how new passwords are hashed: any passlib scheme, with this many
+    # rounds (zero means passlib's default). Older hashes are redone
+    # this way the next time their user logs in. Hashing happens in a
+    # pool of this many worker processes, or in the request's own
+    # thread if there are none.
+    password_scheme = environ.var("sha512_crypt")
+    password_rounds = environ.var(0, converter=int)
+    password_workers = environ.var(2, converter=int)
+    # where to keep the rendered link lists that anonymous visitors
+    # see: "memory" for each worker process to have its own, "sqlite"
+    # to share a file between them (by default, next to the database)
+    # or "" not to keep them. Up to `page_cache_size` are kept.
+    page_cache = environ.var("")
+    page_cache_size = environ.var(1000, converter=int)
+    page_cache_path = environ.var("")
+    # an import job that has been running for longer than this many
+    # seconds is taken to belong to a process that stopped, and failed
+    import_timeout = environ.var(3600, converter=int)
+    # whether to time how long each request spends running SQL,
+    # rendering each template and checking who's asking, and report
+    # that in a Server-Timing header (and a JSON line on stderr, too,
+    # with `timing_log`)
+    timing = environ.bool_var(False)
+    timing_log = environ.bool_var(False)
+    # statements that take longer than this many ms are logged to
+    # stderr along with their query plan (zero means none are), and
+    # with `query_stats` the time taken by each kind of statement is
+    # added up, for admins to see the ones that take longest
+    slow_query_ms = environ.var(0.0, converter=float)
+    query_stats = environ.bool_var(False)
+
+
+# a statement's plan is only worth asking for if it reads tables
+PLANNED = re.compile(r"\s*(SELECT|UPDATE|DELETE|INSERT|WITH)\b", re.I)
+# a list of placeholders, whose length depends on the parameters
+PLACEHOLDERS = re.compile(r"\?(\s*,\s*\?)+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """A statement, written the same way whatever its parameters were"""
+    return " ".join(PLACEHOLDERS.sub("?, ...", sql).split())
+
+
+def redact(params: Optional[tuple]) -> List[str]:
+    """Just the types of a statement's parameters, which are users' data"""
+    return [type(param).__name__ for param in params or ()]
+
+
+class QueryLog:
+    """
+    Watches the statements run on the database, if `slow_query_ms` or
+    `query_stats` asks it to, logging the slow ones and adding up how
+    long each kind of statement takes.
+    """
+
+    # how many kinds of statement to show the totals for
+    TOP = 20
+    # and how many to keep totals for at all
+    MAX_STATEMENTS = 1000
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.lock = threading.Lock()
+        # normalized statement -> (times run, total seconds)
+        self.totals: Dict[str, Tuple[int, float]] = {}
+
+    def watching(self) -> bool:
+        return self.config.slow_query_ms > 0 or self.config.query_stats
+
+    def record(self, db: Any, sql: str, params: Optional[tuple], seconds: float):
+        if self.config.query_stats:
+            statement = normalize(sql)
+            with self.lock:
+                if statement in self.totals or len(self.totals) < self.MAX_STATEMENTS:
+                    count, total = self.totals.get(statement, (0, 0.0))
+                    self.totals[statement] = (count + 1, total + seconds)
+        slow_ms = self.config.slow_query_ms
+        if slow_ms > 0 and seconds * 1000 > slow_ms:
+            endpoint = flask.request.endpoint if flask.has_request_context() else None
+            line = {
+                "slow_query": sql,
+                "params": redact(params),
+                "ms": round(seconds * 1000, 2),
+                "endpoint": endpoint,
+                "plan": self.query_plan(db, sql, params),
+            }
+            log(json.dumps(line))
+
+    @staticmethod
+    def query_plan(db: Any, sql: str, params: Optional[tuple]) -> List[str]:
+        """The steps of SQLite's plan for a statement, as far as we can tell"""
+        if not PLANNED.match(sql):
+            return []
+        try:
+            cursor = db.cursor()
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+            return [detail for (_id, _parent, _unused, detail) in cursor.fetchall()]
+        except Exception as exn:
+            return [f"no plan: {exn}"]
+
+    def top(self) -> List[Tuple[str, int, float]]:
+        """The statements which have taken longest in all, slowest first"""
+        with self.lock:
+            totals = sorted(self.totals.items(), key=lambda t: t[1][1], reverse=True)
+        return [(sql, count, seconds) for sql, (count, seconds) in totals[: self.TOP]]
+
+    def clear(self):
+        with self.lock:
+            self.totals.clear()
+
+
+class QueryLogging:
+    """Hands every statement to the app's query log, while it's watching"""
+
+    query_log: QueryLog
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        if not self.query_log.watching():
+            return super().execute_sql(sql, params, *args, **kwargs)  # type: ignore
+        start = time.perf_counter()
+        cursor = super().execute_sql(sql, params, *args, **kwargs)  # type: ignore
+        self.query_log.record(self, sql, params, time.perf_counter() - start)
+        return cursor
+
+
+class Database(QueryLogging, playhouse.sqlite_ext.SqliteExtDatabase):
+    pass
+
+
+class PooledDatabase(QueryLogging, playhouse.pool.PooledSqliteExtDatabase):
+    pass
 
 
 @dataclass
@@ -23,6 +186,7 @@ class App:
     app: flask.Flask
     db: playhouse.sqlite_ext.SqliteExtDatabase
     serializer: itsdangerous.URLSafeTimedSerializer
+    query_log: QueryLog
     per_page: int = 50
 
     @staticmethod
@@ -32,29 +196,77 @@ class App:
             __name__,
             static_folder=os.path.join(os.getcwd(), config.static_path),
         )
-        # 16MB
-        app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+        app.config["MAX_CONTENT_LENGTH"] = config.max_upload_mb * 1024 * 1024
         app.secret_key = config.secret_key
+        db: Union[Database, PooledDatabase]
+        if config.db_pool_size > 0:
+            # pooled connections get passed between threads, although
+            # only one uses a connection at a time
+            db = PooledDatabase(
+                None,
+                max_connections=config.db_pool_size,
+                timeout=config.db_pool_timeout,
+                check_same_thread=False,
+            )
+        else:
+            db = Database(None)
+        db.query_log = QueryLog(config)
         return App(
             config=config,
-            db=playhouse.sqlite_ext.SqliteExtDatabase(None),
+            db=db,
+            query_log=db.query_log,
             serializer=itsdangerous.URLSafeTimedSerializer(config.secret_key),
             app=app,
         )
 
+    def db_pragmas(self) -> Dict[str, Any]:
+        return {
+            "journal_mode": self.config.db_journal_mode,
+            "synchronous": self.config.db_synchronous,
+            "cache_size": self.config.db_cache_size,
+            "mmap_size": self.config.db_mmap_size,
+            "temp_store": self.config.db_temp_store,
+            "busy_timeout": self.config.db_busy_timeout,
+        }
+
     def init_db(self):
-        self.db.init(self.config.db_path)
+        self.db.init(self.config.db_path, pragmas=self.db_pragmas())
 
     def in_memory_db(self):
         try:
             self.db.close()
         except Exception:
             pass
-        self.db.init(":memory:")
+        self.db.init(":memory:", pragmas=self.db_pragmas())
 
     def close_db(self):
         self.db.close()
 
+    def connect_db(self):
+        """Open a connection for the current request, unless one is open"""
+        self.db.connect(reuse_if_open=True)
+
+    def release_db(self):
+        """
+        Close the current request's connection, or hand it back to the
+        pool. An in-memory database only lasts as long as its
+        connection, so that one is left open.
+        """
+        if self.db.database != ":memory:" and not self.db.is_closed():
+            self.db.close()
+
+    def forget_connections(self):
+        """
+        Drop every connection inherited from a parent process. These
+        still belong to the parent, and SQLite connections can't be
+        shared across a fork, so they're abandoned rather than closed:
+        closing one could checkpoint or remove the parent's WAL file.
+        """
+        self.db._state.reset()
+        if isinstance(self.db, playhouse.pool.PooledDatabase):
+            self.db._connections = []
+            self.db._in_use = {}
+
     def serialize_token(self, obj: Any) -> str:
         return self.serializer.dumps(obj)
 
@@ -63,6 +275,7 @@ class App:
 
 
 app = App.from_env()
+os.register_at_fork(after_in_child=app.forget_connections)
 
 if sys.stderr.isatty():
 
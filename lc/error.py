@@ -58,6 +58,17 @@ class NoSuchLink(LCException):
         return 404
 
 
+@dataclass
+class NoSuchImportJob(LCException):
+    job_id: int
+
+    def __str__(self):
+        return f"No import job '{self.job_id}' exists."
+
+    def http_code(self) -> int:
+        return 404
+
+
 @dataclass
 class BadPassword(LCException):
     name: str
@@ -140,6 +151,26 @@ class BadTagName(LCException):
         return 400
 
 
+@dataclass
+class BadCursor(LCException):
+    cursor: str
+
+    def __str__(self):
+        return f"'{self.cursor}' is not a valid page cursor."
+
+    def http_code(self) -> int:
+        return 400
+
+
+@dataclass
+class DatabaseBusy(LCException):
+    def __str__(self):
+        return "The database is too busy right now. Please try again."
+
+    def http_code(self) -> int:
+        return 503
+
+
 @dataclass
 class BadAddLink(LCException):
     message: str
@@ -160,3 +191,14 @@ class BadFileUpload(LCException):
 
     def http_code(self) -> int:
         return 400
+
+
+@dataclass
+class BadBatch(LCException):
+    message: str
+
+    def __str__(self):
+        return f"Problem with batch: {self.message}"
+
+    def http_code(self) -> int:
+        return 400
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, Union
+
+from lc.cache import LRUCache
+import lc.config as c
+import lc.view as v
+
+
+class MemoryStore:
+    """Keeps fragments in this process, forgetting the least recently used"""
+
+    name = "memory"
+
+    def __init__(self, size: int):
+        self.entries: LRUCache[str, str] = LRUCache(size=size)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.entries.get(key)
+
+    def put(self, key: str, value: str):
+        self.entries.put(key, value)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SqliteStore:
+    """
+    Keeps fragments in an SQLite file of their own, which every worker
+    process can read from. Once there are more than `size`, the ones
+    stored longest ago are forgotten: tracking reads as well would
+    make every read a write.
+    """
+
+    name = "sqlite"
+
+    # a cache that's busy isn't worth waiting long for, in seconds
+    TIMEOUT = 0.1
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.local = threading.local()
+        os.register_at_fork(after_in_child=self.forget_connections)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            # losing the cache in a crash costs nothing, so there's no
+            # need to wait for the disk
+            conn.execute("PRAGMA journal_mode = wal")
+            conn.execute("PRAGMA synchronous = off")
+            conn.execute(f"PRAGMA mmap_size = {c.app.config.db_mmap_size}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fragment "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS fragment_stored ON fragment (stored)"
+            )
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            row = (
+                self.connection()
+                .execute("SELECT value FROM fragment WHERE key = ?", (key,))
+                .fetchone()
+            )
+        except sqlite3.OperationalError:
+            return None
+        return row and row[0]
+
+    def put(self, key: str, value: str):
+        try:
+            conn = self.connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO fragment (key, value, stored) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM fragment WHERE stored < "
+                "(SELECT stored FROM fragment ORDER BY stored DESC LIMIT 1 OFFSET ?)",
+                (self.size - 1,),
+            )
+        except sqlite3.OperationalError:
+            # someone else is writing, so this one can be built again
+            # next time instead
+            pass
+
+    def clear(self):
+        self.connection().execute("DELETE FROM fragment")
+
+    def forget_connections(self):
+        """
+        Drop connections inherited from a parent process, which can't
+        be used or closed safely across a fork
+        """
+        self.local = threading.local()
+
+
+class Fragments:
+    """
+    A cache of rendered pieces of pages, counting how often it has
+    them. Which store it uses (if any) is set by `LC_PAGE_CACHE`.
+    """
+
+    def __init__(self, store: Union[MemoryStore, SqliteStore, None] = None):
+        self.store = store
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_config(config: c.Config) -> "Fragments":
+        if config.page_cache == "memory":
+            return Fragments(MemoryStore(config.page_cache_size))
+        if config.page_cache == "sqlite":
+            path = config.page_cache_path or f"{config.db_path}-pages"
+            return Fragments(SqliteStore(path, config.page_cache_size))
+        return Fragments()
+
+    def fetch(self, key: Optional[str], build: Callable[[], str]) -> str:
+        """The fragment stored under `key`, built and stored if it's missing"""
+        if self.store is None or key is None:
+            return build()
+        fragment = self.store.get(key)
+        with self.lock:
+            if fragment is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if fragment is None:
+            fragment = build()
+            self.store.put(key, fragment)
+        return fragment
+
+    def stats(self) -> Optional[v.CacheStats]:
+        if self.store is None:
+            return None
+        with self.lock:
+            return v.CacheStats(
+                store=self.store.name, hits=self.hits, misses=self.misses
+            )
+
+
+fragments = Fragments.from_config(c.app.config)
@@ -1,15 +1,26 @@
 from contextlib import contextmanager
 import datetime
-import json
-from passlib.apps import custom_app_context as pwd
 import peewee
 import playhouse.shortcuts
-from typing import Iterator, List, Optional, Tuple
-
+import playhouse.sqlite_ext
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from lc.cache import LRUCache
 import lc.config as c
 import lc.error as e
+from lc.fragments import fragments
+from lc.passwords import passwords
 import lc.request as r
 import lc.view as v
+from lc.writes import coordinator, writes
+
+# statements that take a list of ids are given at most this many at once
+CHUNK_SIZE = 500
 
 
 class Model(peewee.Model):
@@ -19,6 +30,10 @@ class Model(peewee.Model):
     def to_dict(self) -> dict:
         return playhouse.shortcuts.model_to_dict(self)
 
+    @writes
+    def save(self, *args, **kwargs):
+        return super().save(*args, **kwargs)
+
     @contextmanager
     def atomic(self):
         with c.app.db.atomic():
@@ -46,41 +61,62 @@ class User(Model):
     name = peewee.TextField(unique=True)
     passhash = peewee.TextField()
     is_admin = peewee.BooleanField(default=False)
+    # maintained by every write to this user's links
+    link_count = peewee.IntegerField(default=0)
+    public_link_count = peewee.IntegerField(default=0)
+    # goes up with every write to this user's links or tags
+    version = peewee.IntegerField(default=0)
 
     @staticmethod
     def from_request(user: r.User) -> "User":
-        passhash = pwd.hash(user.password)
+        # hashing is slow, so it's done before taking the write lock
+        return User.add(user.name, passwords.hash(user.password))
+
+    @staticmethod
+    def add(name: str, passhash: str) -> "User":
         try:
             return User.create(
-                name=user.name,
+                name=name,
                 passhash=passhash,
             )
         except peewee.IntegrityError:
-            raise e.UserExists(name=user.name)
+            raise e.UserExists(name=name)
 
     def change_password(self, req: r.PasswordChange):
-        if not pwd.verify(req.old, self.passhash):
+        if not self.authenticate(req.old):
             raise e.BadPassword(name=self.name)
-        self.passhash = pwd.hash(req.n1)
-        self.save()
+        self.passhash = passwords.hash(req.n1)
+        # this might be a snapshot from the token cache, so the other
+        # fields can be out of date and mustn't be written back
+        self.save(only=[User.passhash])
 
     @staticmethod
     def from_invite(user: r.User, token: str) -> "User":
+        return User.claim_invite(user.name, passwords.hash(user.password), token)
+
+    @staticmethod
+    @writes
+    def claim_invite(name: str, passhash: str, token: str) -> "User":
         invite = UserInvite.by_code(token)
         if invite.claimed_by is not None or invite.claimed_at is not None:
             raise e.AlreadyUsedInvite(invite=token)
-        u = User.from_request(user)
+        u = User.add(name, passhash)
         invite.claimed_at = datetime.datetime.now()
         invite.claimed_by = u
         invite.save()
         return u
 
     def authenticate(self, password: str) -> bool:
-        return pwd.verify(password, self.passhash)
+        ok, passhash = passwords.verify(password, self.passhash)
+        if ok and passhash is not None:
+            # the hash is out of date, so replace it while we can
+            self.passhash = passhash
+            self.save(only=[User.passhash])
+        return ok
 
     def set_as_admin(self):
         self.is_admin = True
-        self.save()
+        self.save(only=[User.is_admin])
 
     @staticmethod
     def login(user: r.User) -> Tuple["User", str]:
@@ -96,6 +132,48 @@ class User(Model):
             raise e.NoSuchUser(name=slug)
         return u
 
+    # verified session tokens, each mapped to a snapshot of the fields
+    # of the user it belongs to
+    TOKENS: LRUCache[str, dict] = LRUCache(
+        size=c.app.config.token_cache_size, ttl=c.app.config.token_cache_ttl
+    )
+
+    @staticmethod
+    def by_token(token: str) -> Optional["User"]:
+        """
+        Find the user that a session token belongs to, if the token is
+        valid. Both checking the token and looking up the user are
+        remembered for a while, so a user making lots of requests
+        doesn't pay for them every time. Each caller gets their own
+        copy of the user.
+        """
+        if (fields := User.TOKENS.get(token)) is None:
+            try:
+                payload = c.app.load_token(token)
+            except Exception:
+                return None
+            if not isinstance(payload, dict) or "name" not in payload:
+                return None
+            u = User.get_or_none(name=payload["name"])
+            if u is None:
+                return None
+            fields = dict(u.__data__)
+            User.TOKENS.put(token, fields)
+        return User(**fields)
+
+    @staticmethod
+    def forget_token(token: str):
+        User.TOKENS.pop(token)
+
+    def forget_tokens(self):
+        """Drop the remembered snapshots of this user, which are out of date"""
+        User.TOKENS.pop_where(lambda fields: fields["id"] == self.id)
+
+    def save(self, *args, **kwargs):
+        saved = super().save(*args, **kwargs)
+        self.forget_tokens()
+        return saved
+
     def base_url(self) -> str:
         return f"/u/{self.name}"
 
@@ -103,16 +181,153 @@ class User(Model):
         return f"/u/{self.name}/config"
 
     def get_links(
-        self, as_user: Optional["User"], page: int
+        self, as_user: Optional["User"], cursor: Optional[r.Cursor] = None
     ) -> Tuple[List[v.Link], v.Pagination]:
         query = Link.select().where(
             (Link.user == self)
             & ((self == as_user) | (Link.private == False))  # noqa: E712
         )
-        links = query.order_by(-Link.created).paginate(page, c.app.per_page)
-        link_views = [link.to_view(as_user) for link in links]
-        pagination = v.Pagination.from_total(page, query.count())
-        return link_views, pagination
+        return Link.paginate(query, as_user, cursor, total=self.visible_links(as_user))
+
+    def visible_links(self, as_user: Optional["User"]) -> int:
+        if as_user is not None and as_user.id == self.id:
+            return self.link_count
+        return self.public_link_count
+
+    def count_links(self, private: bool, delta: int):
+        """Adjust this user's link counters by `delta` links"""
+        User.update(
+            link_count=User.link_count + delta,
+            public_link_count=User.public_link_count + (0 if private else delta),
+        ).where(User.id == self.id).execute()
+        self.forget_tokens()
+
+    @writes
+    def touch(self) -> int:
+        """
+        Note that this user's links or tags have changed, returning
+        their new version
+        """
+        User.update(version=User.version + 1).where(User.id == self.id).execute()
+        self.forget_tokens()
+        return User.select(User.version).where(User.id == self.id).scalar()
+
+    @staticmethod
+    def version_of(name: str) -> Optional[str]:
+        """
+        The current version of a user's links and tags, which differs
+        from every earlier one, or None if there's no such user
+        """
+        found = (
+            User.select(User.id, User.version).where(User.name == name).tuples().first()
+        )
+        return found and f"{found[0]}.{found[1]}"
+
+    @staticmethod
+    def all_versions() -> str:
+        """The current version of everyone's links and tags"""
+        total = User.select(peewee.fn.SUM(User.version)).scalar()
+        return str(total or 0)
+
+    def export_links(self) -> Iterator[r.PinboardLink]:
+        """
+        Every one of this user's links, oldest first, as they would be
+        in a Pinboard export. Links are read CHUNK_SIZE at a time, each
+        chunk seeking past the last one, so memory use doesn't grow with
+        the number of links and no read is left open in between.
+        """
+        query = (
+            Link.select(
+                Link.id,
+                Link.url,
+                Link.name,
+                Link.description,
+                Link.private,
+                Link.created,
+            )
+            .where(Link.user == self)
+            .order_by(Link.created, Link.id)
+            .limit(CHUNK_SIZE)
+        )
+        chunk = list(query)
+        while chunk:
+            tag_names = Link.tag_names([link.id for link in chunk])
+            for link in chunk:
+                yield r.PinboardLink(
+                    href=link.url,
+                    description=link.name,
+                    extended=link.description,
+                    time=link.created,
+                    shared=not link.private,
+                    tags=tag_names[link.id],
+                )
+            last = chunk[-1]
+            # a row value comparison, unlike the equivalent OR, lets
+            # SQLite seek straight to the next chunk in the index
+            chunk = list(
+                query.where(
+                    peewee.Tuple(Link.created, Link.id)
+                    > (Link.created.db_value(last.created), last.id)
+                )
+            )
+
+    # how many changes to send at once
+    CHANGES_BATCH = 200
+
+    def get_changes(self, since: r.ChangeToken) -> v.Changes:
+        """
+        The links that have been added, edited or deleted after the
+        change `since`, up to CHANGES_BATCH of them. Changes are in the
+        order of the versions of this user's links that they made (and
+        then of link id), so the last one sent is where the next batch
+        picks up. That's also the order to apply them in, since SQLite
+        can give a new link the id of one that was just deleted.
+        """
+        position = (since.revision, since.id)
+        links = list(
+            Link.select()
+            .where(
+                (Link.user == self) & (peewee.Tuple(Link.revision, Link.id) > position)
+            )
+            .order_by(Link.revision, Link.id)
+            .limit(User.CHANGES_BATCH + 1)
+        )
+        deleted = list(
+            DeletedLink.select()
+            .where(
+                (DeletedLink.user == self)
+                & (peewee.Tuple(DeletedLink.revision, DeletedLink.link_id) > position)
+            )
+            .order_by(DeletedLink.revision, DeletedLink.link_id)
+            .limit(User.CHANGES_BATCH + 1)
+        )
+
+        def change_position(change) -> Tuple[int, int]:
+            if isinstance(change, DeletedLink):
+                return (change.revision, change.link_id)
+            return (change.revision, change.id)
+
+        changes = sorted(links + deleted, key=change_position)
+        batch = changes[: User.CHANGES_BATCH]
+        if batch:
+            since = r.ChangeToken(*change_position(batch[-1]))
+        tag_names = Link.tag_names(
+            [link.id for link in batch if isinstance(link, Link)]
+        )
+        return v.Changes(
+            changes=[
+                (
+                    v.LinkChange("delete", change.link_id)
+                    if isinstance(change, DeletedLink)
+                    else v.LinkChange(
+                        "upsert", change.id, change.to_change(tag_names[change.id])
+                    )
+                )
+                for change in batch
+            ],
+            next=since.encode(),
+            more=len(changes) > len(batch),
+        )
 
     def get_link(self, link_id: int) -> "Link":
         try:
@@ -137,47 +352,213 @@ class User(Model):
                 )
                 for ui in UserInvite.select().where(UserInvite.created_by == self)
             ]
-            admin_pane = v.AdminPane(invites=user_invites)
+            queries = None
+            if c.app.config.query_stats:
+                queries = v.QueryStats(
+                    statements=[
+                        v.QueryStat(statement=sql, count=count, total_ms=seconds * 1000)
+                        for sql, count, seconds in c.app.query_log.top()
+                    ]
+                )
+            admin_pane = v.AdminPane(
+                invites=user_invites,
+                writes=coordinator.stats(),
+                fragments=fragments.stats(),
+                queries=queries,
+            )
         return v.Config(username=self.name, admin_pane=admin_pane, msg=status_msg)
 
-    def import_pinboard_data(self, stream):
-        try:
-            links = json.load(stream)
-        except json.decoder.JSONDecodeError:
-            raise e.BadFileUpload("could not parse file as JSON")
-
-        if not isinstance(links, list):
-            raise e.BadFileUpload("expected a list")
+    def import_pinboard_data(
+        self,
+        stream,
+        progress: Optional[Callable[[v.ImportStats], None]] = None,
+    ) -> v.ImportStats:
+        """
+        Import a Pinboard JSON export. The export is parsed as it's
+        read, and written a batch at a time, so memory use doesn't grow
+        with the size of the file. Each batch is committed on its own,
+        so other writers aren't locked out for the length of a big
+        import; if a batch fails, the batches before it stay imported,
+        and running the import again will skip over them. If
+        `progress` is given, it's called with the running totals after
+        every batch.
+        """
+        start = time.monotonic()
+        links = (r.PinboardLink.from_export(x) for x in r.iter_json_array(stream))
+        stats = v.ImportStats(imported=0, skipped=0, seconds=0.0)
+        for batch in peewee.chunked(links, Link.IMPORT_BATCH):
+            for link in batch:
+                for tag_name in link.tags:
+                    if not Tag.is_valid_tag_name(tag_name):
+                        raise e.BadTagName(tag_name)
+            added = self.import_links(batch)
+            stats.imported += added
+            stats.skipped += len(batch) - added
+            stats.seconds = time.monotonic() - start
+            if progress:
+                progress(stats)
+
+        stats.seconds = time.monotonic() - start
+        c.log(
+            f"imported {stats.imported} links for {self.name} "
+            f"in {stats.seconds:.2f}s ({stats.rate():.0f} links/s)"
+        )
+        return stats
 
-        # create and (for this session) cache the tags
-        tags = {}
+    @writes
+    def import_links(self, links: List[r.PinboardLink]) -> int:
+        """
+        Add a batch of imported links using a fixed number of set-based
+        statements, skipping any that this user already has. Returns
+        the number of links actually added.
+        """
+        seen = set(
+            Link.select(Link.url, Link.created)
+            .where(
+                (Link.user == self)
+                & Link.url.in_(list({link.href for link in links}))  # type: ignore
+            )
+            .tuples()
+        )
+        new = []
         for link in links:
-            if "tags" not in link:
-                raise e.BadFileUpload("missing key {exn.args[0]}")
-            for t in link["tags"].split():
-                if t in tags:
-                    continue
-
-                tags[t] = Tag.get_or_create_tag(self, t)
-
-        with self.atomic():
-            for link in links:
-                try:
-                    time = datetime.datetime.strptime(
-                        link["time"], "%Y-%m-%dT%H:%M:%SZ"
-                    )
-                    ln = Link.create(
-                        url=link["href"],
-                        name=link["description"],
-                        description=link["extended"],
-                        private=link["shared"] == "no",
-                        created=time,
-                        user=self,
-                    )
-                except KeyError as exn:
-                    raise e.BadFileUpload(f"missing key {exn.args[0]}")
-                for t in link["tags"].split():
-                    HasTag.get_or_create(link=ln, tag=tags[t])
+            if (link.href, link.time) not in seen:
+                seen.add((link.href, link.time))
+                new.append(link)
+        if not new:
+            return 0
+
+        tag_ids = Tag.get_or_create_tags(
+            self, {tag_name for link in new for tag_name in link.tags}
+        )
+        revision, now = self.touch(), datetime.datetime.now()
+
+        # rows are only ever appended with new ids, and we're holding
+        # the write lock, so every link past this id is one of ours
+        last_id = Link.select(peewee.fn.MAX(Link.id)).scalar() or 0
+        Link.insert_many(
+            [
+                {
+                    "url": link.href,
+                    "name": link.description,
+                    "description": link.extended,
+                    "private": not link.shared,
+                    "created": link.time,
+                    "modified": now,
+                    "revision": revision,
+                    "user": self.id,
+                }
+                for link in new
+            ]
+        ).execute()
+        added = (Link.user == self) & (Link.id > last_id)
+        link_ids = {
+            (url, created): id
+            for id, url, created in Link.select(Link.id, Link.url, Link.created)
+            .where(added)
+            .tuples()
+        }
+
+        hastags = [
+            (link_ids[(link.href, link.time)], tag_id)
+            for link in new
+            for tag_id in {
+                tag_ids[name]
+                for tag_name in link.tags
+                for name in Tag.family_names(tag_name)
+            }
+        ]
+        for chunk in peewee.chunked(hastags, CHUNK_SIZE):
+            HasTag.insert_many(
+                chunk, fields=[HasTag.link, HasTag.tag]
+            ).on_conflict_ignore().execute()
+
+        # the counts derived from the new tags are cheapest to find in SQL
+        totals, public = {}, {}
+        for tag_id, total, shared in (
+            HasTag.select(
+                HasTag.tag,
+                peewee.fn.COUNT(HasTag.id),
+                peewee.fn.SUM(Link.private == False),  # noqa: E712
+            )
+            .join(Link)
+            .where(added)
+            .group_by(HasTag.tag)
+            .tuples()
+        ):
+            totals[tag_id], public[tag_id] = total, shared
+        Tag.add_link_counts(totals, public)
+        TagPair.add_links(added)
+
+        shared = sum(link.shared for link in new)
+        self.count_links(private=False, delta=shared)
+        self.count_links(private=True, delta=len(new) - shared)
+        LinkIndex.reindex(list(link_ids.values()))
+        return len(new)
+
+    @writes
+    def apply_batch(self, batch: r.LinkBatch) -> v.BatchResults:
+        """
+        Create, update and delete many links in one transaction. The
+        tags that all the operations use are found or created up
+        front, and tags left unused are cleaned up once at the end.
+        Each operation gets a savepoint of its own, so one that fails
+        is undone and reported without holding up the rest.
+        """
+        tag_ids = Tag.get_or_create_tags(
+            self,
+            {
+                tag_name
+                for op in batch.operations
+                if op.link is not None
+                for tag_name in op.link.tags
+                if Tag.is_valid_tag_name(tag_name)
+            },
+        )
+        revision = self.touch()
+
+        # tags that were made for an operation that then failed need
+        # cleaning up too
+        unused = set(tag_ids.values())
+        results = []
+        for op in batch.operations:
+            try:
+                with self.atomic():
+                    link_id, removed = self.apply_operation(op, tag_ids, revision)
+            except e.LCException as exn:
+                results.append(
+                    v.BatchResult(op=op.op, id=op.id, ok=False, error=str(exn))
+                )
+                continue
+            unused.update(removed)
+            results.append(v.BatchResult(op=op.op, id=link_id, ok=True))
+
+        for chunk in peewee.chunked(unused, CHUNK_SIZE):
+            Tag.clean(chunk)
+        return v.BatchResults(results=results)
+
+    def apply_operation(
+        self, op: r.LinkOperation, tag_ids: Dict[str, int], revision: int
+    ) -> Tuple[int, List[int]]:
+        """
+        Carry out one operation from a batch, returning the id of the
+        link it was on and the ids of any tags it took off links
+        """
+        # LinkOperation has checked that each kind of operation has the
+        # id or link that it needs
+        if op.op == "delete":
+            assert op.id is not None
+            link = self.get_link(op.id)
+            return link.id, link.remove(self, revision)
+        assert op.link is not None
+        for tag_name in op.link.tags:
+            if not Tag.is_valid_tag_name(tag_name):
+                raise e.BadTagName(tag_name)
+        if op.op == "create":
+            return Link.add(self, op.link, tag_ids, revision).id, []
+        assert op.id is not None
+        link = self.get_link(op.id)
+        return link.id, link.edit(self, op.link, tag_ids, revision)
 
     def get_tags(self) -> List[v.Tag]:
         return sorted(
@@ -185,38 +566,62 @@ class User(Model):
             key=lambda t: t.name.upper(),
         )
 
-    def get_related_tags(self, tag: "Tag") -> List[v.Tag]:
-        # SELECT * from has_tag t1, has_tag t2, link l
-        #   WHERE t1.link_id == l.id AND t2.link_id == l.id
-        #   AND t1.id != t2.id AND t1 = self
-        SelfTag = HasTag.alias()
+    def get_related_tags(self, tag: "Tag", limit: Optional[int] = None) -> List[v.Tag]:
+        """
+        The tags that most often appear on the same links as `tag`,
+        most frequent first
+        """
         query = (
-            HasTag.select(HasTag.tag)
-            .join(Link, on=(HasTag.link == Link.id))
-            .join(SelfTag, on=(SelfTag.link == Link.id))
-            .where((SelfTag.tag == tag) & (SelfTag.id != HasTag.id))
-            .group_by(HasTag.tag)
-        )
-        return sorted(
-            (t.tag.to_view() for t in query),
-            key=lambda t: t.name,
+            Tag.select(Tag.name)
+            .join(TagPair, on=(TagPair.other == Tag.id))
+            .where(TagPair.tag == tag)
+            .order_by(-TagPair.count, Tag.name)
         )
+        if limit is not None:
+            query = query.limit(limit)
+        return [v.Tag(url=f"{self.base_url()}/t/{t.name}", name=t.name) for t in query]
 
     def get_string_search(
-        self, needle: str, as_user: Optional["User"], page: int
+        self,
+        needle: str,
+        as_user: Optional["User"],
+        cursor: Optional[r.Cursor] = None,
+        ranked: bool = False,
     ) -> Tuple[List[v.Link], v.Pagination]:
         """
-        Find all links that contain the string `needle` somewhere in their URL or title
+        Find all links whose URL, title, description or tags match the
+        search `needle`. Words in the needle must all appear, words
+        ending in `*` match as prefixes, and "quoted words" must appear
+        as a phrase. Normally results come newest-first, but with
+        `ranked` we instead return the best matches by BM25.
         """
+        visible = (Link.user == self) & (
+            (self == as_user) | (Link.private == False)  # noqa: E712
+        )
+        matches = LinkIndex.match(LinkIndex.to_query(needle))
+        # the full-text index has to be searched once, up front: joined
+        # to the user's links, SQLite would rather walk those and run
+        # the search again for every one of them
         query = Link.select().where(
-            (Link.user == self)
-            & ((self == as_user) | (Link.private == False))  # noqa: E712
-            & (Link.name.contains(needle) | Link.description.contains(needle))
+            visible
+            & Link.id.in_(LinkIndex.select(LinkIndex.rowid).where(matches))  # type: ignore
         )
-        links = query.order_by(-Link.created).paginate(page, c.app.per_page)
-        link_views = [link.to_view(as_user) for link in links]
-        pagination = v.Pagination.from_total(page, query.count())
-        return link_views, pagination
+        if ranked:
+            # ranking needs the search in the same query, so this one
+            # starts from the index and looks up the link for each match
+            best = (
+                Link.select(Link, User)
+                .from_(LinkIndex)
+                .join_from(LinkIndex, Link, on=(Link.id == LinkIndex.rowid))
+                .join_from(Link, User)
+                .where(visible & matches)
+                .order_by(LinkIndex.ranking())
+            )
+            return (
+                Link.to_views(best.limit(c.app.per_page), as_user),
+                v.Pagination(total=query.count()),
+            )
+        return Link.paginate(query, as_user, cursor, total=query.count())
 
 
 class Link(Model):
@@ -227,12 +632,30 @@ class Link(Model):
     url = peewee.TextField()
     name = peewee.TextField()
     description = peewee.TextField()
-    # TODO: do we need to track modified time?
     created = peewee.DateTimeField()
+    # when the link (or its tags) last changed, and the version of its
+    # user's links that the change made
+    modified = peewee.DateTimeField(default=datetime.datetime.now)
+    revision = peewee.IntegerField(default=0)
     # is the field entirely private?
     private = peewee.BooleanField()
-    # owned by
-    user = peewee.ForeignKeyField(User, backref="links")
+    # owned by (indexed along with `created`, below)
+    user = peewee.ForeignKeyField(User, backref="links", index=False)
+    # peewee also gives us the owner's id without fetching the owner
+    user_id: int
+
+    class Meta:
+        indexes = (
+            # a user's links, newest first
+            (("user", "created"), False),
+            # everyone's public links, newest first
+            (("private", "created"), False),
+            # a user's links in the order they last changed
+            (("user", "revision"), False),
+        )
+
+    # imports are written this many links at a time
+    IMPORT_BATCH = 1000
 
     def link_url(self) -> str:
         return f"/u/{self.user.name}/l/{self.id}"
@@ -243,79 +666,270 @@ class Link(Model):
 
     @staticmethod
     def get_all(
-        as_user: Optional[User], page: int
-    ) -> Tuple[List["Link"], v.Pagination]:
-        links = (
-            Link.select()
-            .where((Link.user == as_user) | (Link.private == False))  # noqa: E712
-            .order_by(-Link.created)
-            .paginate(page, c.app.per_page)
-        )
-        link_views = [link.to_view(as_user) for link in links]
-        pagination = v.Pagination.from_total(page, Link.select().count())
-        return link_views, pagination
+        as_user: Optional[User], cursor: Optional[r.Cursor] = None
+    ) -> Tuple[List[v.Link], v.Pagination]:
+        # every user's public links, plus our own private ones. These
+        # are fetched separately so that each can be read in order
+        # from an index, rather than sorting everything that matches
+        # either one.
+        queries = [Link.select().where(Link.private == False)]  # noqa: E712
+        total = User.select(peewee.fn.SUM(User.public_link_count)).scalar() or 0
+        if as_user is not None:
+            queries.append(
+                Link.select().where(
+                    (Link.user == as_user) & (Link.private == True)  # noqa: E712
+                )
+            )
+            # the user may have come from the token cache, whose copy
+            # of the counters another process could have changed since
+            total += (
+                User.select(User.link_count - User.public_link_count)
+                .where(User.id == as_user.id)
+                .scalar()
+                or 0
+            )
+        return Link.paginate(queries, as_user, cursor, total=total)
 
     @staticmethod
+    def paginate(
+        query, as_user: Optional[User], cursor: Optional[r.Cursor], total: int
+    ) -> Tuple[List[v.Link], v.Pagination]:
+        """
+        Fetch the page of `query` indicated by `cursor`. Links are
+        ordered newest-first by (created, id), and the page is found by
+        seeking to the cursor rather than with an OFFSET, so deep pages
+        are as cheap to fetch as the first one. `query` can also be a
+        list of queries for links that don't overlap, in which case
+        the page is made up from all of them.
+        """
+        per_page = c.app.per_page
+        # a `before` cursor without a position asks for the last page
+        created, link_id = (cursor.created, cursor.id) if cursor else (None, None)
+        seek = None
+        if cursor is None or not cursor.before:
+            newest_first = True
+            order = (-Link.created, -Link.id)
+            if created is not None and link_id is not None:
+                seek = (Link.created < created) | (
+                    (Link.created == created) & (Link.id < link_id)
+                )
+        else:
+            newest_first = False
+            order = (Link.created, Link.id)
+            if created is not None and link_id is not None:
+                seek = (Link.created > created) | (
+                    (Link.created == created) & (Link.id > link_id)
+                )
+
+        queries = query if isinstance(query, list) else [query]
+        links = []
+        for query in queries:
+            query = Link.with_owners(query)
+            if seek is not None:
+                query = query.where(seek)
+            links.extend(query.order_by(*order).limit(per_page + 1))
+        if len(queries) > 1:
+            links.sort(key=lambda link: (link.created, link.id), reverse=newest_first)
+            links = links[: per_page + 1]
+
+        # there are more links past the end of the page if we fetched
+        # any extra, and before its start if we seeked to get there
+        if newest_first:
+            has_older, has_newer = len(links) > per_page, seek is not None
+            links = links[:per_page]
+        else:
+            has_older, has_newer = seek is not None, len(links) > per_page
+            links = links[:per_page][::-1]
+
+        pagination = v.Pagination(total=total)
+        if links and has_newer:
+            pagination.before = r.Cursor.encode(links[0].created, links[0].id)
+        if links and has_older:
+            pagination.after = r.Cursor.encode(links[-1].created, links[-1].id)
+        return Link.to_views(links, as_user), pagination
+
+    @staticmethod
+    @writes
     def from_request(user: User, link: r.Link) -> "Link":
+        tag_ids = Tag.get_or_create_tags(user, link.tags)
+        return Link.add(user, link, tag_ids, user.touch())
+
+    @staticmethod
+    def add(user: User, link: r.Link, tag_ids: Dict[str, int], revision: int) -> "Link":
+        """
+        Create a link, given the ids of its tags by name and the
+        version of the user's links that this makes
+        """
         new_link = Link.create(
             url=link.url,
             name=link.name,
             description=link.description,
             private=link.private,
             created=link.created or datetime.datetime.now(),
+            revision=revision,
             user=user,
         )
-        for tag_name in link.tags:
-            tag = Tag.get_or_create_tag(user, tag_name)
-            HasTag.get_or_create(link=new_link, tag=tag)
+        user.count_links(new_link.private, 1)
+        HasTag.add_tags(new_link, [tag_ids[tag_name] for tag_name in link.tags])
+        LinkIndex.reindex([new_link.id])
         return new_link
 
+    @writes
     def update_from_request(self, user: User, link: r.Link):
-        with self.atomic():
-            req_tags = set(link.tags)
+        tag_ids = Tag.get_or_create_tags(user, link.tags)
+        Tag.clean(self.edit(user, link, tag_ids, user.touch()))
 
-            for hastag in self.tags:  # type: ignore
-                name = hastag.tag.name
-                if name not in req_tags:
-                    hastag.delete_instance()
-                else:
-                    req_tags.remove(name)
+    def edit(
+        self, user: User, link: r.Link, tag_ids: Dict[str, int], revision: int
+    ) -> List[int]:
+        """
+        Update this link, given the ids of its tags by name and the
+        version of the user's links that this makes. Returns the ids
+        of the tags it no longer has, which may now need cleaning up.
+        """
+        req_tags = set(link.tags)
+
+        removed, before = [], []
+        for hastag in HasTag.select(HasTag, Tag).join(Tag).where(HasTag.link == self):
+            name = hastag.tag.name
+            before.append(hastag.tag_id)
+            if name not in req_tags:
+                removed.append(hastag.tag_id)
+            else:
+                req_tags.remove(name)
+
+        HasTag.delete().where(
+            (HasTag.link == self) & HasTag.tag.in_(removed)  # type: ignore
+        ).execute()
+        Tag.count_links(removed, self.private, -1)
+        TagPair.count_pairs(removed, before, -1)
+
+        HasTag.add_tags(self, [tag_ids[tag_name] for tag_name in req_tags])
+
+        if link.private != self.private:
+            # the link moves between the public and private counts
+            current = [ht.tag_id for ht in self.tags]  # type: ignore
+            for private, delta in ((self.private, -1), (link.private, 1)):
+                user.count_links(private, delta)
+                Tag.count_links(current, private, delta)
+
+        self.url = link.url
+        self.name = link.name
+        self.description = link.description
+        self.private = link.private
+        self.modified = datetime.datetime.now()
+        self.revision = revision
+        self.save()
+        LinkIndex.reindex([self.id])
+        return removed
 
-            for tag_name in req_tags:
-                t = Tag.get_or_create_tag(user, tag_name)
-                HasTag.get_or_create(link=self, tag=t)
+    @staticmethod
+    def with_owners(query):
+        """
+        Join the owning user into a query over links, so that building
+        views of the results doesn't need to fetch each owner separately
+        """
+        return query.select_extend(User).join_from(Link, User)
 
-            Tag.clean()
+    @staticmethod
+    def to_views(links, as_user: Optional[User]) -> List[v.Link]:
+        """
+        Build the views for a whole page of links. The tags for every
+        link on the page are fetched in a single query, so the number
+        of queries doesn't depend on the number of links.
+        """
+        links = list(links)
+        tag_names = Link.tag_names([link.id for link in links])
+        return [link.build_view(as_user, tag_names[link.id]) for link in links]
 
-            self.url = link.url
-            self.name = link.name
-            self.description = link.description
-            self.private = link.private
-            self.save()
+    @staticmethod
+    def tag_names(link_ids: List[int]) -> Dict[int, List[str]]:
+        """The names of each link's tags, in the order they were added"""
+        tag_names: Dict[int, List[str]] = {link_id: [] for link_id in link_ids}
+        if tag_names:
+            query = (
+                HasTag.select(HasTag.link, Tag.name)
+                .join(Tag)
+                .where(HasTag.link.in_(link_ids))  # type: ignore
+                .order_by(HasTag.link, HasTag.id)
+                .tuples()
+            )
+            for link_id, name in query:
+                tag_names[link_id].append(name)
+        return tag_names
 
     def to_view(self, as_user: Optional[User]) -> v.Link:
+        return Link.to_views([self], as_user)[0]
+
+    def build_view(self, as_user: Optional[User], tag_names: List[str]) -> v.Link:
         return v.Link(
             id=self.id,
             url=self.url,
             name=self.name,
             description=self.description,
             private=self.private,
-            tags=self.get_tags_view(),
+            tags=[
+                v.Tag(url=f"/u/{self.user.name}/t/{name}", name=name)
+                for name in tag_names
+            ],
             created=self.created.strftime("%Y-%m-%d"),
-            is_mine=self.user.id == as_user.id if as_user else False,
+            is_mine=self.user_id == as_user.id if as_user else False,
             link_url=self.link_url(),
             user=self.user.name,
         )
 
-    def get_tags_view(self) -> List[v.Tag]:
-        return [
-            v.Tag(url=f"/u/{self.user.name}/t/{ht.tag.name}", name=ht.tag.name)
-            for ht in HasTag().select(Tag.name).join(Tag).where(HasTag.link == self)
-        ]
+    def to_change(self, tag_names: List[str]) -> v.ChangedLink:
+        return v.ChangedLink(
+            id=self.id,
+            url=self.url,
+            name=self.name,
+            description=self.description,
+            private=self.private,
+            tags=tag_names,
+            created=self.created.isoformat(),
+            modified=self.modified.isoformat(),
+        )
 
+    @writes
     def full_delete(self):
+        user = User.get_by_id(self.user_id)
+        Tag.clean(self.remove(user, user.touch()))
+
+    def remove(self, user: User, revision: int) -> List[int]:
+        """
+        Delete this link, leaving a tombstone marked with the version
+        of the user's links that this makes. Returns the ids of the
+        tags it had, which may now need cleaning up.
+        """
+        tag_ids = [ht.tag_id for ht in self.tags]  # type: ignore
+        Tag.count_links(tag_ids, self.private, -1)
+        TagPair.count_pairs(tag_ids, tag_ids, -1)
+        user.count_links(self.private, -1)
+        DeletedLink.create(
+            user=user,
+            link_id=self.id,
+            revision=revision,
+            deleted=datetime.datetime.now(),
+        )
         self.delete_instance(recursive=True)
-        Tag.clean()
+        LinkIndex.delete().where(LinkIndex.rowid == self.id).execute()
+        return tag_ids
+
+
+class DeletedLink(Model):
+    """
+    A link that has been deleted, kept so that clients syncing a
+    user's changes find out about it
+    """
+
+    user = peewee.ForeignKeyField(User, backref="deleted_links", index=False)
+    link_id = peewee.IntegerField()
+    deleted = peewee.DateTimeField()
+    # the version of its user's links that deleting it made
+    revision = peewee.IntegerField()
+
+    class Meta:
+        indexes = ((("user", "revision", "link_id"), False),)
 
 
 class Tag(Model):
@@ -325,37 +939,66 @@ class Tag(Model):
 
     name = peewee.TextField()
     parent = peewee.ForeignKeyField("self", null=True, backref="children")
-    user = peewee.ForeignKeyField(User, backref="tags")
+    user = peewee.ForeignKeyField(User, backref="tags", index=False)
+    user_id: int
+    # maintained alongside the HasTag rows that point at this tag
+    link_count = peewee.IntegerField(default=0)
+    public_link_count = peewee.IntegerField(default=0)
+
+    class Meta:
+        indexes = ((("user", "name"), False),)
 
     def url(self) -> str:
         return f"/u/{self.user.name}/t/{self.name}"
 
     def get_links(
-        self, as_user: Optional[User], page: int
-    ) -> Tuple[List[Link], v.Pagination]:
-        query = (
-            HasTag.select()
-            .join(Link)
-            .where(
-                (HasTag.tag == self)
-                & (
-                    (HasTag.link.user == as_user)
-                    | (HasTag.link.private == False)  # noqa: E712
-                )
-            )
-        )
-        links = [
-            ht.link.to_view(as_user)
-            for ht in query.order_by(-Link.created).paginate(page, c.app.per_page)
-        ]
-        pagination = v.Pagination.from_total(page, query.count())
-        return links, pagination
+        self, as_user: Optional[User], cursor: Optional[r.Cursor] = None
+    ) -> Tuple[List[v.Link], v.Pagination]:
+        query = Link.select().join(HasTag).where(HasTag.tag == self)
+        if as_user is not None and as_user.id == self.user_id:
+            total = self.link_count
+        else:
+            query = query.where(Link.private == False)  # noqa: E712
+            total = self.public_link_count
+        return Link.paginate(query, as_user, cursor, total=total)
+
+    @staticmethod
+    def count_links(tag_ids: List[int], private: bool, delta: int):
+        """Adjust the link counters of the given tags by `delta` links"""
+        Tag.update(
+            link_count=Tag.link_count + delta,
+            public_link_count=Tag.public_link_count + (0 if private else delta),
+        ).where(
+            Tag.id.in_(tag_ids)  # type: ignore
+        ).execute()
+
+    @staticmethod
+    def add_link_counts(totals: Dict[int, int], public: Dict[int, int]):
+        """
+        Add to the link counters of many tags at once, given the number
+        of links and of public links that each tag id has gained
+        """
+        # tags that gained the same numbers of links share an update
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for tag_id, total in totals.items():
+            groups.setdefault((total, public.get(tag_id, 0)), []).append(tag_id)
+        for (total, shared), tag_ids in groups.items():
+            for chunk in peewee.chunked(tag_ids, CHUNK_SIZE):
+                Tag.update(
+                    link_count=Tag.link_count + total,
+                    public_link_count=Tag.public_link_count + shared,
+                ).where(
+                    Tag.id.in_(chunk)  # type: ignore
+                ).execute()
 
     def get_family(self) -> Iterator["Tag"]:
-        yield self
-        p = self
-        while p := p.parent:
-            yield p
+        """This tag followed by each of its ancestors, nearest first"""
+        yield from (
+            Tag.select()
+            .join(TagClosure, on=(TagClosure.ancestor == Tag.id))
+            .where(TagClosure.descendant == self)
+            .order_by(TagClosure.depth)
+        )
 
     BAD_TAG_CHARS = set("{}\\#")
 
@@ -363,33 +1006,148 @@ class Tag(Model):
     def is_valid_tag_name(tag_name: str) -> bool:
         return all((c not in Tag.BAD_TAG_CHARS for c in tag_name))
 
+    @staticmethod
+    def family_names(tag_name: str) -> List[str]:
+        """
+        The names of a tag and all its ancestors, from the root down: every
+        prefix of a hierarchical tag is its own tag
+        """
+        names = [tag_name[:i] for i, ch in enumerate(tag_name) if ch == "/"]
+        names.append(tag_name)
+        return names
+
     @staticmethod
     def get_or_create_tag(user: User, tag_name: str) -> "Tag":
-        if t := Tag.get_or_none(name=tag_name, user=user):
-            return t
+        # fetch whichever of the tag's family already exist all at once
+        names = Tag.family_names(tag_name)
+        existing = {
+            t.name: t
+            for t in Tag.select().where(
+                (Tag.user == user) & Tag.name.in_(names)  # type: ignore
+            )
+        }
+        if tag_name in existing:
+            return existing[tag_name]
 
         if not Tag.is_valid_tag_name(tag_name):
             raise e.BadTagName(tag_name)
 
-        parent = None
-        if "/" in tag_name:
-            parent_name = tag_name[: tag_name.rindex("/")]
-            parent = Tag.get_or_create_tag(user, parent_name)
+        family: List[Tag] = []
+        for name in names:
+            tag = existing.get(name)
+            if tag is None:
+                parent = family[-1] if family else None
+                tag = Tag.create(name=name, parent=parent, user=user)
+                TagClosure.add_tag(tag, family)
+            family.append(tag)
+        return family[-1]
 
-        return Tag.create(name=tag_name, parent=parent, user=user)
+    @staticmethod
+    def get_or_create_tags(user: User, tag_names: Iterable[str]) -> Dict[str, int]:
+        """
+        Make sure the user has all the given tags, along with all of
+        their ancestors, and return the ids of all of them by name. New
+        tags are created a whole level of the hierarchy at a time.
+        """
+        wanted = {name for tag_name in tag_names for name in Tag.family_names(tag_name)}
+        ids: Dict[str, int] = {}
+        for chunk in peewee.chunked(wanted, CHUNK_SIZE):
+            ids.update(
+                Tag.select(Tag.name, Tag.id)
+                .where((Tag.user == user) & Tag.name.in_(chunk))  # type: ignore
+                .tuples()
+            )
+
+        levels: Dict[int, List[str]] = {}
+        for name in wanted - ids.keys():
+            if not Tag.is_valid_tag_name(name):
+                raise e.BadTagName(name)
+            levels.setdefault(len(Tag.family_names(name)), []).append(name)
+
+        for depth in sorted(levels):
+            names = levels[depth]
+            for chunk in peewee.chunked(names, CHUNK_SIZE):
+                Tag.insert_many(
+                    [
+                        {
+                            "name": name,
+                            "parent": (
+                                ids[Tag.family_names(name)[-2]] if depth > 1 else None
+                            ),
+                            "user": user.id,
+                        }
+                        for name in chunk
+                    ]
+                ).execute()
+                ids.update(
+                    Tag.select(Tag.name, Tag.id)
+                    .where((Tag.user == user) & Tag.name.in_(chunk))  # type: ignore
+                    .tuples()
+                )
+            closure = [
+                {"ancestor": ids[ancestor], "descendant": ids[name], "depth": depth - i}
+                for name in names
+                for i, ancestor in enumerate(Tag.family_names(name), 1)
+            ]
+            for chunk in peewee.chunked(closure, CHUNK_SIZE):
+                TagClosure.insert_many(chunk).execute()
+        return ids
 
     def to_view(self) -> v.Tag:
         return v.Tag(url=self.url(), name=self.name)
 
     @staticmethod
-    def clean():
-        unused = (
-            Tag.select(Tag.id)  # type: ignore
-            .join(HasTag, peewee.JOIN.LEFT_OUTER)
-            .group_by(Tag.name)
-            .having(peewee.fn.COUNT(HasTag.id) == 0)
+    def unused():
+        """
+        A condition on tags which holds when no link is tagged with
+        the tag or with any of its descendants
+        """
+        in_use = (
+            TagClosure.select(TagClosure.id)
+            .join(HasTag, on=(HasTag.tag == TagClosure.descendant))
+            .where(TagClosure.ancestor == Tag.id)
         )
-        Tag.delete().where(Tag.id.in_(unused)).execute()  # type: ignore
+        return ~peewee.fn.EXISTS(in_use)
+
+    @staticmethod
+    def clean(tag_ids: List[int]):
+        """
+        Delete whichever of the given tags, or of their ancestors, are
+        no longer used by any link. This should be called with the
+        tags that a write has just removed from links.
+        """
+        if not tag_ids:
+            return
+        family = TagClosure.select(TagClosure.ancestor).where(
+            TagClosure.descendant.in_(tag_ids)  # type: ignore
+        )
+        Tag.remove_all(
+            Tag.select(Tag.id).where(Tag.id.in_(family) & Tag.unused())  # type: ignore
+        )
+
+    @staticmethod
+    def clean_all():
+        """
+        Delete every unused tag in the database. Writes clean up after
+        themselves, so this is only needed as occasional maintenance.
+        """
+        Tag.remove_all(Tag.select(Tag.id).where(Tag.unused()))
+        User.update(version=User.version + 1).execute()
+        User.TOKENS.clear()
+
+    @staticmethod
+    def remove_all(query):
+        """Delete the tags selected by `query`, along with their closure rows"""
+        tag_ids = [t.id for t in query]
+        for chunk in peewee.chunked(tag_ids, CHUNK_SIZE):
+            TagPair.delete().where(
+                TagPair.tag.in_(chunk) | TagPair.other.in_(chunk)  # type: ignore
+            ).execute()
+            TagClosure.delete().where(
+                TagClosure.descendant.in_(chunk)  # type: ignore
+                | TagClosure.ancestor.in_(chunk)  # type: ignore
+            ).execute()
+            Tag.delete().where(Tag.id.in_(chunk)).execute()  # type: ignore
 
 
 class HasTag(Model):
@@ -397,19 +1155,255 @@ class HasTag(Model):
     Establishes that a link is tagged with a given tag.
     """
 
-    link = peewee.ForeignKeyField(Link, backref="tags")
-    tag = peewee.ForeignKeyField(Tag, backref="models")
+    link = peewee.ForeignKeyField(Link, backref="tags", index=False)
+    tag = peewee.ForeignKeyField(Tag, backref="models", index=False)
+
+    class Meta:
+        indexes = (
+            (("link", "tag"), True),
+            # covers finding the links with a tag
+            (("tag", "link"), False),
+        )
+
+    @staticmethod
+    def add_tags(link: Link, tag_ids: List[int]):
+        """
+        Tag the link with each of the given tags and all of their
+        ancestors, skipping whichever of those it already has
+        """
+        if not tag_ids:
+            return
+        family = (
+            TagClosure.select(TagClosure.ancestor)
+            .where(TagClosure.descendant.in_(tag_ids))  # type: ignore
+            .distinct()
+        )
+        present = [
+            ht.tag_id for ht in HasTag.select(HasTag.tag).where(HasTag.link == link)
+        ]
+        missing = [tc.ancestor_id for tc in family if tc.ancestor_id not in present]
+        if missing:
+            HasTag.insert_many(
+                [{"link": link.id, "tag": tag_id} for tag_id in missing]
+            ).execute()
+            Tag.count_links(missing, link.private, 1)
+            TagPair.count_pairs(missing, present + missing, 1)
+
+
+class TagClosure(Model):
+    """
+    The transitive closure of the tag hierarchy: there is a row for
+    every tag paired with each of its ancestors, at the number of
+    levels between them, and one pairing every tag with itself at
+    depth zero. This lets us find all the ancestors or descendants of
+    a tag with a single query.
+    """
+
+    ancestor = peewee.ForeignKeyField(Tag, backref="descendant_closure", index=False)
+    descendant = peewee.ForeignKeyField(Tag, backref="ancestor_closure", index=False)
+    depth = peewee.IntegerField()
+
+    class Meta:
+        indexes = (
+            (("ancestor", "descendant"), True),
+            # a tag's ancestors, nearest first
+            (("descendant", "depth"), False),
+        )
+
+    @staticmethod
+    def add_tag(tag: Tag, ancestors: List[Tag]):
+        """Record a new tag, given its ancestors ordered from the root"""
+        family = ancestors + [tag]
+        TagClosure.insert_many(
+            [
+                {"ancestor": t.id, "descendant": tag.id, "depth": len(family) - i - 1}
+                for i, t in enumerate(family)
+            ]
+        ).execute()
 
     @staticmethod
-    def get_or_create(link: Link, tag: Tag):
-        res = HasTag.get_or_none(link=link, tag=tag)
-        if res is None:
-            res = HasTag.create(link=link, tag=tag)
+    def rebuild():
+        """Recompute the whole closure from the tags' parent links"""
+        TagClosure.delete().execute()
+        TagClosure.insert_from(
+            Tag.select(Tag.id, Tag.id, peewee.Value(0)),
+            [TagClosure.ancestor, TagClosure.descendant, TagClosure.depth],
+        ).execute()
+        depth = 0
+        while True:
+            # extend every path found at the last depth by one parent
+            paths = (
+                TagClosure.select(
+                    Tag.parent, TagClosure.descendant, peewee.Value(depth + 1)
+                )
+                .join(Tag, on=(TagClosure.ancestor == Tag.id))
+                .where((TagClosure.depth == depth) & Tag.parent.is_null(False))
+            )
+            added = (
+                TagClosure.insert_from(
+                    paths,
+                    [TagClosure.ancestor, TagClosure.descendant, TagClosure.depth],
+                )
+                .as_rowcount()
+                .execute()
+            )
+            if not added:
+                break
+            depth += 1
+
 
-        if tag.parent:
-            HasTag.get_or_create(link, tag.parent)
+class TagPair(Model):
+    """
+    The number of links tagged with both `tag` and `other`. Tags
+    belong to a single user, so these are always counts over one
+    user's links. Each pair of tags is stored in both orders.
+    """
+
+    tag = peewee.ForeignKeyField(Tag, backref="pairs", index=False)
+    other = peewee.ForeignKeyField(Tag)
+    count = peewee.IntegerField(default=0)
 
-        return res
+    class Meta:
+        indexes = (
+            (("tag", "other"), True),
+            (("tag", "count"), False),
+        )
+
+    @staticmethod
+    def count_pairs(tag_ids: List[int], among: List[int], delta: int):
+        """
+        Adjust by `delta` the count of every pair made of one of
+        `tag_ids` and a different tag from `among`
+        """
+        pairs = {(a, b) for a in tag_ids for b in among if a != b}
+        pairs |= {(b, a) for a, b in pairs}
+        TagPair.add_counts({pair: delta for pair in pairs})
+        if delta < 0:
+            touched = list(set(tag_ids) | set(among))
+            TagPair.delete().where(
+                (TagPair.count <= 0) & TagPair.tag.in_(touched)  # type: ignore
+            ).execute()
+
+    @staticmethod
+    def add_counts(counts: Dict[Tuple[int, int], int]):
+        """Add to the count of each (tag, other) pair"""
+        rows = [{"tag": a, "other": b, "count": n} for (a, b), n in counts.items()]
+        for chunk in peewee.chunked(rows, CHUNK_SIZE):
+            TagPair.insert_many(chunk).on_conflict(
+                conflict_target=[TagPair.tag, TagPair.other],
+                update={TagPair.count: TagPair.count + peewee.EXCLUDED.count},
+            ).execute()
+
+    @staticmethod
+    def add_links(condition):
+        """Count the pairs of tags on the links matching `condition`"""
+        Other = HasTag.alias()
+        pairs = (
+            HasTag.select(HasTag.tag, Other.tag, peewee.fn.COUNT(HasTag.id))
+            .join(
+                Other,
+                on=((Other.link == HasTag.link) & (Other.tag != HasTag.tag)),
+            )
+            .join_from(HasTag, Link)
+            .where(condition)
+            .group_by(HasTag.tag, Other.tag)
+        )
+        TagPair.insert_from(
+            pairs, [TagPair.tag, TagPair.other, TagPair.count]
+        ).on_conflict(
+            conflict_target=[TagPair.tag, TagPair.other],
+            update={TagPair.count: TagPair.count + peewee.EXCLUDED.count},
+        ).execute()
+
+    @staticmethod
+    def rebuild():
+        """Recompute every pair count from the tagged links"""
+        TagPair.delete().execute()
+        TagPair.add_links(Link.id.is_null(False))  # type: ignore
+
+
+class LinkIndex(playhouse.sqlite_ext.FTS5Model):
+    """
+    The full-text search index over links. Each row shares its rowid
+    with the link it indexes, and is rebuilt from the link and its
+    tags whenever the link is written.
+    """
+
+    rowid = playhouse.sqlite_ext.RowIDField()
+    url = playhouse.sqlite_ext.SearchField()
+    name = playhouse.sqlite_ext.SearchField()
+    description = playhouse.sqlite_ext.SearchField()
+    tags = playhouse.sqlite_ext.SearchField()
+
+    class Meta:
+        database = c.app.db
+        # keep short prefixes indexed so that `foo*` searches are cheap
+        options = {"prefix": "2 3", "tokenize": "unicode61"}
+
+    # how much a match in each of (url, name, description, tags) counts
+    WEIGHTS = (2.0, 10.0, 1.0, 5.0)
+    SEARCH_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+    @staticmethod
+    def to_query(needle: str) -> str:
+        """
+        Turn a user's search string into an FTS5 query. Every word or
+        phrase gets quoted, so punctuation and FTS5 keywords in the
+        search are taken literally.
+        """
+        terms = []
+        for phrase, word in LinkIndex.SEARCH_TERM.findall(needle):
+            prefix = ""
+            if word.endswith("*"):
+                word, prefix = word.rstrip("*"), "*"
+            term = (phrase or word).replace('"', '""')
+            if term.strip():
+                terms.append(f'"{term}"{prefix}')
+        return " ".join(terms) or '""'
+
+    @staticmethod
+    def ranking():
+        return LinkIndex.bm25(*LinkIndex.WEIGHTS)
+
+    @staticmethod
+    def reindex(link_ids: List[int]):
+        """Rebuild the index rows for the given links"""
+        for chunk in peewee.chunked(link_ids, CHUNK_SIZE):
+            LinkIndex.delete().where(
+                LinkIndex.rowid.in_(chunk)  # type: ignore
+            ).execute()
+            LinkIndex.index_links(Link.id.in_(chunk))  # type: ignore
+
+    @staticmethod
+    def reindex_all():
+        LinkIndex.delete().execute()
+        LinkIndex.index_links(Link.id.is_null(False))  # type: ignore
+
+    @staticmethod
+    def index_links(condition):
+        links = (
+            Link.select(
+                Link.id,
+                Link.url,
+                Link.name,
+                Link.description,
+                peewee.fn.COALESCE(peewee.fn.GROUP_CONCAT(Tag.name, " "), ""),
+            )
+            .join(HasTag, peewee.JOIN.LEFT_OUTER)
+            .join(Tag, peewee.JOIN.LEFT_OUTER)
+            .where(condition)
+            .group_by(Link.id)
+        )
+        LinkIndex.insert_from(
+            links,
+            [
+                LinkIndex.rowid,
+                LinkIndex.url,
+                LinkIndex.name,
+                LinkIndex.description,
+                LinkIndex.tags,
+            ],
+        ).execute()
 
 
 class UserInvite(Model):
@@ -445,15 +1439,234 @@ class UserInvite(Model):
         )
 
 
+class ImportJob(Model):
+    """
+    A Pinboard import that runs in the background. The uploaded file
+    waits at `path` until a worker picks the job up, and is removed
+    once the import has finished.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    user = peewee.ForeignKeyField(User, backref="import_jobs")
+    path = peewee.TextField()
+    status = peewee.TextField(default=QUEUED)
+    imported = peewee.IntegerField(default=0)
+    skipped = peewee.IntegerField(default=0)
+    error = peewee.TextField(null=True)
+    created = peewee.DateTimeField()
+    started = peewee.DateTimeField(null=True)
+    finished = peewee.DateTimeField(null=True)
+    # when the worker running the job last reported progress
+    heartbeat = peewee.DateTimeField(null=True)
+
+    class Meta:
+        indexes = ((("status", "id"), False),)
+
+    @staticmethod
+    def enqueue(user: User, stream) -> "ImportJob":
+        """
+        Copy an uploaded file somewhere a worker can find it and queue
+        up a job to import it
+        """
+        fd, path = tempfile.mkstemp(prefix="lc-import-", suffix=".json")
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        return ImportJob.create(
+            user=user,
+            path=path,
+            created=datetime.datetime.now(),
+        )
+
+    @staticmethod
+    def by_id(user: User, job_id: int) -> "ImportJob":
+        job = ImportJob.get_or_none((ImportJob.id == job_id) & (ImportJob.user == user))
+        if job is None:
+            raise e.NoSuchImportJob(job_id)
+        return job
+
+    @staticmethod
+    @writes
+    def claim_next() -> Optional["ImportJob"]:
+        """
+        Mark the oldest queued job as running and return it. The status
+        only changes if the job is still queued, so two workers can't
+        both end up running the same job.
+        """
+        while True:
+            job = (
+                ImportJob.select()
+                .where(ImportJob.status == ImportJob.QUEUED)
+                .order_by(ImportJob.id)
+                .first()
+            )
+            if job is None:
+                return None
+            now = datetime.datetime.now()
+            claimed = (
+                ImportJob.update(status=ImportJob.RUNNING, started=now, heartbeat=now)
+                .where(
+                    (ImportJob.id == job.id) & (ImportJob.status == ImportJob.QUEUED)
+                )
+                .execute()
+            )
+            if claimed:
+                return ImportJob.get_by_id(job.id)
+
+    @staticmethod
+    def fail_stale(timeout: int) -> int:
+        """
+        Fail the running jobs that haven't reported any progress for
+        more than `timeout` seconds. Nothing is still working on them:
+        their process must have stopped partway. Returns how many there
+        were.
+        """
+        now = datetime.datetime.now()
+        # jobs from before there were heartbeats only have a start time
+        last_seen = peewee.fn.COALESCE(ImportJob.heartbeat, ImportJob.started)
+        stale = (ImportJob.status == ImportJob.RUNNING) & (
+            last_seen < now - datetime.timedelta(seconds=timeout)
+        )
+        jobs = list(ImportJob.select().where(stale))
+        if not jobs:
+            return 0
+        ImportJob.mark_failed([job.id for job in jobs], now)
+        for job in jobs:
+            if os.path.exists(job.path):
+                os.remove(job.path)
+        return len(jobs)
+
+    @staticmethod
+    @writes
+    def mark_failed(job_ids: List[int], now: datetime.datetime):
+        ImportJob.update(
+            status=ImportJob.FAILED,
+            error="The import was interrupted. Please try uploading it again.",
+            finished=now,
+        ).where(
+            ImportJob.id.in_(job_ids)  # type: ignore
+            & (ImportJob.status == ImportJob.RUNNING)
+        ).execute()
+
+    def run(self):
+        try:
+            with open(self.path, "rb") as stream:
+                self.user.import_pinboard_data(stream, progress=self.record_progress)
+            self.status = ImportJob.DONE
+        except e.LCException as exn:
+            self.status = ImportJob.FAILED
+            self.error = str(exn)
+        except Exception as exn:
+            c.log(f"import job {self.id} failed: {exn!r}")
+            self.status = ImportJob.FAILED
+            self.error = "Unexpected error while importing."
+        finally:
+            self.finished = datetime.datetime.now()
+            if not self.finish():
+                c.log(f"import job {self.id} finished after it was failed as stale")
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    @writes
+    def finish(self) -> bool:
+        """
+        Record how the job ended, unless it was failed as stale while
+        it ran: the user has already been told that it failed. Returns
+        whether the job was still running.
+        """
+        return bool(
+            ImportJob.update(
+                status=self.status,
+                imported=self.imported,
+                skipped=self.skipped,
+                error=self.error,
+                finished=self.finished,
+            )
+            .where((ImportJob.id == self.id) & (ImportJob.status == ImportJob.RUNNING))
+            .execute()
+        )
+
+    def record_progress(self, stats: v.ImportStats):
+        self.imported = stats.imported
+        self.skipped = stats.skipped
+        self.heartbeat = datetime.datetime.now()
+        self.save(only=[ImportJob.imported, ImportJob.skipped, ImportJob.heartbeat])
+
+    def url(self) -> str:
+        return f"{self.user.base_url()}/import/{self.id}"
+
+    def to_view(self) -> v.ImportJob:
+        if self.started is None:
+            seconds = 0.0
+        else:
+            end = self.finished or datetime.datetime.now()
+            seconds = (end - self.started).total_seconds()
+        return v.ImportJob(
+            url=self.url(),
+            status=self.status,
+            processed=self.imported + self.skipped,
+            imported=self.imported,
+            skipped=self.skipped,
+            seconds=seconds,
+            error=self.error,
+        )
+
+
 MODELS = [
     Meta,
     User,
     Link,
     Tag,
     HasTag,
+    TagClosure,
+    TagPair,
     UserInvite,
+    LinkIndex,
+    ImportJob,
+    DeletedLink,
 ]
 
 
+# The schema version that `create_tables` builds. This needs to go up
+# along with every new migration.
+SCHEMA_VERSION = 10
+
+
 def create_tables():
-    c.app.db.create_tables(MODELS, safe=True)
+    """
+    Create the whole schema in an empty database, marked as already
+    up to date with every migration. A database that already has
+    tables is left for the migrations to bring up to date.
+    """
+    if User.table_exists():
+        Meta.create_table(safe=True)
+        return
+    with c.app.db.atomic():
+        c.app.db.create_tables(MODELS)
+        Meta.create(id=0, version=SCHEMA_VERSION)
+
+
+@writes
+def recount_links():
+    """
+    Recompute every user's and every tag's link counters from scratch,
+    in case they have drifted from the links actually stored
+    """
+    public = Link.private == False  # noqa: E712
+    user_links = Link.select(peewee.fn.COUNT(Link.id)).where(Link.user == User.id)
+    tag_links = (
+        HasTag.select(peewee.fn.COUNT(HasTag.id)).join(Link).where(HasTag.tag == Tag.id)
+    )
+    User.update(
+        link_count=user_links,
+        public_link_count=user_links.where(public),
+        version=User.version + 1,
+    ).execute()
+    Tag.update(
+        link_count=tag_links,
+        public_link_count=tag_links.where(public),
+    ).execute()
+    User.TOKENS.clear()
@@ -0,0 +1,97 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import multiprocessing
+import os
+import threading
+from typing import Callable, Optional, Tuple, TypeVar
+
+from passlib.apps import custom_app_context
+from passlib.context import CryptContext
+
+import lc.config as c
+
+T = TypeVar("T")
+
+
+@functools.lru_cache(maxsize=None)
+def context(scheme: str, rounds: int) -> CryptContext:
+    """
+    The hashing policy for new passwords: hash with `scheme`, using
+    `rounds` rounds if that's more than zero, and passlib's defaults
+    otherwise. Hashes made some other way can still be checked, but
+    they're marked as needing an update.
+    """
+    schemes = list(dict.fromkeys([scheme, *custom_app_context.schemes()]))
+    settings = {}
+    if rounds > 0:
+        for key in ("default_rounds", "min_rounds", "max_rounds"):
+            settings[f"{scheme}__{key}"] = rounds
+    return CryptContext(schemes=schemes, default=scheme, deprecated="auto", **settings)
+
+
+# These run in the pool's processes, so they're given the policy
+# rather than looking it up in the configuration
+def hash_password(scheme: str, rounds: int, password: str) -> str:
+    return context(scheme, rounds).hash(password)
+
+
+def verify_password(
+    scheme: str, rounds: int, password: str, passhash: str
+) -> Tuple[bool, Optional[str]]:
+    return context(scheme, rounds).verify_and_update(password, passhash)
+
+
+class Passwords:
+    """
+    Hashes and checks passwords. Hashing is slow on purpose, and
+    passlib's own implementations are pure Python, so a hash holds
+    the interpreter lock for as long as it takes: any other thread in
+    the process has to wait for it. So, hashing is handed off to a
+    pool of `password_workers` separate processes instead, which
+    also caps how many hashes can be running at once: anything past
+    that waits its turn, rather than taking CPU from page requests.
+    With no workers, hashing happens in the calling thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def run(self, fn: Callable[..., T], *args) -> T:
+        config = c.app.config
+        policy = (config.password_scheme, config.password_rounds)
+        if config.password_workers <= 0:
+            return fn(*policy, *args)
+        with self.lock:
+            if self.pool is None:
+                # forking a process with threads running can deadlock
+                # the child, so the workers start from scratch
+                self.pool = ProcessPoolExecutor(
+                    max_workers=config.password_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            pool = self.pool
+        return pool.submit(fn, *policy, *args).result()
+
+    def hash(self, password: str) -> str:
+        return self.run(hash_password, password)
+
+    def verify(self, password: str, passhash: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password against its hash. If it matches, but the hash
+        was made with a scheme or cost we no longer use, this also
+        returns the password hashed the way we do now.
+        """
+        return self.run(verify_password, password, passhash)
+
+    def forget_pool(self):
+        """
+        Drop a pool inherited from a parent process, whose workers
+        still belong to the parent
+        """
+        self.lock = threading.Lock()
+        self.pool = None
+
+
+passwords = Passwords()
+os.register_at_fork(after_in_child=passwords.forget_pool)
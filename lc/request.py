@@ -1,8 +1,12 @@
 import abc
+import codecs
 from dataclasses import dataclass
 from dataclasses_json import dataclass_json
-from datetime import datetime
-from typing import List, Mapping, Optional, TypeVar, Type
+from datetime import datetime, timezone
+import html
+import itertools
+import json
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, TypeVar, Type
 
 import lc.config as c
 import lc.error as e
@@ -102,3 +106,318 @@ class Link(Request):
             private="private" in form,
             tags=form["tags"].split(),
         )
+
+
+@dataclass_json
+@dataclass
+class LinkOperation:
+    """
+    One operation in a batch: `create` needs a `link`, `update` needs
+    the `id` of a link along with what it should become, and `delete`
+    needs just an `id`
+    """
+
+    op: str
+    id: Optional[int] = None
+    link: Optional[Link] = None
+
+    OPS = ("create", "update", "delete")
+
+    def __post_init__(self):
+        if self.op not in LinkOperation.OPS:
+            raise e.BadBatch(f"'{self.op}' is not an operation")
+        if self.op != "create" and self.id is None:
+            raise e.BadPayload(key="id")
+        if self.op != "delete" and self.link is None:
+            raise e.BadPayload(key="link")
+        # nothing checks the types of what came in as JSON but us
+        if self.id is not None and (
+            not isinstance(self.id, int) or isinstance(self.id, bool)
+        ):
+            raise e.BadBatch(f"'{self.id}' is not a link id")
+
+
+@dataclass
+class LinkBatch(Request):
+    """A list of operations on links, sent as a JSON array"""
+
+    operations: List[LinkOperation]
+
+    # a batch holds the write lock for as long as it runs, so it can't
+    # be allowed to run for too long
+    LIMIT = 1000
+
+    @classmethod
+    def from_form(cls, form: Mapping[str, str]):
+        raise e.BadContentType("application/x-www-form-urlencoded")
+
+    @classmethod
+    def from_json(cls, payload: bytes) -> "LinkBatch":
+        try:
+            operations = json.loads(payload)
+        except ValueError:
+            raise e.BadBatch("it isn't valid JSON")
+        if not isinstance(operations, list) or not all(
+            isinstance(op, dict) for op in operations
+        ):
+            raise e.BadBatch("it should be an array of operations")
+        if len(operations) > cls.LIMIT:
+            raise e.BadBatch(f"it can't have more than {cls.LIMIT} operations")
+        batch = cls(operations=[])
+        for number, op in enumerate(operations, 1):
+            if isinstance(op.get("link"), dict):
+                cls.check_link(number, op["link"])
+            try:
+                batch.operations.append(LinkOperation.from_dict(op))  # type: ignore
+            except (AttributeError, KeyError, TypeError, ValueError):
+                raise e.BadBatch(f"operation {number} isn't a valid operation")
+        return batch
+
+    @staticmethod
+    def check_link(number: int, link: dict):
+        """
+        Check the types of a link's fields before it's decoded, since
+        decoding converts whatever it's given: a list of URLs would be
+        stored as its repr, and a string of tags would become a list of
+        its characters
+        """
+        for key in ("url", "name", "description"):
+            if key in link and not isinstance(link[key], str):
+                raise e.BadBatch(f"operation {number} should have a string {key}")
+        if "private" in link and not isinstance(link["private"], bool):
+            raise e.BadBatch(
+                f"operation {number} should have true or false for private"
+            )
+        tags = link.get("tags", [])
+        if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+            raise e.BadBatch(f"operation {number} should have a list of tags")
+
+
+@dataclass
+class ChangeToken:
+    """
+    A position in the changes to a user's links, as given by the
+    `since` query parameter: the version of the user's links that a
+    change made, and the id of the link it was to. With no `since`,
+    this is the very beginning, before any link was added.
+    """
+
+    revision: int = 0
+    id: int = 0
+
+    def encode(self) -> str:
+        return f"{self.revision}-{self.id}"
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "ChangeToken":
+        if not (since := args.get("since")):
+            return cls()
+        try:
+            revision, id = since.split("-")
+            return cls(revision=int(revision), id=int(id))
+        except ValueError:
+            raise e.BadCursor(since)
+
+
+@dataclass
+class Cursor:
+    """
+    A position in a list of links, as given by the `after` or `before`
+    query parameters. Links are ordered newest-first by (created, id),
+    so `after` asks for older links and `before` for newer ones. A
+    `before` cursor with no position asks for the very last page.
+    """
+
+    before: bool
+    created: Optional[datetime] = None
+    id: Optional[int] = None
+
+    LAST = "last"
+    TIME_FORMAT = "%Y%m%d%H%M%S%f"
+
+    @staticmethod
+    def encode(created: datetime, id: int) -> str:
+        return f"{created.strftime(Cursor.TIME_FORMAT)}-{id}"
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> Optional["Cursor"]:
+        if after := args.get("after"):
+            return cls.decode(after, before=False)
+        if before := args.get("before"):
+            if before == Cursor.LAST:
+                return cls(before=True)
+            return cls.decode(before, before=True)
+        return None
+
+    @classmethod
+    def decode(cls, cursor: str, before: bool) -> "Cursor":
+        try:
+            created, id = cursor.split("-")
+            return cls(
+                before=before,
+                created=datetime.strptime(created, Cursor.TIME_FORMAT),
+                id=int(id),
+            )
+        except ValueError:
+            raise e.BadCursor(cursor)
+
+
+@dataclass
+class PinboardLink:
+    """
+    A single link from a Pinboard JSON export
+    """
+
+    href: str
+    description: str
+    extended: str
+    time: datetime
+    shared: bool
+    tags: List[str]
+
+    TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+    @classmethod
+    def from_export(cls, entry: Any) -> "PinboardLink":
+        if not isinstance(entry, dict):
+            raise e.BadFileUpload("expected each link to be an object")
+        try:
+            return cls(
+                href=entry["href"],
+                description=entry["description"],
+                extended=entry["extended"],
+                time=datetime.strptime(entry["time"], PinboardLink.TIME_FORMAT),
+                shared=entry["shared"] != "no",
+                tags=entry["tags"].split(),
+            )
+        except KeyError as exn:
+            raise e.BadFileUpload(f"missing key {exn.args[0]}")
+        except (AttributeError, TypeError, ValueError):
+            raise e.BadFileUpload(f"malformed link {entry.get('href')}")
+
+    def to_export(self) -> dict:
+        return {
+            "href": self.href,
+            "description": self.description,
+            "extended": self.extended,
+            "time": self.time.strftime(PinboardLink.TIME_FORMAT),
+            "shared": "yes" if self.shared else "no",
+            "toread": "no",
+            "tags": " ".join(self.tags),
+        }
+
+    def to_netscape(self) -> str:
+        """This link as an entry in a Netscape bookmark file"""
+        attrs = [
+            f'HREF="{html.escape(self.href)}"',
+            f'ADD_DATE="{int(self.time.replace(tzinfo=timezone.utc).timestamp())}"',
+            f'PRIVATE="{0 if self.shared else 1}"',
+            f'TAGS="{html.escape(",".join(self.tags))}"',
+        ]
+        entry = f"<DT><A {' '.join(attrs)}>{html.escape(self.description)}</A>\n"
+        if self.extended:
+            entry += f"<DD>{html.escape(self.extended)}\n"
+        return entry
+
+
+def iter_json_array(stream, chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """
+    Lazily parse a stream containing a JSON array, yielding one element
+    at a time, so that only the element being parsed (and one chunk of
+    the stream) is ever held in memory. The stream may produce either
+    bytes, which are decoded as UTF-8, or text.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos, eof = "", 0, False
+
+    def fill() -> bool:
+        """Read another chunk into the buffer, unless we're at the end already"""
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = stream.read(chunk_size)
+        try:
+            if isinstance(chunk, bytes):
+                chunk = utf8.decode(chunk, final=not chunk)
+        except UnicodeDecodeError:
+            raise e.BadFileUpload("file is not valid UTF-8")
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+        return True
+
+    def skip_space() -> str:
+        """Skip past any whitespace, returning the next character or '' at the end"""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                return ""
+
+    if skip_space() != "[":
+        raise e.BadFileUpload("expected a list")
+    pos += 1
+    if skip_space() == "]":
+        pos += 1
+    else:
+        while True:
+            skip_space()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                value, end = None, None
+            # the value might continue into the next chunk, either
+            # because it failed to parse or because it runs right up
+            # to the end of the buffer (as a number could)
+            if end is None or end == len(buf):
+                if fill():
+                    continue
+                if end is None:
+                    raise e.BadFileUpload("could not parse file as JSON")
+            pos = end
+            yield value
+
+            separator = skip_space()
+            pos += 1
+            if separator == "]":
+                break
+            if separator != ",":
+                raise e.BadFileUpload("could not parse file as JSON")
+
+    if skip_space() != "":
+        raise e.BadFileUpload("unexpected data after the end of the list")
+
+
+# how many links to write out at once when streaming an export
+EXPORT_BATCH = 500
+
+NETSCAPE_HEADER = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+"""
+
+
+def json_export(links: Iterable[PinboardLink]) -> Iterator[str]:
+    """
+    Write out links as a Pinboard JSON export, a batch at a time, so
+    the whole export is never held in memory at once
+    """
+    yield "["
+    separator = "\n"
+    for batch in itertools.batched(links, EXPORT_BATCH):
+        yield separator + ",\n".join(json.dumps(link.to_export()) for link in batch)
+        separator = ",\n"
+    yield "\n]\n"
+
+
+def netscape_export(links: Iterable[PinboardLink]) -> Iterator[str]:
+    """Write out links as a Netscape bookmark file, a batch at a time"""
+    yield NETSCAPE_HEADER
+    for batch in itertools.batched(links, EXPORT_BATCH):
+        yield "".join(link.to_netscape() for link in batch)
+    yield "</DL><p>\n"
@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import flask
+import json
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import lc.config as c
+
+
+@dataclass
+class RequestTimes:
+    """
+    Where the time went in handling one request, in seconds. SQL time
+    and auth time can overlap, since checking a session token runs
+    queries of its own.
+    """
+
+    start: float = field(default_factory=time.perf_counter)
+    queries: int = 0
+    sql: float = 0.0
+    auth: float = 0.0
+    # how many times each template was rendered, and for how long
+    renders: Dict[str, Tuple[int, float]] = field(default_factory=dict)
+
+    def rendered(self, name: str, seconds: float):
+        count, total = self.renders.get(name, (0, 0.0))
+        self.renders[name] = (count + 1, total + seconds)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def header(self, total: float) -> str:
+        """These times as the value of a Server-Timing header"""
+        metrics = [
+            f'sql;dur={self.sql * 1000:.2f};desc="{self.queries} queries"',
+            f"auth;dur={self.auth * 1000:.2f}",
+        ]
+        for name, (count, seconds) in self.renders.items():
+            metrics.append(
+                f'render.{name};dur={seconds * 1000:.2f};desc="{count} renders"'
+            )
+        metrics.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(metrics)
+
+    def to_dict(self, total: float) -> dict:
+        return {
+            "total_ms": round(total * 1000, 2),
+            "queries": self.queries,
+            "sql_ms": round(self.sql * 1000, 2),
+            "auth_ms": round(self.auth * 1000, 2),
+            "render_ms": {
+                name: round(seconds * 1000, 2)
+                for name, (_, seconds) in self.renders.items()
+            },
+        }
+
+
+class Timing:
+    """
+    Times the parts of each request, when `LC_TIMING` is set. The
+    measuring points in the code look for the times of the request
+    their thread is handling, so with timing off each costs no more
+    than finding that there isn't one. SQL is timed by wrapping the
+    database's `execute_sql`, which only happens once timing is first
+    used: that covers running each statement up to its first row,
+    but not fetching the rest of its rows.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hooked = False
+
+    def current(self) -> Optional[RequestTimes]:
+        return getattr(self.local, "times", None)
+
+    @contextmanager
+    def request(self) -> Iterator[RequestTimes]:
+        """Time everything this thread does inside the block"""
+        self.hook_sql()
+        times = self.local.times = RequestTimes()
+        try:
+            yield times
+        finally:
+            self.local.times = None
+
+    def hook_sql(self):
+        with self.lock:
+            if self.hooked:
+                return
+            execute_sql = c.app.db.execute_sql
+
+            def timed_execute_sql(sql, params=None, *args, **kwargs):
+                times = self.current()
+                if times is None:
+                    return execute_sql(sql, params, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return execute_sql(sql, params, *args, **kwargs)
+                finally:
+                    times.queries += 1
+                    times.sql += time.perf_counter() - start
+
+            c.app.db.execute_sql = timed_execute_sql  # type: ignore
+            self.hooked = True
+
+    def report(self, times: RequestTimes, response):
+        """Add the times to a response, and log them if we're asked to"""
+        total = times.elapsed()
+        response.headers["Server-Timing"] = times.header(total)
+        if c.app.config.timing_log:
+            line = {
+                "method": flask.request.method,
+                "path": flask.request.path,
+                "status": response.status_code,
+                **times.to_dict(total),
+            }
+            c.log(json.dumps(line))
+
+
+timing = Timing()
@@ -1,7 +1,8 @@
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from typing import Any, Optional, List
+from typing import Any, ClassVar, Optional, List, Tuple
 
+from lc.cache import LRUCache
 import lc.config as c
 
 
@@ -11,25 +12,23 @@ class View:
 
 @dataclass
 class Pagination(View):
-    current: int
-    last: int
+    total: int
+    # cursors for the pages before and after this one, if any
+    before: Optional[str] = None
+    after: Optional[str] = None
 
     def previous(self) -> Optional[dict]:
-        if self.current > 1:
-            return {"page": self.current - 1}
+        if self.before:
+            return {"before": self.before}
         return None
 
     def next(self) -> Optional[dict]:
-        if self.current < self.last:
-            return {"page": self.current + 1}
+        if self.after:
+            return {"after": self.after}
         return None
 
-    @classmethod
-    def from_total(cls, current, total) -> "Pagination":
-        return cls(
-            current=current,
-            last=((total - 1) // c.app.per_page) + 1,
-        )
+    def to_dict(self) -> dict:
+        return {"total": self.total, "before": self.before, "after": self.after}
 
 
 @dataclass
@@ -44,9 +43,62 @@ class AddUser(View):
     token: str
 
 
+@dataclass
+class WriteStats(View):
+    writes: int
+    retries: int
+    failures: int
+    wait_p50_ms: float
+    wait_p99_ms: float
+    wait_max_ms: float
+
+    def summary(self) -> str:
+        return (
+            f"{self.writes} writes, waiting {self.wait_p50_ms:.1f}ms (p50), "
+            f"{self.wait_p99_ms:.1f}ms (p99) and at most {self.wait_max_ms:.1f}ms "
+            f"for the lock; {self.retries} retried, {self.failures} gave up"
+        )
+
+
+@dataclass
+class CacheStats(View):
+    store: str
+    hits: int
+    misses: int
+
+    def summary(self) -> str:
+        looked_up = self.hits + self.misses
+        rate = self.hits / looked_up * 100 if looked_up else 0.0
+        return (
+            f"{self.hits} hits and {self.misses} misses ({rate:.0f}% hit rate) "
+            f"in the {self.store} store"
+        )
+
+
+@dataclass
+class QueryStat(View):
+    statement: str
+    count: int
+    total_ms: float
+
+    def summary(self) -> str:
+        return (
+            f"{self.total_ms:.1f}ms in all, over {self.count} runs "
+            f"({self.total_ms / self.count:.2f}ms each)"
+        )
+
+
+@dataclass
+class QueryStats(View):
+    statements: List[QueryStat]
+
+
 @dataclass
 class AdminPane(View):
     invites: List[UserInvite]
+    writes: WriteStats
+    fragments: Optional[CacheStats] = None
+    queries: Optional[QueryStats] = None
 
 
 @dataclass
@@ -85,43 +137,41 @@ class HierTagList:
     user: str
     tags: List[Tag]
 
+    # the rendered HTML for each user and list of tag names. This is
+    # all that the HTML depends on, so an entry never goes stale.
+    RENDERED: ClassVar[LRUCache[Tuple[str, Tuple[str, ...]], str]] = LRUCache(size=1024)
+
     def render(self) -> str:
+        key = (self.user, tuple(t.name for t in self.tags))
+        if (html := HierTagList.RENDERED.get(key)) is None:
+            html = self._render()
+            HierTagList.RENDERED.put(key, html)
+        return html
+
+    def _render(self) -> str:
+        # each part of a tag's name maps to the parts that follow it
         groups: dict = {}
-
         for tag in (t.name for t in self.tags):
-            if "/" not in tag:
-                groups[tag] = groups.get(tag, {})
-            else:
-                chunks = tag.split("/")
-                focus = groups[chunks[0]] = groups.get(chunks[0], {})
-                for chunk in chunks[1:]:
-                    focus[chunk] = focus = focus.get(chunk, {})
-
-        return "\n".join(self.render_html(k, v) for k, v in groups.items())
-
-    def render_html(self, prefix: str, values: dict) -> str:
-        link = self._render_html(prefix, values, [])
-        return f'<span class="tag">{link}</span>'
+            focus = groups
+            for chunk in tag.split("/"):
+                focus = focus.setdefault(chunk, {})
 
-    def _href(self, tag: str, init: List[str]) -> str:
-        link = "/".join(init + [tag])
-        return f'<a href="/u/{self.user}/t/{link}">{tag}</a>'
+        return "\n".join(
+            f'<span class="tag">{self._render_html(k, k, v)}</span>'
+            for k, v in groups.items()
+        )
 
-    def _render_html(self, prefix: str, values: dict, init: List[str]) -> str:
+    def _render_html(self, chunk: str, path: str, values: dict) -> str:
+        href = f'<a href="/u/{self.user}/t/{path}">{chunk}</a>'
         if not values:
-            return self._href(prefix, init)
+            return href
         if len(values) == 1:
-            k, v = values.popitem()
-            rest = self._render_html(k, v, init + [prefix])
-            prefix_href = self._href(prefix, init)
-            return f"{prefix_href}/{rest}"
-        else:
-            fragments = []
-            for k, v in values.items():
-                fragments.append(self._render_html(k, v, init + [prefix]))
-            items = ", ".join(fragments)
-            prefix_href = self._href(prefix, init)
-            return f"{prefix_href}/{{{items}}}"
+            [(k, v)] = values.items()
+            return f"{href}/{self._render_html(k, f'{path}/{k}', v)}"
+        items = ", ".join(
+            [self._render_html(k, f"{path}/{k}", v) for k, v in values.items()]
+        )
+        return f"{href}/{{{items}}}"
 
 
 @dataclass
@@ -151,6 +201,65 @@ class LinkList(View):
     def hier_tags(self) -> str:
         return HierTagList(user=self.user, tags=self.tags).render()
 
+    def to_dict(self) -> dict:
+        return {
+            "links": [asdict(link) for link in self.links],
+            "pages": self.pages and self.pages.to_dict(),
+        }
+
+
+@dataclass
+class ChangedLink(View):
+    id: int
+    url: str
+    name: str
+    description: str
+    private: bool
+    tags: List[str]
+    created: str
+    modified: str
+
+
+@dataclass
+class LinkChange(View):
+    # "upsert" for a link that was added or edited, and "delete" for
+    # one that's gone
+    op: str
+    id: int
+    # what the link is now, for an upsert
+    link: Optional[ChangedLink] = None
+
+
+@dataclass
+class Changes(View):
+    # in the order they happened, since a deleted link's id can be
+    # given to a new link later on
+    changes: List[LinkChange]
+    # where to pick up from next time
+    next: str
+    # whether there are more changes to fetch straight away
+    more: bool
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class BatchResult(View):
+    op: str
+    # the link operated on, which is None for a create that failed
+    id: Optional[int]
+    ok: bool
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchResults(View):
+    results: List[BatchResult]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
 
 @dataclass
 class SingleLink(View):
@@ -175,6 +284,44 @@ class AddLinkDefaults(View):
         return f"/u/{self.user}/l"
 
 
+@dataclass
+class ImportStats(View):
+    imported: int
+    skipped: int
+    seconds: float
+
+    def rate(self) -> float:
+        """Links imported per second"""
+        return self.imported / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "rate": self.rate()}
+
+
+@dataclass
+class ImportJob(View):
+    url: str
+    status: str
+    processed: int
+    imported: int
+    skipped: int
+    seconds: float
+    error: Optional[str]
+
+    def rate(self) -> float:
+        """Links processed per second"""
+        return self.processed / self.seconds if self.seconds else 0.0
+
+    def rate_text(self) -> str:
+        return f"{self.rate():.0f}"
+
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "rate": self.rate()}
+
+
 @dataclass
 class Page(View):
     title: str
@@ -1,15 +1,25 @@
 from dataclasses import dataclass
 import flask
+import hashlib
+import os
 import pystache
-from typing import Optional, TypeVar, Type
-
+import pystache.common
+import pystache.parsed
+import pystache.parser
+import pystache.renderengine
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, TypeVar, Type
+
+from lc.cache import LRUCache
 import lc.config as c
 import lc.error as e
+from lc.fragments import fragments
 import lc.model as m
 import lc.request as r
+from lc.timing import timing
 import lc.view as v
 
-
 T = TypeVar("T", bound=r.Request)
 
 
@@ -19,40 +29,37 @@ class ApiOK:
 
 
 class Endpoint:
-    __slots__ = ("user",)
+    __slots__ = ("_user", "_etag")
+
+    # stands in for a user we haven't looked up yet
+    UNKNOWN = object()
 
     def __init__(self):
-        self.user = None
+        self._user = Endpoint.UNKNOWN
+        self._etag: Optional[str] = None
+
+    @property
+    def user(self) -> Optional[m.User]:
+        """
+        The user whose session token came with this request, if any.
+        This is only worked out the first time it's asked for, so
+        endpoints which don't care who's asking don't pay for it.
+        """
+        if self._user is Endpoint.UNKNOWN:
+            times, start = timing.current(), time.perf_counter()
+            token = self.token()
+            self._user = m.User.by_token(token) if token else None
+            if times is not None:
+                times.auth += time.perf_counter() - start
+        return self._user  # type: ignore
 
-        # try finding the token
-        token = None
+    @staticmethod
+    def token() -> Optional[str]:
         # first check the HTTP headers
         if auth := flask.request.headers.get("Authorization", None):
-            token = auth.split()[1]
+            return auth.split()[1]
         # if that fails, check the session
-        elif flask.session.get("auth", None):
-            token = flask.session["auth"]
-
-        if token is None:
-            return
-
-        # if that exists and we can deserialize it, then make sure
-        # it contains a valid user password, too
-        try:
-            payload = c.app.load_token(token)
-        except Exception:
-            # TODO: be more specific about what errors we're catching
-            # here!
-            return
-
-        if "name" not in payload:
-            return
-
-        try:
-            u = m.User.by_slug(payload["name"])
-            self.user = u
-        except e.LCException:
-            return
+        return flask.session.get("auth", None)
 
     @staticmethod
     def just_get_user() -> Optional[m.User]:
@@ -95,6 +102,10 @@ class Endpoint:
         else:
             raise e.BadContentType(flask.request.content_type or "unknown")
 
+    def cursor(self) -> Optional[r.Cursor]:
+        """Find the page of links requested by the `after` or `before` query parameters"""
+        return r.Cursor.from_args(flask.request.args)
+
     def require_authentication(self, name: str) -> m.User:
         """
         Check that the currently logged-in user exists and is the
@@ -106,8 +117,74 @@ class Endpoint:
 
         return self.user
 
+    def version(self, *args, **kwargs) -> Optional[str]:
+        """
+        The version of the data that a GET of this endpoint shows. An
+        endpoint that has one gives each response an ETag made from
+        it, and can answer a request whose If-None-Match has that ETag
+        without doing any of the work of building the page again.
+        """
+        return None
+
+    def etag(self, *args, **kwargs) -> Optional[str]:
+        version = self.version(*args, **kwargs)
+        if version is None:
+            return None
+        # a response also depends on who's asking, which page of links
+        # they asked for (and as HTML or JSON), and how it's rendered
+        parts = [
+            self.user.name if self.user else "",
+            version,
+            flask.request.full_path,
+            flask.request.content_type or "",
+            TEMPLATES.version(),
+        ]
+        return hashlib.sha1("\0".join(parts).encode()).hexdigest()
+
     def route(self, *args, **kwargs):
-        """Forward to the appropriate routing method"""
+        """Forward to the appropriate routing method, timing it if asked to"""
+        if not c.app.config.timing:
+            return self.conditional(*args, **kwargs)
+        with timing.request() as times:
+            response = flask.make_response(self.conditional(*args, **kwargs))
+        timing.report(times, response)
+        return response
+
+    def conditional(self, *args, **kwargs):
+        """
+        Respond to the request, or just tell the client that the copy
+        it already has is current, if its If-None-Match says so
+        """
+        if flask.request.method not in ["GET", "HEAD"]:
+            return self.respond(*args, **kwargs)
+        etag = self._etag = self.etag(*args, **kwargs)
+        if etag is None:
+            return self.respond(*args, **kwargs)
+        if flask.request.if_none_match.contains_weak(etag):
+            response = flask.Response(status=304)
+        else:
+            response = flask.make_response(self.respond(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # the browser has to check whether a page has changed every
+        # time, and shouldn't share it with anyone else
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    def fragment(self, build: Callable[[], str]) -> str:
+        """
+        Build part of a page, or reuse it from the page cache. Only what
+        anonymous visitors see is cached, since it's the same for all
+        of them. The key is the page's ETag, which changes with every
+        write to the data behind the page, so a write never has to go
+        looking for the copies it made out of date.
+        """
+        if self.user is not None:
+            return build()
+        return fragments.fetch(self._etag, build)
+
+    def respond(self, *args, **kwargs):
         try:
             if flask.request.method == "POST":
                 # all POST methods are "API methods": if we want to
@@ -130,7 +207,12 @@ class Endpoint:
                 # I like using the HTTP headers to distinguish these
                 # cases, while other APIs tend to have a separate /api
                 # endpoint to do this.
-                return flask.jsonify(self.api_get(*args, **kwargs).response)  # type: ignore
+                result = self.api_get(*args, **kwargs)  # type: ignore
+                if isinstance(result, ApiOK):
+                    return flask.jsonify(result.response)
+                # some endpoints (like exports) send a response of
+                # their own, rather than data to turn into JSON
+                return result
         # if an exception arose from an "API method", then we should
         # report it as JSON
         except e.LCException as exn:
@@ -195,14 +277,109 @@ def endpoint(route: str):
     return do_endpoint
 
 
-LOADER = pystache.loader.Loader(extension="mustache", search_dirs=["templates"])
+class CachingRenderEngine(pystache.renderengine.RenderEngine):
+    """
+    A render engine which parses each template only once. pystache
+    parses a partial every time it's used, which for `link` is once
+    per link on the page.
+    """
+
+    PARSED: LRUCache[Tuple[str, Optional[tuple]], pystache.parsed.ParsedTemplate] = (
+        LRUCache(size=256)
+    )
+
+    def render(self, template, context_stack, delimiters=None):
+        key = (template, delimiters)
+        if (parsed := self.PARSED.get(key)) is None:
+            parsed = pystache.parser.parse(template, delimiters)
+            self.PARSED.put(key, parsed)
+        return parsed.render(self, context_stack)
+
+
+class Templates(pystache.Renderer):
+    """
+    Renders the Mustache templates in `path`, reading each one from
+    disk only the first time it's used. In debug mode, a template
+    which has changed since then is read again.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(missing_tags="strict", partials=self)
+        self.path = path
+        self.lock = threading.Lock()
+        # each template's source, and the mtime of its file when read
+        self.sources: Dict[str, Tuple[float, str]] = {}
+        self.digest: Optional[str] = None
+
+    def get(self, name: str) -> Optional[str]:
+        """Find the source of a template (which is how partials are found, too)"""
+        filename = os.path.join(self.path, f"{name}.mustache")
+        known = self.sources.get(name)
+        if known is not None and not c.app.app.debug:
+            return known[1]
+        try:
+            mtime = os.stat(filename).st_mtime
+            if known is not None and known[0] == mtime:
+                return known[1]
+            with open(filename, encoding="utf-8") as f:
+                source = f.read()
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            self.sources[name] = (mtime, source)
+        return source
+
+    def _make_render_engine(self):
+        return CachingRenderEngine(
+            literal=self._to_unicode_hard,
+            escape=self._escape_to_unicode,
+            resolve_context=self._make_resolve_context(),
+            resolve_partial=self._make_resolve_partial(),
+            to_str=self.str_coerce,
+        )
+
+    def version(self) -> str:
+        """A digest of every template, which changes when any of them do"""
+        if self.digest is None or c.app.app.debug:
+            digest = hashlib.sha1()
+            for filename in sorted(os.listdir(self.path)):
+                if filename.endswith(".mustache"):
+                    with open(os.path.join(self.path, filename), "rb") as f:
+                        digest.update(filename.encode())
+                        digest.update(f.read())
+            self.digest = digest.hexdigest()
+        return self.digest
+
+    def render_name(self, name: str, data: Optional[v.View] = None) -> str:
+        source = self.get(name)
+        if source is None:
+            raise pystache.common.TemplateNotFoundError(f"No template named {name}")
+        return self.render(source, data or {})
+
+
+TEMPLATES = Templates("templates")
 
 
 def render(name: str, data: Optional[v.View] = None) -> str:
-    """Load and use a Mustache template from the project root"""
-    template = LOADER.load_name(name)
-    renderer = pystache.Renderer(missing_tags="strict", search_dirs=["templates"])
-    return renderer.render(template, data or {})
+    """Use a Mustache template from the project root"""
+    times = timing.current()
+    if times is None:
+        return TEMPLATES.render_name(name, data)
+    start = time.perf_counter()
+    try:
+        return TEMPLATES.render_name(name, data)
+    finally:
+        times.rendered(name, time.perf_counter() - start)
+
+
+@c.app.app.before_request
+def connect_db():
+    c.app.connect_db()
+
+
+@c.app.app.teardown_request
+def release_db(_exn):
+    c.app.release_db()
 
 
 @c.app.app.errorhandler(404)
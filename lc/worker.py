@@ -0,0 +1,84 @@
+import os
+import threading
+from typing import Optional
+
+import lc.config as c
+import lc.model as m
+
+
+class ImportWorker:
+    """
+    Runs queued import jobs on a background thread. The thread starts
+    with the first request that a process serves, so a process that
+    only forks the ones which serve requests (like gunicorn's, with
+    --preload) never runs imports itself. It checks for queued jobs
+    every so often in case another process queued them, which is also
+    when it fails jobs left running by a process that stopped.
+    """
+
+    POLL_SECONDS = 30
+
+    def __init__(self, threaded: bool = True):
+        self.threaded = threaded
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        # whether this process is meant to be running the thread
+        self.started = False
+
+    def start(self):
+        """Start the thread, if it isn't running, and look for jobs straight away"""
+        if not self.threaded:
+            return
+        with self.lock:
+            self.started = True
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.loop, name="import-worker", daemon=True
+                )
+                self.thread.start()
+        self.wakeup.set()
+
+    def ensure_started(self):
+        if not self.started:
+            self.start()
+
+    def wake(self):
+        self.start()
+
+    def restart_after_fork(self):
+        """
+        A forked process only has the thread that forked it, so it
+        needs a worker thread of its own
+        """
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        if self.started:
+            self.start()
+
+    def loop(self):
+        while True:
+            self.wakeup.wait(timeout=self.POLL_SECONDS)
+            self.wakeup.clear()
+            try:
+                with c.app.db.connection_context():
+                    self.run_pending()
+            except Exception as exn:
+                c.log(f"import worker: {exn!r}")
+
+    def run_pending(self) -> int:
+        """
+        Run queued jobs until there are none left, returning how many
+        were run
+        """
+        m.ImportJob.fail_stale(c.app.config.import_timeout)
+        count = 0
+        while job := m.ImportJob.claim_next():
+            job.run()
+            count += 1
+        return count
+
+
+worker = ImportWorker()
+os.register_at_fork(after_in_child=worker.restart_after_fork)
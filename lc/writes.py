@@ -0,0 +1,101 @@
+import collections
+import functools
+import random
+import threading
+import time
+from typing import Callable, Deque, TypeVar
+
+import peewee
+
+import lc.config as c
+import lc.error as e
+import lc.view as v
+
+T = TypeVar("T")
+
+
+class WriteCoordinator:
+    """
+    Funnels every write to the database through one place. Within a
+    process, writers queue up on a lock and take turns. Across
+    processes, each write runs in a BEGIN IMMEDIATE transaction, which
+    takes SQLite's write lock before doing anything else: a
+    transaction that reads first and only then writes can fail with
+    SQLITE_BUSY straight away, if another process wrote in between.
+    If the lock can't be had within the busy timeout, the whole write
+    is retried after a jittered and growing delay, so that writers
+    which collided once don't keep on colliding.
+    """
+
+    # how many of the most recent lock waits to keep for percentiles
+    SAMPLES = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits: Deque[float] = collections.deque(maxlen=self.SAMPLES)
+        self.writes = 0
+        self.retries = 0
+        self.failures = 0
+
+    def run(self, write: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Call `write` in its own transaction, unless we're already
+        inside one, in which case that transaction is the one that
+        gets retried
+        """
+        db = c.app.db
+        if db.in_transaction():
+            return write(*args, **kwargs)
+
+        start = time.monotonic()
+        attempts = 0
+        while True:
+            try:
+                with self.lock:
+                    with db.atomic("IMMEDIATE"):
+                        waited = time.monotonic() - start
+                        result = write(*args, **kwargs)
+                    self.writes += 1
+                    self.waits.append(waited)
+                return result
+            except peewee.OperationalError as exn:
+                if "locked" not in str(exn) and "busy" not in str(exn):
+                    raise
+                attempts += 1
+                with self.lock:
+                    if attempts > c.app.config.db_write_retries:
+                        self.failures += 1
+                        raise e.DatabaseBusy()
+                    self.retries += 1
+            backoff = c.app.config.db_write_backoff_ms / 1000 * 2**attempts
+            time.sleep(random.uniform(0, backoff))
+
+    def stats(self) -> v.WriteStats:
+        with self.lock:
+            waits = sorted(self.waits)
+            writes, retries, failures = self.writes, self.retries, self.failures
+
+        def percentile(p: float) -> float:
+            return waits[int(p * (len(waits) - 1))] * 1000 if waits else 0.0
+
+        return v.WriteStats(
+            writes=writes,
+            retries=retries,
+            failures=failures,
+            wait_p50_ms=percentile(0.5),
+            wait_p99_ms=percentile(0.99),
+            wait_max_ms=percentile(1.0),
+        )
+
+
+coordinator = WriteCoordinator()
+
+
+def writes(method: Callable[..., T]) -> Callable[..., T]:
+    """Make every call to the decorated method a coordinated write"""
+
+    @functools.wraps(method)
+    def coordinated(*args, **kwargs) -> T:
+        return coordinator.run(method, *args, **kwargs)
+
+    return coordinated
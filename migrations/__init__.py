@@ -0,0 +1,10 @@
+from migrations import m_0001_add_meta_table  # noqa: F401
+from migrations import m_0002_add_link_counts  # noqa: F401
+from migrations import m_0003_add_link_index  # noqa: F401
+from migrations import m_0004_add_tag_closure  # noqa: F401
+from migrations import m_0005_add_tag_pairs  # noqa: F401
+from migrations import m_0006_add_import_jobs  # noqa: F401
+from migrations import m_0007_add_query_indexes  # noqa: F401
+from migrations import m_0008_add_user_versions  # noqa: F401
+from migrations import m_0009_add_link_changes  # noqa: F401
+from migrations import m_0010_add_import_heartbeats  # noqa: F401
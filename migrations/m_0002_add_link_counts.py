@@ -0,0 +1,38 @@
+import peewee
+import playhouse.migrate
+
+import lc.config
+from lc.migration import migration
+
+# This migration adds the maintained link counters on users and tags,
+# and then fills them in from the existing links. The counting is
+# written out here rather than left to the model, which is free to
+# change in ways this schema can't support yet.
+
+RECOUNT = """
+UPDATE "user" SET
+  "link_count" = (SELECT COUNT(*) FROM "link" WHERE "link"."user_id" = "user"."id"),
+  "public_link_count" = (
+    SELECT COUNT(*) FROM "link"
+    WHERE "link"."user_id" = "user"."id" AND "link"."private" = 0
+  );
+UPDATE "tag" SET
+  "link_count" = (SELECT COUNT(*) FROM "hastag" WHERE "hastag"."tag_id" = "tag"."id"),
+  "public_link_count" = (
+    SELECT COUNT(*) FROM "hastag" JOIN "link" ON "link"."id" = "hastag"."link_id"
+    WHERE "hastag"."tag_id" = "tag"."id" AND "link"."private" = 0
+  );
+"""
+
+
+@migration
+def run(m):
+    playhouse.migrate.migrate(
+        m.add_column("user", "link_count", peewee.IntegerField(default=0)),
+        m.add_column("user", "public_link_count", peewee.IntegerField(default=0)),
+        m.add_column("tag", "link_count", peewee.IntegerField(default=0)),
+        m.add_column("tag", "public_link_count", peewee.IntegerField(default=0)),
+    )
+    for statement in RECOUNT.split(";"):
+        if statement.strip():
+            lc.config.app.db.execute_sql(statement)
@@ -0,0 +1,11 @@
+import lc.model
+from lc.migration import migration
+
+# This migration creates the full-text search index over links and
+# fills it in from the existing links
+
+
+@migration
+def run(m):
+    lc.model.LinkIndex.create_table(safe=True)
+    lc.model.LinkIndex.reindex_all()
@@ -0,0 +1,11 @@
+import lc.model
+from lc.migration import migration
+
+# This migration creates the closure table for the tag hierarchy and
+# fills it in from the existing tags
+
+
+@migration
+def run(m):
+    lc.model.TagClosure.create_table(safe=True)
+    lc.model.TagClosure.rebuild()
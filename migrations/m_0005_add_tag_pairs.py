@@ -0,0 +1,11 @@
+import lc.model
+from lc.migration import migration
+
+# This migration creates the tag co-occurrence table and fills it in
+# from the existing tagged links
+
+
+@migration
+def run(m):
+    lc.model.TagPair.create_table(safe=True)
+    lc.model.TagPair.rebuild()
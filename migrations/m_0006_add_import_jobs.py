@@ -0,0 +1,9 @@
+import lc.model
+from lc.migration import migration
+
+# This migration creates the table of background import jobs
+
+
+@migration
+def run(m):
+    lc.model.ImportJob.create_table(safe=True)
@@ -0,0 +1,74 @@
+import peewee
+import playhouse.migrate
+
+import lc.config
+import lc.model
+from lc.migration import migration
+
+# This migration adds the composite indexes that the link and tag
+# queries are answered from, and drops the single-column foreign key
+# indexes that they make redundant. A link can only have a tag once,
+# so any duplicate tagging is cleared out first. The indexes are named
+# here, rather than taken from the models, since later migrations add
+# indexes to the models on columns that don't exist yet.
+
+INDEXES = [
+    # a user's links, newest first
+    ("link", ("user_id", "created"), False),
+    # everyone's public links, newest first
+    ("link", ("private", "created"), False),
+    ("tag", ("user_id", "name"), False),
+    ("hastag", ("link_id", "tag_id"), True),
+    ("hastag", ("tag_id", "link_id"), False),
+    ("tagclosure", ("ancestor_id", "descendant_id"), True),
+    ("tagclosure", ("descendant_id", "depth"), False),
+]
+
+REDUNDANT = [
+    ("link", "link_user_id"),
+    ("tag", "tag_user_id"),
+    ("hastag", "hastag_link_id"),
+    ("hastag", "hastag_tag_id"),
+    ("tagclosure", "tagclosure_ancestor_id"),
+    ("tagclosure", "tagclosure_descendant_id"),
+    ("tagpair", "tagpair_tag_id"),
+]
+
+RECOUNT_TAGS = """
+UPDATE "tag" SET
+  "link_count" = (SELECT COUNT(*) FROM "hastag" WHERE "hastag"."tag_id" = "tag"."id"),
+  "public_link_count" = (
+    SELECT COUNT(*) FROM "hastag" JOIN "link" ON "link"."id" = "hastag"."link_id"
+    WHERE "hastag"."tag_id" = "tag"."id" AND "link"."private" = 0
+  )
+"""
+
+
+@migration
+def run(m):
+    HasTag = lc.model.HasTag
+    first = HasTag.select(peewee.fn.MIN(HasTag.id)).group_by(HasTag.link, HasTag.tag)
+    duplicates = HasTag.delete().where(HasTag.id.not_in(first)).execute()  # type: ignore
+
+    db = lc.config.app.db
+
+    def exists(table: str, name: str) -> bool:
+        return name in {index.name for index in db.get_indexes(table)}
+
+    # the closure table was made with its indexes already
+    playhouse.migrate.migrate(
+        *(
+            m.add_index(table, columns, unique)
+            for table, columns, unique in INDEXES
+            if not exists(table, "_".join((table, *columns)))
+        ),
+        *(
+            m.drop_index(table, name)
+            for table, name in REDUNDANT
+            if exists(table, name)
+        ),
+    )
+    if duplicates:
+        # only tags' counters counted the duplicates
+        db.execute_sql(RECOUNT_TAGS)
+        lc.model.TagPair.rebuild()
@@ -0,0 +1,14 @@
+import peewee
+import playhouse.migrate
+
+from lc.migration import migration
+
+# This migration adds the version that goes up with every write to a
+# user's links or tags, which is what link pages' ETags come from
+
+
+@migration
+def run(m):
+    playhouse.migrate.migrate(
+        m.add_column("user", "version", peewee.IntegerField(default=0)),
+    )
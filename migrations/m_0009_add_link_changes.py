@@ -0,0 +1,23 @@
+import datetime
+import peewee
+import playhouse.migrate
+
+import lc.model
+from lc.migration import migration
+
+# This migration records when each link last changed, and which
+# version of its user's links that change made, and adds the table of
+# deleted links, so that clients can fetch just what has changed
+
+
+@migration
+def run(m):
+    playhouse.migrate.migrate(
+        m.add_column(
+            "link", "modified", peewee.DateTimeField(default=datetime.datetime.now)
+        ),
+        m.add_column("link", "revision", peewee.IntegerField(default=0)),
+        m.add_index("link", ("user_id", "revision"), False),
+    )
+    lc.model.Link.update(modified=lc.model.Link.created).execute()
+    lc.model.DeletedLink.create_table(safe=True)
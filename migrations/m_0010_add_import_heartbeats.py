@@ -0,0 +1,19 @@
+import peewee
+import playhouse.migrate
+
+import lc.config
+from lc.migration import migration
+
+# This migration adds the time that an import job last reported its
+# progress, which is how abandoned jobs are told apart from slow ones
+
+
+@migration
+def run(m):
+    # migration 6 creates the table from the model, so databases that
+    # ran it after the column was added there already have it
+    columns = {column.name for column in lc.config.app.db.get_columns("importjob")}
+    if "heartbeat" not in columns:
+        playhouse.migrate.migrate(
+            m.add_column("importjob", "heartbeat", peewee.DateTimeField(null=True)),
+        )
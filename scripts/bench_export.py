@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Measure how fast a user's links are streamed out by the JSON and HTML
+export endpoints, and the peak memory of the exporting process, for
+accounts of a few different sizes. Each export runs in a fresh
+process, so the peak isn't from filling the database.
+"""
+
+import argparse
+import datetime
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import lc.app as a
+import lc.config as c
+import lc.model as m
+import lc.request as r
+
+
+def fake_links(start: int, n: int) -> list:
+    return [
+        r.PinboardLink(
+            href=f"https://example.com/{i}",
+            description=f"Link number {i}",
+            extended="some words about the link " * 3,
+            time=datetime.datetime(2010 + i % 10, 1, 1, 0, 0, i % 60),
+            shared=i % 2 == 0,
+            tags=[f"topic{i % 40}/sub{i % 5}", f"tag{i % 200}"],
+        )
+        for i in range(start, start + n)
+    ]
+
+
+def seed(path: str, links: int):
+    c.app.db.init(path, pragmas=c.app.db_pragmas())
+    m.create_tables()
+    u = m.User.from_request(r.User(name="bench", password="bench"))
+    for start in range(0, links, 10000):
+        u.import_links(fake_links(start, min(10000, links - start)))
+    c.app.db.close()
+
+
+def export(path: str, kind: str):
+    """Run in its own process: stream one export and report on it"""
+    c.app.config.db_path = path
+    c.app.init_db()
+    client = a.app.test_client()
+    client.post("/auth", json={"name": "bench", "password": "bench"})
+    start = time.monotonic()
+    response = client.get(f"/u/bench/export.{kind}", buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    seconds = time.monotonic() - start
+    response.close()
+    links = m.User.by_slug("bench").link_count
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"{links:>8} links as {kind:>4}: {links / seconds:.0f} links/s, "
+        f"{size / 1024 / 1024:.1f}MB in {seconds:.2f}s, peak RSS {peak_mb:.0f}MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--links",
+        default="10000,100000",
+        help="comma-separated account sizes to export",
+    )
+    parser.add_argument("--export", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.export:
+        export(*args.export)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for links in (int(n) for n in args.links.split(",")):
+            path = os.path.join(tmp, f"{links}.db")
+            seed(path, links)
+            for kind in ("json", "html"):
+                subprocess.run(
+                    [sys.executable, __file__, "--export", path, kind], check=True
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Compare importing a synthetic Pinboard export in bulk against adding
+the same links one at a time through the ordinary model methods.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import lc.config as c
+import lc.model as m
+import lc.request as r
+
+
+def fake_export(n: int) -> list:
+    rng = random.Random(0)
+    tags = [f"topic{i}/sub{j}" for i in range(40) for j in range(5)]
+    tags += [f"tag{i}" for i in range(200)]
+    return [
+        {
+            "href": f"https://example.com/{i}",
+            "description": f"Link number {i}",
+            "extended": "some words about the link " * 3,
+            "time": f"20{10 + i % 10}-01-01T00:00:{i % 60:02}Z",
+            "shared": rng.choice(["yes", "no"]),
+            "tags": " ".join(rng.sample(tags, rng.randint(1, 5))),
+        }
+        for i in range(n)
+    ]
+
+
+def fresh_db(path: str) -> m.User:
+    c.app.db.init(path)
+    m.create_tables()
+    return m.User.create(name="bench", passhash="")
+
+
+def bench_bulk(path: str, export: list) -> float:
+    u = fresh_db(path)
+    start = time.monotonic()
+    u.import_pinboard_data(io.StringIO(json.dumps(export)))
+    return time.monotonic() - start
+
+
+def bench_one_at_a_time(path: str, export: list) -> float:
+    u = fresh_db(path)
+    start = time.monotonic()
+    with c.app.db.atomic():
+        for entry in export:
+            link = r.PinboardLink.from_export(entry)
+            m.Link.from_request(
+                u,
+                r.Link(
+                    url=link.href,
+                    name=link.description,
+                    description=link.extended,
+                    private=not link.shared,
+                    tags=link.tags,
+                    created=link.time,
+                ),
+            )
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=5000, help="number of links")
+    args = parser.parse_args()
+
+    export = fake_export(args.n)
+    with tempfile.TemporaryDirectory() as tmp:
+        slow = bench_one_at_a_time(os.path.join(tmp, "slow.db"), export)
+        fast = bench_bulk(os.path.join(tmp, "fast.db"), export)
+        c.app.close_db()
+
+    print(f"one at a time: {slow:.2f}s ({args.n / slow:.0f} links/s)")
+    print(f"bulk import:   {fast:.2f}s ({args.n / fast:.0f} links/s)")
+    print(f"speedup:       {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""
+Measure login throughput and how long link pages take to load while
+logins are going on, with passwords hashed in the request's thread
+and with them hashed in the LC_PASSWORD_WORKERS worker processes.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import lc.app as a
+import lc.config as c
+import lc.model as m
+import lc.request as r
+
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[int(p * (len(samples) - 1))] * 1000 if samples else 0.0
+
+
+def bench(path: str, workers: int, seconds: float, logins: int, readers: int) -> dict:
+    c.app.config.password_workers = workers
+    c.app.db.init(path, pragmas=c.app.db_pragmas())
+    m.create_tables()
+    m.User.from_request(r.User(name="bench", password="bench"))
+    c.app.db.close()
+
+    done = threading.Event()
+    lock = threading.Lock()
+    results: dict = {"logins": 0, "latencies": []}
+
+    def login():
+        client = a.app.test_client()
+        count = 0
+        while not done.is_set():
+            client.post("/auth", json={"name": "bench", "password": "bench"})
+            count += 1
+        with lock:
+            results["logins"] += count
+
+    def read():
+        client = a.app.test_client()
+        latencies = []
+        while not done.is_set():
+            start = time.monotonic()
+            client.get("/u/bench")
+            latencies.append(time.monotonic() - start)
+        with lock:
+            results["latencies"].extend(latencies)
+
+    threads = [threading.Thread(target=login) for _ in range(logins)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    done.set()
+    for t in threads:
+        t.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10, help="how long to run")
+    parser.add_argument("--logins", type=int, default=4, help="logging-in threads")
+    parser.add_argument("--readers", type=int, default=4, help="page-reading threads")
+    args = parser.parse_args()
+
+    settings = {
+        "in thread": 0,
+        "in workers": max(c.app.config.password_workers, 1),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, workers in settings.items():
+            path = os.path.join(tmp, f"{workers}.db")
+            result = bench(path, workers, args.seconds, args.logins, args.readers)
+            latencies = result["latencies"]
+            print(
+                f"{name:>10}: {result['logins'] / args.seconds:.1f} logins/s, "
+                f"{len(latencies) / args.seconds:.0f} pages/s, "
+                f"page p50 {percentile(latencies, 0.5):.1f}ms "
+                f"p99 {percentile(latencies, 0.99):.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
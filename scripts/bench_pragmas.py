@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+Measure how many link pages can be read while a large write is in
+progress, with SQLite's default settings and with the settings from
+the LC_DB_* configuration.
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import lc.config as c
+import lc.model as m
+import lc.request as r
+
+
+def fake_links(start: int, n: int) -> list:
+    return [
+        r.PinboardLink(
+            href=f"https://example.com/{i}",
+            description=f"Link number {i}",
+            extended="some words about the link " * 3,
+            time=datetime.datetime(2010 + i % 10, 1, 1, 0, 0, i % 60),
+            shared=i % 2 == 0,
+            tags=[f"topic{i % 40}/sub{i % 5}", f"tag{i % 200}"],
+        )
+        for i in range(start, start + n)
+    ]
+
+
+def bench(path: str, pragmas: dict, seed: int, writes: int, readers: int) -> dict:
+    c.app.db.init(path, pragmas=pragmas)
+    m.create_tables()
+    u = m.User.create(name="bench", passhash="")
+    with c.app.db.atomic():
+        u.import_links(fake_links(0, seed))
+    c.app.db.close()
+
+    writing = threading.Event()
+    done = threading.Event()
+    counts = {"reads": 0, "locked": 0}
+    lock = threading.Lock()
+
+    def write():
+        with c.app.db.connection_context():
+            with c.app.db.atomic():
+                writing.set()
+                u.import_links(fake_links(seed, writes))
+        done.set()
+
+    def read():
+        reads = locked = 0
+        with c.app.db.connection_context():
+            writing.wait()
+            while not done.is_set():
+                try:
+                    m.User.by_slug("bench").get_links(as_user=None)
+                    reads += 1
+                except sqlite3.OperationalError:
+                    locked += 1
+        with lock:
+            counts["reads"] += reads
+            counts["locked"] += locked
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads.append(threading.Thread(target=write))
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.monotonic() - start
+    return {**counts, "seconds": seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, default=5000, help="links to start with")
+    parser.add_argument("--writes", type=int, default=20000, help="links to write")
+    parser.add_argument("--readers", type=int, default=4, help="reading threads")
+    args = parser.parse_args()
+
+    settings = {
+        # SQLite's defaults, plus the timeout that Python sets
+        "default": {"busy_timeout": 5000},
+        "configured": c.app.db_pragmas(),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, pragmas in settings.items():
+            path = os.path.join(tmp, f"{name}.db")
+            result = bench(path, pragmas, args.seed, args.writes, args.readers)
+            print(
+                f"{name:>10}: {result['reads']} pages read "
+                f"({result['reads'] / result['seconds']:.0f}/s) "
+                f"and {result['locked']} failed on locks "
+                f"during a {result['seconds']:.2f}s write"
+            )
+
+
+if __name__ == "__main__":
+    main()
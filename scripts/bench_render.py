@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Measure how long it takes to render a user's page of links, reading
+and parsing the templates on every render (as we used to) and with
+the cached templates from lc.web.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pystache
+
+import lc.config as c
+import lc.model as m
+import lc.request as r
+import lc.view as v
+import lc.web as w
+
+LOADER = pystache.loader.Loader(extension="mustache", search_dirs=["templates"])
+
+
+def uncached_render(name: str, data: v.View) -> str:
+    template = LOADER.load_name(name)
+    renderer = pystache.Renderer(missing_tags="strict", search_dirs=["templates"])
+    return renderer.render(template, data)
+
+
+def user_page(u: m.User, linklist: v.LinkList, render) -> str:
+    return render(
+        "main",
+        v.Page(title=f"user {u.name}", content=render("linklist", linklist), user=u),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=200, help="pages to render")
+    args = parser.parse_args()
+
+    c.app.in_memory_db()
+    m.create_tables()
+    u = m.User.create(name="bench", passhash="")
+    for i in range(c.app.per_page):
+        m.Link.from_request(
+            u,
+            r.Link(
+                f"https://example.com/{i}",
+                f"Link number {i}",
+                "some words about the link " * 3,
+                i % 2 == 0,
+                [f"topic{i % 10}/sub{i % 3}", f"tag{i % 20}"],
+            ),
+        )
+
+    links, pages = u.get_links(as_user=u)
+    linklist = v.LinkList(links=links, user=u.name, pages=pages, tags=u.get_tags())
+
+    assert user_page(u, linklist, uncached_render) == user_page(u, linklist, w.render)
+    for name, render in (("uncached", uncached_render), ("cached", w.render)):
+        start = time.monotonic()
+        for _ in range(args.pages):
+            user_page(u, linklist, render)
+        seconds = time.monotonic() - start
+        print(f"{name:>8}: {seconds / args.pages * 1000:.2f}ms per page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import lc.config as c
+import lc.model as m
+
+
+def main():
+    c.app.init_db()
+    with c.app.db.atomic():
+        m.Tag.clean_all()
+    c.log("deleted unused tags")
+
+
+if __name__ == "__main__":
+    main()
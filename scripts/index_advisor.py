@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+Run every query method against a scratch database and report any
+query whose plan reads or sorts a whole table.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import lc.advisor
+import lc.config as c
+import lc.model as m
+
+
+def main():
+    c.app.in_memory_db()
+    m.create_tables()
+    found = lc.advisor.advise()
+    for query, steps in found.items():
+        print(query)
+        for step in steps:
+            print(f"  {step}")
+    if found:
+        sys.exit(1)
+    c.log("no unexpected table scans or sorts")
+
+
+if __name__ == "__main__":
+    main()
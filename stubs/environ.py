@@ -1,3 +1,5 @@
+# mypy: disable-error-code="empty-body"
+
 from typing import Any, TypeVar, Type
 
 T = TypeVar("T")
@@ -7,7 +9,11 @@ def config(prefix: str) -> Any:
     pass
 
 
-def var(default: str = "") -> str:
+def var(default: Any = "", converter: Any = None) -> Any:
+    pass
+
+
+def bool_var(default: bool = False) -> Any:
     pass
 
 
@@ -1,3 +1,8 @@
+# mypy: disable-error-code="empty-body"
+
+import typing
+
+
 class custom_app_context:
     @staticmethod
     def hash(password: str) -> str:
@@ -6,3 +11,7 @@ class custom_app_context:
     @staticmethod
     def verify(password: str, hash: str) -> bool:
         pass
+
+    @staticmethod
+    def schemes() -> typing.Tuple[str, ...]:
+        pass
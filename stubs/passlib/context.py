@@ -0,0 +1,16 @@
+# mypy: disable-error-code="empty-body"
+
+import typing
+
+
+class CryptContext:
+    def __init__(self, schemes: typing.List[str], **kwargs: typing.Any):
+        pass
+
+    def hash(self, password: str) -> str:
+        pass
+
+    def verify_and_update(
+        self, password: str, hash: str
+    ) -> typing.Tuple[bool, typing.Optional[str]]:
+        pass
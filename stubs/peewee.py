@@ -1,4 +1,6 @@
-from typing import Any, Optional, TypeVar, Type
+# mypy: disable-error-code="empty-body"
+
+from typing import Any, Dict, Optional, TypeVar, Type
 
 
 class Expression:
@@ -10,6 +12,7 @@ T = TypeVar("T", bound="Model")
 
 class Model:
     id: int
+    __data__: Dict[str, Any]
 
     class DoesNotExist(Exception):
         pass
@@ -27,7 +30,31 @@ class Model:
         pass
 
     @classmethod
-    def select(self, expr: Optional[Expression] = None):
+    def get_by_id(cls: Type[T], pk: Any) -> T:
+        pass
+
+    @classmethod
+    def select(self, *fields: Any) -> Any:
+        pass
+
+    @classmethod
+    def update(cls, *args: Any, **kwargs: Any) -> Any:
+        pass
+
+    @classmethod
+    def insert_many(cls, rows: Any, fields: Any = None) -> Any:
+        pass
+
+    @classmethod
+    def insert_from(cls, query: Any, fields: Any) -> Any:
+        pass
+
+    @classmethod
+    def table_exists(cls) -> bool:
+        pass
+
+    @classmethod
+    def create_table(cls, safe: bool = True) -> Any:
         pass
 
     def save(self):
@@ -51,7 +78,7 @@ def TextField(default: str = "", unique: bool = False, null: bool = None) -> Any
     pass
 
 
-def DateTimeField(unique: bool = False, null: bool = None) -> Any:
+def DateTimeField(default: Any = None, unique: bool = False, null: bool = None) -> Any:
     pass
 
 
@@ -59,7 +86,9 @@ def BooleanField(default: bool = False, unique: bool = False, null: bool = None)
     pass
 
 
-def ForeignKeyField(key: object, null: bool = None, backref: str = "") -> Any:
+def ForeignKeyField(
+    key: object, null: bool = None, backref: str = "", index: bool = True
+) -> Any:
     pass
 
 
@@ -71,5 +100,22 @@ class IntegrityError(Exception):
     pass
 
 
+class OperationalError(Exception):
+    pass
+
+
 JOIN: Any = None
 fn: Any = None
+EXCLUDED: Any = None
+
+
+def Value(value: Any) -> Any:
+    pass
+
+
+def chunked(it: Any, n: int) -> Any:
+    pass
+
+
+def Tuple(*args: Any) -> Any:
+    pass
@@ -1,6 +1,18 @@
+# mypy: disable-error-code="empty-body"
+
 import typing
 
 
 class SqliteMigrator:
     def __init__(self, db: typing.Any):
         pass
+
+    def add_column(self, table: str, column_name: str, field: typing.Any) -> typing.Any:
+        pass
+
+    def drop_index(self, table: str, index_name: str) -> typing.Any:
+        pass
+
+
+def migrate(*operations: typing.Any):
+    pass
@@ -0,0 +1,24 @@
+# mypy: disable-error-code="empty-body"
+
+import typing
+
+from playhouse.sqlite_ext import SqliteExtDatabase
+
+
+class PooledDatabase:
+    _connections: typing.Any
+    _in_use: typing.Any
+
+    def close_all(self):
+        pass
+
+
+class PooledSqliteExtDatabase(PooledDatabase, SqliteExtDatabase):
+    def __init__(
+        self,
+        path: typing.Optional[str],
+        max_connections: int = 20,
+        timeout: typing.Optional[int] = None,
+        **kwargs: typing.Any,
+    ):
+        pass
@@ -1,14 +1,42 @@
+# mypy: disable-error-code="empty-body"
+
 import typing
 
+import peewee
+
 
 class SqliteExtDatabase:
+    database: typing.Optional[str]
+    _state: typing.Any
+
     def __init__(self, path: typing.Optional[str]):
         pass
 
-    def atomic(self):
+    def atomic(self, lock_type: typing.Optional[str] = None) -> typing.Any:
+        pass
+
+    def execute_sql(self, sql: str, params: typing.Any = None) -> typing.Any:
+        pass
+
+    def in_transaction(self) -> bool:
+        pass
+
+    def connect(self, reuse_if_open: bool = False) -> bool:
+        pass
+
+    def connection(self) -> typing.Any:
+        pass
+
+    def connection_context(self) -> typing.Any:
+        pass
+
+    def bind_ctx(self, models: typing.List[typing.Any]) -> typing.Any:
+        pass
+
+    def is_closed(self) -> bool:
         pass
 
-    def init(self, path: str):
+    def init(self, path: str, pragmas: typing.Optional[typing.Any] = None):
         pass
 
     def close(self):
@@ -16,3 +44,30 @@ class SqliteExtDatabase:
 
     def create_tables(self, tables: typing.List[typing.Any], safe: bool = True):
         pass
+
+    def get_tables(self) -> typing.List[str]:
+        pass
+
+    def get_columns(self, table: str) -> typing.List[typing.Any]:
+        pass
+
+    def get_indexes(self, table: str) -> typing.List[typing.Any]:
+        pass
+
+
+class FTS5Model(peewee.Model):
+    @classmethod
+    def match(cls, term: str) -> typing.Any:
+        pass
+
+    @classmethod
+    def bm25(cls, *weights: float) -> typing.Any:
+        pass
+
+
+def SearchField() -> typing.Any:
+    pass
+
+
+def RowIDField() -> typing.Any:
+    pass
@@ -1,11 +1,32 @@
-from typing import Any, List
+# mypy: disable-error-code="empty-body"
+
+from typing import Any, Callable, List, Optional
 
 import pystache.loader  # noqa: F401
 
 
 class Renderer:
-    def __init__(self, missing_tags: str, search_dirs: List[str]):
+    str_coerce: Callable[[Any], str]
+
+    def __init__(
+        self,
+        missing_tags: str,
+        search_dirs: Optional[List[str]] = None,
+        partials: Any = None,
+    ):
+        pass
+
+    def render(self, template: Any, kwargs: Any) -> str:
+        pass
+
+    def _to_unicode_hard(self, s: Any) -> str:
+        pass
+
+    def _escape_to_unicode(self, s: Any) -> str:
+        pass
+
+    def _make_resolve_context(self) -> Callable[..., Any]:
         pass
 
-    def render(self, template: Any, kwargs: Any):
+    def _make_resolve_partial(self) -> Callable[[str], str]:
         pass
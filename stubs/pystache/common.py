@@ -0,0 +1,2 @@
+class TemplateNotFoundError(Exception):
+    pass
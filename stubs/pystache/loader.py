@@ -1,3 +1,5 @@
+# mypy: disable-error-code="empty-body"
+
 from typing import Any, List
 
 
@@ -0,0 +1,9 @@
+# mypy: disable-error-code="empty-body"
+
+from typing import Optional
+
+from pystache.parsed import ParsedTemplate
+
+
+def parse(template: str, delimiters: Optional[tuple] = None) -> ParsedTemplate:
+    pass
@@ -0,0 +1,15 @@
+# mypy: disable-error-code="empty-body"
+
+from typing import Any, Callable
+
+
+class RenderEngine:
+    def __init__(
+        self,
+        literal: Callable[[Any], str],
+        escape: Callable[[Any], str],
+        resolve_context: Callable[..., Any],
+        resolve_partial: Callable[[str], str],
+        to_str: Callable[[Any], str],
+    ):
+        pass
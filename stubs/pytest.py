@@ -1,4 +1,6 @@
-from typing import Type
+# mypy: disable-error-code="empty-body"
+
+from typing import Any, Type
 
 
 class RaisesContext:
@@ -11,3 +13,11 @@ class RaisesContext:
 
 def raises(e: Type[Exception]) -> RaisesContext:
     pass
+
+
+class MarkGenerator:
+    def __getattr__(self, name: str) -> Any:
+        pass
+
+
+mark: MarkGenerator
@@ -42,6 +42,47 @@ def migrate(c, port=8080, host="127.0.0.1"):
     )
 
 
+@task
+def recount(c, port=8080, host="127.0.0.1"):
+    """Recompute the stored per-user and per-tag link counters"""
+    c.run(
+        "uv run python scripts/recount.py",
+        env={
+            "FLASK_APP": "lament-configuration.py",
+            "LC_APP_PATH": f"http://{host}:{port}",
+            "LC_DB_PATH": "test.db",
+            "LC_SECRET_KEY": "TESTING_KEY",
+        },
+    )
+
+
+@task
+def clean_tags(c, port=8080, host="127.0.0.1"):
+    """Delete every tag that is no longer used by any link"""
+    c.run(
+        "uv run python scripts/clean_tags.py",
+        env={
+            "FLASK_APP": "lament-configuration.py",
+            "LC_APP_PATH": f"http://{host}:{port}",
+            "LC_DB_PATH": "test.db",
+            "LC_SECRET_KEY": "TESTING_KEY",
+        },
+    )
+
+
+@task
+def advise_indexes(c):
+    """Check that every query method is answered from an index"""
+    c.run(
+        "uv run python scripts/index_advisor.py",
+        env={
+            "LC_APP_PATH": "localhost",
+            "LC_DB_PATH": ":memory:",
+            "LC_SECRET_KEY": "TESTING_KEY",
+        },
+    )
+
+
 @task
 def install(c):
     """Install the listed dependencies into a virtualenv"""
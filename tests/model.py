@@ -1,16 +1,91 @@
+from contextlib import contextmanager
+import datetime
+import io
+import json
+import os
+import peewee
 import pytest
+import sqlite3
+import threading
+from typing import List
 import config  # noqa: F401
 
+import lc.advisor
+from lc.cache import LRUCache
 import lc.config as c
+import lc.fragments
+import lc.migration
+import lc.passwords
 import lc.error as e
 import lc.request as r
 import lc.model as m
+import lc.view as v
+import lc.worker
+import lc.writes
+
+# the schema that databases made before there were any migrations
+# have, which every migration has to be able to start from
+BASELINE_SCHEMA = """
+CREATE TABLE "user" ("id" INTEGER NOT NULL PRIMARY KEY, "name" TEXT NOT NULL,
+  "passhash" TEXT NOT NULL, "is_admin" INTEGER NOT NULL);
+CREATE UNIQUE INDEX "user_name" ON "user" ("name");
+CREATE TABLE "link" ("id" INTEGER NOT NULL PRIMARY KEY, "url" TEXT NOT NULL,
+  "name" TEXT NOT NULL, "description" TEXT NOT NULL, "created" DATETIME NOT NULL,
+  "private" INTEGER NOT NULL, "user_id" INTEGER NOT NULL,
+  FOREIGN KEY ("user_id") REFERENCES "user" ("id"));
+CREATE INDEX "link_user_id" ON "link" ("user_id");
+CREATE TABLE "tag" ("id" INTEGER NOT NULL PRIMARY KEY, "name" TEXT NOT NULL,
+  "parent_id" INTEGER, "user_id" INTEGER NOT NULL,
+  FOREIGN KEY ("parent_id") REFERENCES "tag" ("id"),
+  FOREIGN KEY ("user_id") REFERENCES "user" ("id"));
+CREATE INDEX "tag_parent_id" ON "tag" ("parent_id");
+CREATE INDEX "tag_user_id" ON "tag" ("user_id");
+CREATE TABLE "hastag" ("id" INTEGER NOT NULL PRIMARY KEY,
+  "link_id" INTEGER NOT NULL, "tag_id" INTEGER NOT NULL,
+  FOREIGN KEY ("link_id") REFERENCES "link" ("id"),
+  FOREIGN KEY ("tag_id") REFERENCES "tag" ("id"));
+CREATE INDEX "hastag_link_id" ON "hastag" ("link_id");
+CREATE INDEX "hastag_tag_id" ON "hastag" ("tag_id");
+CREATE TABLE "meta" ("id" INTEGER NOT NULL PRIMARY KEY, "version" INTEGER NOT NULL);
+CREATE TABLE "userinvite" ("id" INTEGER NOT NULL PRIMARY KEY,
+  "token" TEXT NOT NULL, "created_by_id" INTEGER NOT NULL,
+  "created_at" DATETIME NOT NULL, "claimed_by_id" INTEGER, "claimed_at" DATETIME,
+  FOREIGN KEY ("created_by_id") REFERENCES "user" ("id"),
+  FOREIGN KEY ("claimed_by_id") REFERENCES "user" ("id"));
+CREATE UNIQUE INDEX "userinvite_token" ON "userinvite" ("token");
+CREATE INDEX "userinvite_created_by_id" ON "userinvite" ("created_by_id");
+CREATE INDEX "userinvite_claimed_by_id" ON "userinvite" ("claimed_by_id");
+INSERT INTO "meta" VALUES (0, 1);
+INSERT INTO "user" VALUES (1, 'old', '', 0);
+INSERT INTO "link" VALUES
+  (1, 'http://a.com', 'a', '', '2020-01-01 00:00:00', 0, 1),
+  (2, 'http://b.com', 'b', '', '2020-01-02 00:00:00', 1, 1);
+INSERT INTO "tag" VALUES (1, 'food', NULL, 1), (2, 'food/bread', 1, 1);
+-- including a tagging that was made twice
+INSERT INTO "hastag" ("link_id", "tag_id") VALUES (1, 1), (1, 2), (2, 1), (2, 1);
+"""
+
+
+def schema() -> dict:
+    """The columns and indexes of every table in the database"""
+    db = c.app.db
+    tables = {}
+    for table in db.get_tables():
+        columns = [column.name for column in db.get_columns(table)]
+        indexes = {
+            (index.name, tuple(index.columns), index.unique)
+            for index in db.get_indexes(table)
+        }
+        tables[table] = (sorted(columns), indexes)
+    return tables
 
 
 class Testdb:
     def setup_method(self, _):
         c.app.in_memory_db()
         m.create_tables()
+        # the users that tokens were verified for don't exist any more
+        m.User.TOKENS.clear()
 
     def teardown_method(self, _):
         c.app.close_db()
@@ -23,6 +98,23 @@ class Testdb:
             )
         )
 
+    @contextmanager
+    def count_queries(self):
+        """Collect the SQL of every statement run inside the block"""
+        statements = []
+        execute_sql = c.app.db.execute_sql
+
+        def counting_execute_sql(sql, *args, **kwargs):
+            statements.append(sql)
+            return execute_sql(sql, *args, **kwargs)
+
+        c.app.db.execute_sql = counting_execute_sql  # type: ignore
+        try:
+            yield statements
+        finally:
+            # put back whatever was there, which might be the timing hook
+            c.app.db.execute_sql = execute_sql  # type: ignore
+
     def test_create_user(self):
         name = "gdritter"
         u = self.mk_user(name=name)
@@ -48,6 +140,42 @@ class Testdb:
         assert u.authenticate(password)
         assert u.authenticate("wrong password") is False
 
+    def test_password_upgrade(self):
+        settings = c.app.config
+        saved = (settings.password_scheme, settings.password_rounds)
+        u = self.mk_user(password="foo")
+        assert u.passhash.startswith("$6$")
+        try:
+            settings.password_scheme, settings.password_rounds = "sha256_crypt", 1000
+            # the old hash still works, but gets replaced with a new one
+            assert u.authenticate("wrong password") is False
+            assert u.passhash.startswith("$6$")
+            assert u.authenticate("foo")
+            assert u.passhash.startswith("$5$rounds=1000$")
+            assert m.User.by_slug(u.name).passhash == u.passhash
+            # which then doesn't need replacing again
+            assert u.authenticate("foo")
+            assert m.User.by_slug(u.name).passhash == u.passhash
+        finally:
+            settings.password_scheme, settings.password_rounds = saved
+
+    def test_password_workers(self):
+        passwords = lc.passwords.passwords
+        saved = (c.app.config.password_workers, passwords.pool)
+        try:
+            # without workers, passwords are hashed right here
+            c.app.config.password_workers, passwords.pool = 0, None
+            u = self.mk_user(password="foo")
+            assert u.authenticate("foo")
+            assert passwords.pool is None
+            # and otherwise in the pool's processes
+            c.app.config.password_workers = 1
+            assert u.authenticate("foo")
+            assert passwords.pool is not None
+            passwords.pool.shutdown()
+        finally:
+            c.app.config.password_workers, passwords.pool = saved
+
     def test_no_duplicate_users(self):
         name = "gdritter"
         self.mk_user(name=name)
@@ -182,3 +310,715 @@ class Testdb:
         assert link2.private
         assert link2.created != req.created
         self.check_tags(link2, req.tags)
+
+    def test_link_page_query_count(self):
+        u = self.mk_user()
+        other = self.mk_user(name="other")
+
+        def add_links(user, n):
+            for i in range(n):
+                req = r.Link(f"http://{i}.com", f"{i}", "", False, ["a/b", "c"])
+                m.Link.from_request(user, req)
+
+        add_links(u, 2)
+        execute_sql = c.app.db.execute_sql
+        with self.count_queries() as small:
+            links, _ = u.get_links(as_user=u)
+            m.Link.get_all(as_user=other)
+            m.Tag.get(name="c", user=u).get_links(as_user=u)
+        assert len(links) == 2
+        # counting leaves any other hook (like timing's) in place
+        assert c.app.db.execute_sql == execute_sql
+
+        add_links(u, 20)
+        add_links(other, 5)
+        with self.count_queries() as large:
+            links, _ = u.get_links(as_user=u)
+            all_links, _ = m.Link.get_all(as_user=other)
+            m.Tag.get(name="c", user=u).get_links(as_user=u)
+        assert len(links) == 22
+        assert len(all_links) == 27
+
+        # the number of queries shouldn't depend on the number of links
+        assert len(small) == len(large)
+
+        # and the views should still carry the owners and tags
+        view = next(link for link in all_links if link.user == u.name)
+        assert not view.is_mine
+        assert {t.name for t in view.tags} == {"a", "a/b", "c"}
+        assert view.tags[0].url.startswith(f"/u/{u.name}/t/")
+
+    def test_cursor_pagination(self):
+        u = self.mk_user()
+        created = datetime.datetime(2020, 1, 1)
+        for i in range(7):
+            # pairs of links share a creation time, so that the id
+            # has to break the tie, and every other link is private
+            req = r.Link(f"http://{i}.com", f"{i}", "", i % 2 == 1, ["a"])
+            req.created = created + datetime.timedelta(days=i // 2)
+            m.Link.from_request(u, req)
+        u = m.User.by_slug(u.name)
+
+        per_page = c.app.per_page
+        c.app.per_page = 3
+        try:
+            # walk forward through every page
+            seen: List[str] = []
+            cursor = None
+            while True:
+                links, pages = u.get_links(as_user=u, cursor=cursor)
+                seen.extend(link.name for link in links)
+                assert pages.total == 7
+                if not pages.after:
+                    break
+                cursor = r.Cursor.decode(pages.after, before=False)
+            assert seen == ["6", "5", "4", "3", "2", "1", "0"]
+
+            # the last page is the oldest links, and we can walk back
+            links, pages = u.get_links(as_user=u, cursor=r.Cursor(before=True))
+            assert [link.name for link in links] == ["2", "1", "0"]
+            assert pages.after is None
+            assert pages.before is not None
+            cursor = r.Cursor.decode(pages.before, before=True)
+            links, pages = u.get_links(as_user=u, cursor=cursor)
+            assert [link.name for link in links] == ["5", "4", "3"]
+            assert pages.before is not None
+            cursor = r.Cursor.decode(pages.before, before=True)
+            links, pages = u.get_links(as_user=u, cursor=cursor)
+            assert [link.name for link in links] == ["6"]
+            assert pages.before is None
+
+            # the front page is put together from everyone's public
+            # links and our own private ones, which should interleave
+            # across pages in both directions
+            def walk(as_user, cursor):
+                seen = []
+                while True:
+                    links, pages = m.Link.get_all(as_user=as_user, cursor=cursor)
+                    names = [link.name for link in links]
+                    seen.extend(
+                        names if not cursor or not cursor.before else names[::-1]
+                    )
+                    page = pages.before if cursor and cursor.before else pages.after
+                    if not page:
+                        return seen
+                    cursor = r.Cursor.decode(
+                        page, before=bool(cursor and cursor.before)
+                    )
+
+            assert walk(u, None) == ["6", "5", "4", "3", "2", "1", "0"]
+            assert walk(u, r.Cursor(before=True)) == ["0", "1", "2", "3", "4", "5", "6"]
+            assert walk(None, None) == ["6", "4", "2", "0"]
+        finally:
+            c.app.per_page = per_page
+
+    def test_bad_cursor(self):
+        with pytest.raises(e.BadCursor):
+            r.Cursor.from_args({"after": "not-a-cursor"})
+
+    def check_counts(self, obj, total, public):
+        obj = type(obj).get_by_id(obj.id)
+        assert (obj.link_count, obj.public_link_count) == (total, public)
+
+    def test_link_counters(self):
+        u = self.mk_user()
+        req = r.Link("http://foo.com", "foo", "", False, ["food/bread", "baking"])
+        link = m.Link.from_request(u, req)
+        m.Link.from_request(u, r.Link("http://bar.com", "bar", "", True, ["baking"]))
+        self.check_counts(u, 2, 1)
+        self.check_counts(u.get_tag("food"), 1, 1)
+        self.check_counts(u.get_tag("baking"), 2, 1)
+
+        # making the link private moves it between the counts
+        req.private = True
+        req.tags = ["food/bread", "baking", "rye"]
+        link.update_from_request(u, req)
+        self.check_counts(u, 2, 0)
+        self.check_counts(u.get_tag("food/bread"), 1, 0)
+        self.check_counts(u.get_tag("rye"), 1, 0)
+        self.check_counts(u.get_tag("baking"), 2, 0)
+
+        req.tags = ["baking"]
+        link.update_from_request(u, req)
+        self.check_counts(u.get_tag("baking"), 2, 0)
+
+        deleted = m.Link.by_id(link.id)
+        assert deleted is not None
+        deleted.full_delete()
+        self.check_counts(u, 1, 0)
+        self.check_counts(u.get_tag("baking"), 1, 0)
+
+        # scrambling the counters and recounting should restore them
+        m.User.update(link_count=100, public_link_count=5).execute()
+        m.Tag.update(link_count=100).execute()
+        m.recount_links()
+        self.check_counts(u, 1, 0)
+        self.check_counts(u.get_tag("baking"), 1, 0)
+
+        # the page totals come from the counters
+        other = self.mk_user(name="other")
+        m.Link.from_request(other, r.Link("http://baz.com", "baz", "", False, []))
+        _, pages = m.Link.get_all(as_user=m.User.by_slug(u.name))
+        assert pages.total == 2
+        _, pages = m.Link.get_all(as_user=None)
+        assert pages.total == 1
+
+    def test_string_search(self):
+        u = self.mk_user()
+
+        def add(url, name, description, tags, private=False):
+            req = r.Link(url, name, description, private, tags)
+            return m.Link.from_request(u, req)
+
+        add("http://bread.com/rye", "Rye bread", "a dense loaf", ["food/bread"])
+        add("http://example.com/", "Sourdough", "starter notes", ["food/bread"])
+        add("http://python.org/", "Python", "bread and butter", ["lang/python"])
+        add("http://secret.com/", "Secret bread", "", ["food"], private=True)
+
+        def search(needle, as_user=u, **kwargs):
+            links, _ = u.get_string_search(needle, as_user=as_user, **kwargs)
+            return {link.name for link in links}
+
+        # searches cover the name, description, URL and tags
+        assert search("bread") == {"Rye bread", "Sourdough", "Python", "Secret bread"}
+        assert search("example") == {"Sourdough"}
+        assert search("python") == {"Python"}
+        assert search("bread", as_user=None) == {"Rye bread", "Sourdough", "Python"}
+        # all words must match, and we can ask for prefixes or phrases
+        assert search("bread loaf") == {"Rye bread"}
+        assert search("sour*") == {"Sourdough"}
+        assert search('"butter and bread"') == set()
+        assert search('"bread and butter"') == {"Python"}
+        # search syntax from the user is taken literally
+        assert search('NOT "unclosed') == set()
+        assert search("") == set()
+
+        # the ranked search puts the best match first
+        links, _ = u.get_string_search("rye", as_user=u, ranked=True)
+        assert links[0].name == "Rye bread"
+
+        # the index should follow edits and deletes
+        link = add("http://foo.com", "foo", "", ["a"])
+        assert search("foo") == {"foo"}
+        link.update_from_request(u, r.Link("http://foo.com", "quux", "", False, []))
+        assert search("foo") == {"quux"}
+        assert search("quux") == {"quux"}
+        link.full_delete()
+        assert search("quux") == set()
+
+        # and rebuilding it from scratch should find the same things
+        m.LinkIndex.reindex_all()
+        assert search("bread loaf") == {"Rye bread"}
+
+    def closure(self):
+        return {
+            (tc.ancestor.name, tc.descendant.name, tc.depth)
+            for tc in m.TagClosure.select()
+        }
+
+    def test_tag_closure(self):
+        u = self.mk_user()
+        rye = m.Tag.get_or_create_tag(u, "food/bread/rye")
+        m.Tag.get_or_create_tag(u, "food/cheese")
+        assert self.closure() == {
+            ("food", "food", 0),
+            ("food/bread", "food/bread", 0),
+            ("food/bread/rye", "food/bread/rye", 0),
+            ("food/cheese", "food/cheese", 0),
+            ("food", "food/bread", 1),
+            ("food", "food/bread/rye", 2),
+            ("food/bread", "food/bread/rye", 1),
+            ("food", "food/cheese", 1),
+        }
+        assert [t.name for t in rye.get_family()] == [
+            "food/bread/rye",
+            "food/bread",
+            "food",
+        ]
+
+        # rebuilding from the parent pointers gives the same closure
+        before = self.closure()
+        m.TagClosure.rebuild()
+        assert self.closure() == before
+
+        # tagging a link with a deep tag shouldn't need a query per level
+        link = m.Link.from_request(u, r.Link("http://foo.com", "foo", "", False, []))
+        deep = m.Tag.get_or_create_tag(u, "a/b/c/d/e/f/g")
+        with self.count_queries() as deep_queries:
+            m.HasTag.add_tags(link, [deep.id, rye.id])
+        other = m.Link.from_request(u, r.Link("http://bar.com", "", "", False, []))
+        shallow = [m.Tag.get_or_create_tag(u, name) for name in ("s", "t")]
+        with self.count_queries() as shallow_queries:
+            m.HasTag.add_tags(other, [t.id for t in shallow])
+        assert len(deep_queries) == len(shallow_queries)
+        self.check_tags(
+            link,
+            ["food", "food/bread", "food/bread/rye"]
+            + ["a", "a/b", "a/b/c", "a/b/c/d", "a/b/c/d/e", "a/b/c/d/e/f"]
+            + ["a/b/c/d/e/f/g"],
+        )
+
+        # cleaning up unused tags removes them from the closure
+        m.Tag.clean_all()
+        assert ("food", "food/cheese", 1) not in self.closure()
+        assert ("food", "food/bread/rye", 2) in self.closure()
+
+    def test_clean_tags(self):
+        u = self.mk_user()
+        other = self.mk_user(name="other")
+        mine = m.Link.from_request(u, r.Link("http://a.com", "a", "", False, ["x/y"]))
+        m.Link.from_request(other, r.Link("http://b.com", "b", "", False, ["x/y"]))
+        m.Link.from_request(u, r.Link("http://c.com", "c", "", False, ["x/z"]))
+        # a tag nothing ever used, which only a full sweep should find
+        m.Tag.get_or_create_tag(u, "orphan")
+
+        def tags(user):
+            return {t.name for t in m.Tag.select().where(m.Tag.user == user)}
+
+        # removing a tag from a link deletes it, but keeps any parent
+        # that is still in use, and other users' tags of the same name
+        mine.update_from_request(u, r.Link("http://a.com", "a", "", False, []))
+        assert tags(u) == {"x", "x/z", "orphan"}
+        assert tags(other) == {"x", "x/y"}
+
+        for link in m.Link.select().where(m.Link.user == u):
+            link.full_delete()
+        assert tags(u) == {"orphan"}
+        assert tags(other) == {"x", "x/y"}
+
+        m.Tag.clean_all()
+        assert tags(u) == set()
+        assert tags(other) == {"x", "x/y"}
+
+    def pairs(self):
+        return {
+            (p.tag.name, p.other.name, p.count)
+            for p in m.TagPair.select().where(m.TagPair.count != 0)
+        }
+
+    def test_related_tags(self):
+        u = self.mk_user()
+        a = m.Link.from_request(u, r.Link("http://a.com", "a", "", False, ["x", "y/z"]))
+        m.Link.from_request(u, r.Link("http://b.com", "b", "", False, ["x", "w"]))
+        m.Link.from_request(u, r.Link("http://c.com", "c", "", False, ["x", "w"]))
+
+        related = u.get_related_tags(u.get_tag("x"))
+        assert [t.name for t in related] == ["w", "y", "y/z"]
+        assert related[0].url == f"/u/{u.name}/t/w"
+        assert len(u.get_related_tags(u.get_tag("x"), limit=1)) == 1
+        assert [t.name for t in u.get_related_tags(u.get_tag("y"))] == ["x", "y/z"]
+
+        # edits and deletes keep the counts up to date...
+        a.update_from_request(u, r.Link("http://a.com", "a", "", False, ["x", "w"]))
+        assert [t.name for t in u.get_related_tags(u.get_tag("x"))] == ["w"]
+        incremental = self.pairs()
+        deleted = m.Link.by_id(a.id)
+        assert deleted is not None
+        deleted.full_delete()
+        assert self.pairs() == {("x", "w", 2), ("w", "x", 2)}
+
+        # ...and agree with counting them all from scratch
+        assert ("x", "w", 3) in incremental
+        m.TagPair.rebuild()
+        assert self.pairs() == {("x", "w", 2), ("w", "x", 2)}
+
+    def pinboard_export(self, links):
+        return io.StringIO(
+            json.dumps(
+                [
+                    {
+                        "href": href,
+                        "description": name,
+                        "extended": "",
+                        "time": "2020-01-01T00:00:00Z",
+                        "shared": shared,
+                        "tags": tags,
+                    }
+                    for href, name, shared, tags in links
+                ]
+            )
+        )
+
+    def test_import_pinboard_data(self):
+        u = self.mk_user()
+        m.Link.from_request(u, r.Link("http://old.com", "old", "", False, ["food"]))
+        export = [
+            ("http://a.com", "a", "yes", "food/bread/rye baking"),
+            ("http://b.com", "b", "no", "food/cheese baking"),
+            ("http://c.com", "c", "yes", ""),
+        ]
+        stats = u.import_pinboard_data(self.pinboard_export(export))
+        assert (stats.imported, stats.skipped) == (3, 0)
+
+        u = m.User.by_slug(u.name)
+        links, _ = u.get_links(as_user=u)
+        assert {link.name for link in links} == {"old", "a", "b", "c"}
+        a = next(link for link in links if link.name == "a")
+        assert {t.name for t in a.tags} == {
+            "food",
+            "food/bread",
+            "food/bread/rye",
+            "baking",
+        }
+        names, _ = u.get_string_search("rye", as_user=u)
+        assert [link.name for link in names] == ["a"]
+
+        # everything derived from the links should match what we'd get
+        # from recomputing it all from scratch
+        counts = [(t.name, t.link_count, t.public_link_count) for t in m.Tag.select()]
+        closure, pairs = self.closure(), self.pairs()
+        m.recount_links()
+        m.TagClosure.rebuild()
+        m.TagPair.rebuild()
+        assert (u.link_count, u.public_link_count) == (4, 3)
+        assert counts == [
+            (t.name, t.link_count, t.public_link_count) for t in m.Tag.select()
+        ]
+        assert self.closure() == closure
+        assert self.pairs() == pairs
+
+        # importing the same file again doesn't add anything
+        stats = u.import_pinboard_data(self.pinboard_export(export))
+        assert (stats.imported, stats.skipped) == (0, 3)
+
+    def test_bad_import(self):
+        u = self.mk_user()
+        export = [
+            ("http://a.com", "a", "yes", "fine"),
+            ("http://b.com", "b", "yes", "not{fine}"),
+        ]
+        with pytest.raises(e.BadTagName):
+            u.import_pinboard_data(self.pinboard_export(export))
+        with pytest.raises(e.BadFileUpload):
+            u.import_pinboard_data(io.StringIO('[{"href": "http://a.com"}]'))
+        with pytest.raises(e.BadFileUpload):
+            u.import_pinboard_data(io.StringIO("{}"))
+        assert m.Link.select().count() == 0
+        assert m.Tag.select().count() == 0
+
+    def test_import_job(self, monkeypatch):
+        u = self.mk_user()
+        export = [
+            ("http://a.com", "a", "yes", "fine"),
+            ("http://b.com", "b", "yes", "fine"),
+            ("http://c.com", "c", "yes", "not{fine}"),
+        ]
+        upload = self.pinboard_export(export[:2]).getvalue().encode()
+        job = m.ImportJob.enqueue(u, io.BytesIO(upload))
+        assert job.to_view().status == m.ImportJob.QUEUED
+
+        claimed = m.ImportJob.claim_next()
+        assert claimed is not None and claimed.id == job.id
+        assert claimed.status == m.ImportJob.RUNNING
+        # a job only gets claimed once
+        assert m.ImportJob.claim_next() is None
+
+        progress: List[int] = []
+        batch_size = m.Link.IMPORT_BATCH
+        m.Link.IMPORT_BATCH = 1
+        try:
+            record_progress = claimed.record_progress
+
+            def track_progress(stats):
+                record_progress(stats)
+                progress.append(stats.imported)
+
+            monkeypatch.setattr(claimed, "record_progress", track_progress)
+            claimed.run()
+        finally:
+            m.Link.IMPORT_BATCH = batch_size
+        assert progress == [1, 2]
+        view = m.ImportJob.by_id(u, job.id).to_view()
+        assert (view.status, view.processed, view.error) == (m.ImportJob.DONE, 2, None)
+        assert not os.path.exists(job.path)
+
+        # a job that fails keeps the batches it managed to import
+        upload = self.pinboard_export(export).getvalue().encode()
+        job = m.ImportJob.enqueue(u, io.BytesIO(upload))
+        claimed = m.ImportJob.claim_next()
+        assert claimed is not None
+        m.Link.IMPORT_BATCH = 1
+        try:
+            claimed.run()
+        finally:
+            m.Link.IMPORT_BATCH = batch_size
+        view = m.ImportJob.by_id(u, job.id).to_view()
+        assert view.status == m.ImportJob.FAILED
+        assert (view.imported, view.skipped) == (0, 2)
+        assert view.error is not None and "not{fine}" in view.error
+
+        other = self.mk_user(name="other")
+        with pytest.raises(e.NoSuchImportJob):
+            m.ImportJob.by_id(other, job.id)
+
+    def test_stale_import_jobs(self):
+        u = self.mk_user()
+        for _ in range(2):
+            m.ImportJob.enqueue(u, io.BytesIO(b"[]"))
+        stuck = m.ImportJob.claim_next()
+        busy = m.ImportJob.claim_next()
+        assert stuck is not None and busy is not None
+        # the process running this one stopped long ago, while the
+        # other one is slow but still reporting its progress
+        long_ago = datetime.datetime.now() - datetime.timedelta(hours=2)
+        m.ImportJob.update(started=long_ago, heartbeat=long_ago).execute()
+        busy.record_progress(v.ImportStats(imported=1, skipped=0, seconds=1.0))
+
+        assert lc.worker.ImportWorker(threaded=False).run_pending() == 0
+        failed = m.ImportJob.by_id(u, stuck.id)
+        assert failed.status == m.ImportJob.FAILED
+        assert failed.error is not None and "interrupted" in failed.error
+        assert not os.path.exists(stuck.path)
+        assert m.ImportJob.by_id(u, busy.id).status == m.ImportJob.RUNNING
+        assert os.path.exists(busy.path)
+
+        # if the stale job turns out to finish after all, it stays failed
+        with open(stuck.path, "w") as f:
+            f.write("[]")
+        stuck.run()
+        assert m.ImportJob.by_id(u, stuck.id).error == failed.error
+        assert not os.path.exists(stuck.path)
+        # while the slow one gets to finish properly
+        busy.run()
+        done = m.ImportJob.by_id(u, busy.id)
+        assert (done.status, done.error) == (m.ImportJob.DONE, None)
+
+    def test_search_plan(self):
+        u = self.mk_user()
+        for i in range(5):
+            m.Link.from_request(
+                u, r.Link(f"http://{i}.com", f"bread {i}", "", False, ["food"])
+            )
+        for ranked in (False, True):
+            with lc.advisor.recording() as statements:
+                links, pagination = u.get_string_search("bread", u, ranked=ranked)
+            assert len(links) == pagination.total == 5
+            searches = [(sql, params) for sql, params in statements if "MATCH" in sql]
+            assert searches
+            for sql, params in searches:
+                # the index should be searched once, rather than being
+                # asked about each of the user's links in turn
+                for step in lc.advisor.query_plan(sql, params):
+                    assert "VIRTUAL TABLE INDEX 0:=" not in step
+
+    def test_query_plans(self):
+        # every query method should be answered from indexes
+        assert lc.advisor.advise() == {}
+        # and the advisor does notice when one isn't
+        scan = 'SELECT * FROM "link" AS "t1" WHERE ("t1"."name" = ?)'
+        assert lc.advisor.problems("Link.by_name", scan, ("a",)) == [
+            "scan link: SCAN t1"
+        ]
+        # including a search of the full-text index run for every link
+        u = self.mk_user()
+        search = (
+            'SELECT "t1"."id" FROM "link" AS "t1" INNER JOIN "linkindex" AS "t2"'
+            ' ON ("t2"."rowid" = "t1"."id")'
+            ' WHERE (("t1"."user_id" = ?) AND ("linkindex" MATCH ?))'
+        )
+        assert lc.advisor.problems("Link.search", search, (u.id, "a")) == [
+            "search linkindex per row: SCAN t2 VIRTUAL TABLE INDEX 0:=M4"
+        ]
+
+    def test_schema_version(self):
+        import migrations  # noqa: F401
+
+        newest = max(mig.version for mig in lc.migration.registered)
+        assert m.SCHEMA_VERSION == newest
+        assert m.Meta.fetch().version == newest
+
+    def test_migrations(self):
+        import migrations  # noqa: F401
+        import playhouse.migrate
+
+        c.app.in_memory_db()
+        c.app.db.connection().executescript(BASELINE_SCHEMA)
+        for mig in sorted(lc.migration.registered, key=lambda mig: mig.version):
+            mig.run(playhouse.migrate.SqliteMigrator(c.app.db))
+        assert c.app.db.execute_sql("PRAGMA integrity_check").fetchall() == [("ok",)]
+        migrated = schema()
+
+        # the data made it through, and can be written to
+        u = m.User.by_slug("old")
+        assert (u.link_count, u.public_link_count) == (2, 1)
+        assert m.Tag.get(name="food").link_count == 2
+        link = m.Link.from_request(u, r.Link("http://c.com", "c", "", False, ["food"]))
+        assert [t.name for t in link.to_view(u).tags] == ["food"]
+        assert c.app.db.execute_sql("PRAGMA integrity_check").fetchall() == [("ok",)]
+
+        # and ended up just as a new database starts out
+        c.app.in_memory_db()
+        m.create_tables()
+        assert migrated == schema()
+
+    def test_write_retries(self):
+        calls: List[None] = []
+
+        def flaky_write():
+            calls.append(None)
+            if len(calls) < 3:
+                raise peewee.OperationalError("database is locked")
+            return m.User.add("flaky", "")
+
+        coordinator = lc.writes.WriteCoordinator()
+        saved = (c.app.config.db_write_retries, c.app.config.db_write_backoff_ms)
+        c.app.config.db_write_backoff_ms = 1
+        try:
+            assert coordinator.run(flaky_write).name == "flaky"
+            assert (len(calls), coordinator.retries) == (3, 2)
+
+            # give up once we run out of retries
+            calls.clear()
+            c.app.config.db_write_retries = 1
+            with pytest.raises(e.DatabaseBusy):
+                coordinator.run(flaky_write)
+            assert (len(calls), coordinator.failures) == (2, 1)
+
+            # and anything else that goes wrong isn't retried at all
+            with pytest.raises(e.UserExists):
+                coordinator.run(m.User.add, "flaky", "")
+        finally:
+            c.app.config.db_write_retries, c.app.config.db_write_backoff_ms = saved
+        assert coordinator.stats().writes == 1
+
+    def test_write_waits_for_lock(self, tmp_path):
+        c.app.close_db()
+        path = str(tmp_path / "lc.db")
+        c.app.db.init(path, pragmas={**c.app.db_pragmas(), "busy_timeout": 10})
+        m.create_tables()
+
+        # someone else is in the middle of a write for a while
+        other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        other.execute("BEGIN IMMEDIATE")
+        threading.Timer(0.2, lambda: other.execute("COMMIT")).start()
+
+        retries = lc.writes.coordinator.retries
+        saved = c.app.config.db_write_retries
+        c.app.config.db_write_retries = 50
+        try:
+            m.User.add("patient", "")
+        finally:
+            c.app.config.db_write_retries = saved
+            other.close()
+        assert m.User.by_slug("patient")
+        assert lc.writes.coordinator.retries > retries
+        assert lc.writes.coordinator.stats().wait_max_ms >= 200
+
+    def test_hier_tags(self):
+        def render(*names):
+            tags = [v.Tag(url="", name=name) for name in names]
+            return v.HierTagList(user="u", tags=tags).render()
+
+        def a(path):
+            return f'<a href="/u/u/t/{path}">{path.split("/")[-1]}</a>'
+
+        html = render("food/bread/rye", "food/cheese", "food", "misc")
+        assert html == "\n".join(
+            [
+                f'<span class="tag">{a("food")}/'
+                f'{{{a("food/bread")}/{a("food/bread/rye")}, {a("food/cheese")}}}'
+                "</span>",
+                f'<span class="tag">{a("misc")}</span>',
+            ]
+        )
+        # the same tags give the same HTML, which is only built once
+        hits = v.HierTagList.RENDERED.hits
+        assert render("food/bread/rye", "food/cheese", "food", "misc") == html
+        assert v.HierTagList.RENDERED.hits == hits + 1
+        # but the order of the tags matters
+        assert render("misc", "food/cheese", "food/bread/rye") != html
+
+    def test_sqlite_page_store(self, tmp_path):
+        store = lc.fragments.SqliteStore(str(tmp_path / "pages"), size=2)
+        for key in ["a", "b", "c"]:
+            store.put(key, key * 3)
+        # the oldest is forgotten, and every process sees the rest
+        other = lc.fragments.SqliteStore(str(tmp_path / "pages"), size=2)
+        assert [other.get(key) for key in "abc"] == [None, "bbb", "ccc"]
+        store.put("b", "new")
+        assert other.get("b") == "new"
+
+    def test_lru_cache(self, monkeypatch):
+        now = [0.0]
+        monkeypatch.setattr("time.monotonic", lambda: now[0])
+        cache: LRUCache[str, int] = LRUCache(size=2, ttl=10)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        # "b" is now the least recently used, so it's the one to go
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        now[0] = 11
+        assert cache.get("a") is None
+        assert (cache.hits, cache.misses) == (3, 2)
+
+    def test_token_cache(self):
+        u = self.mk_user(password="foo")
+        _, token = m.User.login(r.User(name=u.name, password="foo"))
+        assert m.User.by_token("not a token") is None
+
+        found = m.User.by_token(token)
+        assert found is not None and found.name == u.name
+        assert m.User.TOKENS.get(token) is not None
+        # a cached user is still a fresh copy
+        found.link_count = 100
+        again = m.User.by_token(token)
+        assert again is not None and again.link_count == 0
+
+        # anything that changes the user means checking it again
+        m.Link.from_request(
+            u, r.Link("http://example.com", "example", "", False, ["tag"])
+        )
+        assert m.User.TOKENS.get(token) is None
+        again = m.User.by_token(token)
+        assert again is not None and again.link_count == 1
+        u.change_password(r.PasswordChange(old="foo", n1="bar", n2="bar"))
+        assert m.User.TOKENS.get(token) is None
+
+        # saving a snapshot doesn't write its stale fields back
+        found = m.User.by_token(token)
+        assert found is not None
+        m.User.update(link_count=5, version=7).where(m.User.id == u.id).execute()
+        found.change_password(r.PasswordChange(old="bar", n1="baz", n2="baz"))
+        found = m.User.by_token(token)
+        assert found is not None and found.link_count == 5
+        m.User.update(version=8).where(m.User.id == u.id).execute()
+        found.set_as_admin()
+        row = m.User.get(id=u.id)
+        assert (row.link_count, row.version, row.is_admin) == (5, 8, True)
+        assert row.authenticate("baz")
+
+        # and so does a user that's gone
+        m.User.by_token(token)
+        m.User.delete().where(m.User.id == u.id).execute()
+        m.User.TOKENS.clear()
+        assert m.User.by_token(token) is None
+
+    def test_iter_json_array(self):
+        values = [
+            {"a": "[not, the, end]", "b": [1, 2, {"c": None}]},
+            12345678,
+            '\u00e9t\u00e9 \\"quoted\\"',
+            [],
+            True,
+        ]
+        text = " [ " + " ,\n ".join(json.dumps(x) for x in values) + " ] \n"
+        # try chunk sizes which split the values at every position
+        for chunk_size in (1, 2, 3, 7, 1024):
+            parsed = list(r.iter_json_array(io.StringIO(text), chunk_size))
+            assert parsed == values
+            raw = io.BytesIO(text.encode("utf-8"))
+            assert list(r.iter_json_array(raw, chunk_size)) == values
+        assert list(r.iter_json_array(io.StringIO(" [ ] "))) == []
+
+        # elements come out before the rest of the stream has been read
+        stream = io.StringIO(json.dumps(list(range(10000))))
+        elements = r.iter_json_array(stream, chunk_size=16)
+        assert next(elements) == 0
+        assert stream.tell() < 100
+
+        for bad in ("", "{}", "[1, 2", "[1 2]", "[1,]", "[1] 2", '["unclosed]'):
+            with pytest.raises(e.BadFileUpload):
+                list(r.iter_json_array(io.StringIO(bad), chunk_size=2))
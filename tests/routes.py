@@ -1,15 +1,33 @@
+import datetime
+import io
+import json
+import os
+import threading
+from typing import Any, Dict, List
 import config  # noqa: F401
+import playhouse.pool
+import pytest
 import lc.config as c
+import lc.fragments
+from lc.fragments import fragments
 import lc.model as m
 import lc.request as r
+import lc.view as v
 import lc.app as a
+import lc.web as web
+import lc.worker as w
 
 
 class TestRoutes:
     def setup_method(self, _):
         c.app.in_memory_db()
         m.create_tables()
+        # the users that tokens were verified for don't exist any more
+        m.User.TOKENS.clear()
         self.app = a.app.test_client()
+        # the in-memory database isn't shared with other threads, so
+        # run import jobs by hand instead
+        w.worker.threaded = False
 
     def teardown_method(self, _):
         c.app.close_db()
@@ -80,6 +98,114 @@ class TestRoutes:
         assert result.status == "200 OK"
         assert result.json["url"] == "http://example.com/"
 
+    def test_logout_forgets_token(self):
+        u = self.mk_user(password="foo")
+        result = self.app.post("/auth", json={"name": u.name, "password": "foo"})
+        assert result.json is not None
+        token = result.json["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert self.app.get("/u", headers=headers).status == "302 FOUND"
+        assert m.User.TOKENS.get(token) is not None
+        result = self.app.post("/logout", json={}, headers=headers)
+        assert result.status == "200 OK"
+        assert m.User.TOKENS.get(token) is None
+
+    def test_front_page_total(self):
+        u = self.mk_user(password="foo")
+        self.app.post("/auth", json={"name": u.name, "password": "foo"})
+        api = {"Content-Type": "application/json"}
+
+        def total() -> int:
+            result = self.app.get("/", headers=api)
+            assert result.json is not None
+            return result.json["pages"]["total"]
+
+        assert total() == 0
+        # another process adds a private link, which this one's cached
+        # copy of the user doesn't know about
+        m.User.update(link_count=m.User.link_count + 1).where(
+            m.User.id == u.id
+        ).execute()
+        assert total() == 1
+
+    def test_conditional_get(self):
+        u = self.mk_user(password="foo")
+        m.Link.from_request(
+            u, r.Link("http://example.com", "example", "", False, ["tag"])
+        )
+        first = self.app.get(f"/u/{u.name}")
+        assert first.status == "200 OK"
+        etag = first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "private, no-cache"
+
+        # the same page gets a 304 for as long as nothing changes
+        again = self.app.get(f"/u/{u.name}", headers={"If-None-Match": etag})
+        assert again.status == "304 NOT MODIFIED"
+        assert again.headers["ETag"] == etag
+        assert again.data == b""
+
+        # but not for a different page, representation, or viewer
+        for path, headers in [
+            (f"/u/{u.name}/t/tag", {}),
+            (f"/u/{u.name}?order=rank", {}),
+            (f"/u/{u.name}", {"Content-Type": "application/json"}),
+        ]:
+            result = self.app.get(path, headers={"If-None-Match": etag, **headers})
+            assert result.status == "200 OK"
+            assert result.headers["ETag"] != etag
+        self.app.post("/auth", json={"name": u.name, "password": "foo"})
+        result = self.app.get(f"/u/{u.name}", headers={"If-None-Match": etag})
+        assert result.status == "200 OK"
+        viewer_etag = result.headers["ETag"]
+        assert viewer_etag != etag
+
+        # and a write to the user's links changes the page's ETag
+        m.Link.from_request(
+            u, r.Link("http://example.com/2", "another", "", False, ["tag"])
+        )
+        result = self.app.get(f"/u/{u.name}", headers={"If-None-Match": viewer_etag})
+        assert result.status == "200 OK"
+        assert result.headers["ETag"] != viewer_etag
+
+        # pages that don't exist don't get an ETag
+        result = self.app.get("/u/nobody")
+        assert result.status == "404 NOT FOUND"
+        assert "ETag" not in result.headers
+
+    @pytest.mark.parametrize("store", ["memory", "sqlite"])
+    def test_page_cache(self, store, tmp_path):
+        saved = fragments.store
+        if store == "memory":
+            fragments.store = lc.fragments.MemoryStore(size=10)
+        else:
+            fragments.store = lc.fragments.SqliteStore(str(tmp_path / "pages"), 10)
+        fragments.hits = fragments.misses = 0
+        try:
+            u = self.mk_user(password="foo")
+            m.Link.from_request(
+                u, r.Link("http://example.com", "example", "", False, ["tag"])
+            )
+            first = self.app.get(f"/u/{u.name}")
+            assert self.app.get(f"/u/{u.name}").data == first.data
+            assert (fragments.hits, fragments.misses) == (1, 1)
+            self.app.get(f"/u/{u.name}/t/tag")
+            assert (fragments.hits, fragments.misses) == (1, 2)
+
+            # a write means the page is built again
+            m.Link.from_request(
+                u, r.Link("http://example.com/2", "another", "", False, ["tag"])
+            )
+            result = self.app.get(f"/u/{u.name}")
+            assert b"another" in result.data
+            assert (fragments.hits, fragments.misses) == (1, 3)
+
+            # and what the owner sees isn't cached at all
+            self.app.post("/auth", json={"name": u.name, "password": "foo"})
+            self.app.get(f"/u/{u.name}")
+            assert (fragments.hits, fragments.misses) == (1, 3)
+        finally:
+            fragments.store = saved
+
     def test_no_permissions_api_add_link(self):
         # create a user who owns a link collection
         owner = self.mk_user()
@@ -150,3 +276,520 @@ class TestRoutes:
             headers={"Content-Type": "application/json"},
         )
         assert bad_result.status == "404 NOT FOUND"
+
+    def test_api_link_pages(self):
+        u = self.mk_user()
+        for i in range(3):
+            m.Link.from_request(
+                u, r.Link(f"http://{i}.com", f"link {i}", "", False, ["website"])
+            )
+
+        per_page = c.app.per_page
+        c.app.per_page = 2
+        try:
+            result = self.app.get(
+                f"/u/{u.name}", headers={"Content-Type": "application/json"}
+            )
+            assert result.status == "200 OK" and result.json is not None
+            assert result.json["name"] == u.name
+            assert [ln["name"] for ln in result.json["links"]] == ["link 2", "link 1"]
+            after = result.json["pages"]["after"]
+
+            result = self.app.get(
+                f"/u/{u.name}/t/website?after={after}",
+                headers={"Content-Type": "application/json"},
+            )
+            assert result.json is not None
+            assert [ln["name"] for ln in result.json["links"]] == ["link 0"]
+            assert result.json["pages"]["after"] is None
+
+            # the HTML pages link to the following page by cursor
+            result = self.app.get(f"/u/{u.name}")
+            assert f"?after={after}" in result.get_data(as_text=True)
+
+            result = self.app.get(f"/u/{u.name}?after=garbage")
+            assert result.status == "400 BAD REQUEST"
+        finally:
+            c.app.per_page = per_page
+
+    def test_export(self, monkeypatch):
+        u = self.mk_user(password="foo")
+        when = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        for i in range(7):
+            m.Link.from_request(
+                u,
+                r.Link(
+                    f"http://example.com/{i}?a=1&b=2",
+                    f"link <{i}>",
+                    f"about link {i}" if i % 2 else "",
+                    i % 3 == 0,
+                    ["food/bread", f"tag{i}"],
+                    # some links share a time, which the chunks have to
+                    # get past without skipping or repeating any
+                    created=when + datetime.timedelta(days=i // 3),
+                ),
+            )
+        assert self.app.get(f"/u/{u.name}/export.json").status == "403 FORBIDDEN"
+        self.app.post("/auth", json={"name": u.name, "password": "foo"})
+        monkeypatch.setattr(m, "CHUNK_SIZE", 2)
+
+        result = self.app.get(f"/u/{u.name}/export.json")
+        assert result.status == "200 OK"
+        assert result.is_streamed
+        assert "attachment" in result.headers["Content-Disposition"]
+        exported = [r.PinboardLink.from_export(x) for x in json.loads(result.data)]
+        assert [link.href for link in exported] == [
+            f"http://example.com/{i}?a=1&b=2" for i in range(7)
+        ]
+        assert exported[1] == r.PinboardLink(
+            href="http://example.com/1?a=1&b=2",
+            description="link <1>",
+            extended="about link 1",
+            time=when,
+            shared=True,
+            # a hierarchical tag's ancestors are exported along with it
+            tags=["food/bread", "food", "tag1"],
+        )
+        assert not exported[0].shared
+
+        # API clients get just the same export
+        api = {"Content-Type": "application/json"}
+        result = self.app.get(f"/u/{u.name}/export.json", headers=api)
+        assert result.status == "200 OK"
+        assert len(json.loads(result.data)) == 7
+        result = self.app.get(f"/u/{u.name}/export.html", headers=api)
+        assert result.status == "200 OK"
+        assert result.data.decode().count("<DT>") == 7
+
+        result = self.app.get(f"/u/{u.name}/export.html")
+        assert result.status == "200 OK"
+        page = result.data.decode()
+        assert page.startswith("<!DOCTYPE NETSCAPE-Bookmark-file-1>")
+        assert page.count("<DT>") == 7
+        assert page.count("<DD>") == 3
+        assert (
+            '<DT><A HREF="http://example.com/1?a=1&amp;b=2" '
+            f'ADD_DATE="{int(when.replace(tzinfo=datetime.timezone.utc).timestamp())}" '
+            'PRIVATE="0" TAGS="food/bread,food,tag1">link &lt;1&gt;</A>'
+        ) in page
+
+    def test_link_batch(self):
+        u = self.mk_user(password="foo")
+        old = m.Link.from_request(
+            u, r.Link("http://example.com/old", "old", "", False, ["stale/tag"])
+        )
+        kept = m.Link.from_request(
+            u, r.Link("http://example.com/kept", "kept", "", False, ["keep"])
+        )
+        url = f"/u/{u.name}/links/batch"
+        ops: List[Dict[str, Any]] = [
+            {
+                "op": "create",
+                "link": {
+                    "url": "http://example.com/new",
+                    "name": "new",
+                    "description": "",
+                    "private": True,
+                    "tags": ["fresh/tag", "keep"],
+                },
+            },
+            {
+                "op": "update",
+                "id": kept.id,
+                "link": {
+                    "url": "http://example.com/kept",
+                    "name": "renamed",
+                    "description": "",
+                    "private": False,
+                    "tags": ["fresh/tag"],
+                },
+            },
+            {"op": "delete", "id": old.id},
+            # these fail, but without undoing the others
+            {"op": "delete", "id": old.id + 1000},
+            {
+                "op": "create",
+                "link": {
+                    "url": "http://example.com/bad",
+                    "name": "bad",
+                    "description": "",
+                    "private": False,
+                    "tags": ["ok/tag", "b{a}d"],
+                },
+            },
+        ]
+        assert self.app.post(url, json=ops).status == "403 FORBIDDEN"
+        self.app.post("/auth", json={"name": u.name, "password": "foo"})
+
+        result = self.app.post(url, json=ops)
+        assert result.status == "200 OK" and result.json is not None
+        results = result.json["results"]
+        assert [(x["op"], x["ok"]) for x in results] == [
+            ("create", True),
+            ("update", True),
+            ("delete", True),
+            ("delete", False),
+            ("create", False),
+        ]
+        assert results[1]["id"] == kept.id
+        assert "No link" in results[3]["error"]
+        assert "b{a}d" in results[4]["error"]
+
+        u = m.User.by_slug(u.name)
+        links, _ = u.get_links(as_user=u)
+        assert sorted(link.name for link in links) == ["new", "renamed"]
+        assert (u.link_count, u.public_link_count) == (2, 1)
+        new = u.get_link(results[0]["id"])
+        assert sorted(t.name for t in new.to_view(u).tags) == [
+            "fresh",
+            "fresh/tag",
+            "keep",
+        ]
+        # tags no link uses any more are cleaned up, along with any made
+        # for the operation that failed
+        assert sorted(t.name for t in u.get_tags()) == ["fresh", "fresh/tag", "keep"]
+        assert m.Tag.get(name="fresh/tag").link_count == 2
+        assert m.Tag.get(name="keep").public_link_count == 0
+        # it all happened at once
+        assert len({u.get_link(link.id).revision for link in links}) == 1
+
+        link = ops[0]["link"]
+        for bad in [
+            {"ops": []},
+            [{"op": "frob"}],
+            [{"op": "delete"}],
+            [{"op": "delete", "id": "abc"}],
+            [{"op": "update", "id": "abc", "link": link}],
+            [{"op": "create", "link": "x"}],
+            [{"op": "create", "link": {**link, "created": "garbage"}}],
+            [{"op": "create", "link": {**link, "tags": "abc"}}],
+            [{"op": "create", "link": {**link, "tags": [1]}}],
+            [{"op": "create", "link": {**link, "url": ["u"]}}],
+            [{"op": "create", "link": {**link, "name": None}}],
+            [{"op": "create", "link": {**link, "description": 5}}],
+            [{"op": "create", "link": {**link, "private": "yes"}}],
+            [{"op": "create", "link": {**link, "private": 1}}],
+            [{"op": "create", "link": {"name": "no url"}}],
+        ]:
+            assert self.app.post(url, json=bad).status == "400 BAD REQUEST"
+        assert self.app.post(url, data="[", content_type="application/json").status == (
+            "400 BAD REQUEST"
+        )
+
+    def test_changes(self, monkeypatch):
+        u = self.mk_user(password="foo")
+        links = [
+            m.Link.from_request(
+                u, r.Link(f"http://example.com/{i}", f"link {i}", "", True, ["a/b"])
+            )
+            for i in range(5)
+        ]
+        url = f"/u/{u.name}/changes"
+        api = {"Content-Type": "application/json"}
+        assert self.app.get(url, headers=api).status == "403 FORBIDDEN"
+        self.app.post("/auth", json={"name": u.name, "password": "foo"})
+        monkeypatch.setattr(m.User, "CHANGES_BATCH", 2)
+
+        def sync(since: str = "") -> dict:
+            result = self.app.get(f"{url}?since={since}", headers=api)
+            assert result.status == "200 OK" and result.json is not None
+            return result.json
+
+        # everything comes in batches, oldest first
+        seen: List[int] = []
+        since, more = "", True
+        while more:
+            changes = sync(since)
+            assert len(changes["changes"]) <= 2
+            seen.extend(change["id"] for change in changes["changes"])
+            since, more = changes["next"], changes["more"]
+        assert seen == [link.id for link in links]
+        assert changes["changes"][-1]["link"]["tags"] == ["a/b", "a"]
+        assert sync(since) == {
+            "changes": [],
+            "next": since,
+            "more": False,
+            "redirect": url,
+        }
+
+        # after which only what's changed since comes back
+        links[1].update_from_request(
+            u, r.Link(links[1].url, "renamed", "", False, ["c"])
+        )
+        links[3].full_delete()
+        changes = sync(since)
+        assert [(change["op"], change["id"]) for change in changes["changes"]] == [
+            ("upsert", links[1].id),
+            ("delete", links[3].id),
+        ]
+        renamed = changes["changes"][0]["link"]
+        assert (renamed["name"], renamed["tags"]) == ("renamed", ["c"])
+        assert renamed["modified"] > renamed["created"]
+        assert changes["changes"][1]["link"] is None
+        assert not changes["more"]
+        assert sync(changes["next"])["changes"] == []
+
+        # and the same token gets a 304 if nothing has changed
+        first = self.app.get(f"{url}?since={since}", headers=api)
+        again = self.app.get(
+            f"{url}?since={since}",
+            headers={**api, "If-None-Match": first.headers["ETag"]},
+        )
+        assert again.status == "304 NOT MODIFIED"
+
+        # a new link can get the id of the newest one after it's deleted,
+        # so the order of the two changes is what tells them apart
+        newest = m.Link.from_request(
+            u, r.Link("http://example.com/old", "old", "", False, [])
+        )
+        since = sync(since)["next"]
+        newest.full_delete()
+        reused = m.Link.from_request(
+            u, r.Link("http://example.com/new", "new", "", False, [])
+        )
+        assert reused.id == newest.id
+        changes = sync(since)["changes"]
+        assert [(change["op"], change["id"]) for change in changes] == [
+            ("delete", reused.id),
+            ("upsert", reused.id),
+        ]
+        assert changes[1]["link"]["name"] == "new"
+
+        assert self.app.get(f"{url}?since=x", headers=api).status == "400 BAD REQUEST"
+
+    def test_worker_starts_with_requests(self, monkeypatch):
+        started = []
+        monkeypatch.setattr(w.worker, "ensure_started", lambda: started.append(1))
+        assert not started
+        self.app.get("/")
+        assert started
+
+    def test_import_job(self):
+        u = self.mk_user()
+        _, token = m.User.login(r.User(name=u.name, password="foo"))
+        export = [
+            {
+                "href": "http://a.com",
+                "description": "a",
+                "extended": "",
+                "time": "2020-01-01T00:00:00Z",
+                "shared": "yes",
+                "tags": "food",
+            }
+        ]
+        result = self.app.post(
+            f"/u/{u.name}/import",
+            data={"file": (io.BytesIO(json.dumps(export).encode()), "export.json")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert result.status == "302 FOUND"
+        job_url = result.headers["Location"]
+        assert job_url.startswith(f"/u/{u.name}/import/")
+
+        result = self.app.get(
+            job_url,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+        )
+        assert result.json is not None and result.json["status"] == "queued"
+
+        assert w.worker.run_pending() == 1
+        result = self.app.get(
+            job_url,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+        )
+        assert result.json is not None and result.json["status"] == "done"
+        assert (result.json["processed"], result.json["imported"]) == (1, 1)
+        assert m.Link.select().count() == 1
+
+        result = self.app.get(job_url, headers={"Authorization": f"Bearer {token}"})
+        assert "done" in result.get_data(as_text=True)
+
+        # and a job id has to be a number
+        bad_url = f"/u/{u.name}/import/abc"
+        result = self.app.get(bad_url, headers={"Authorization": f"Bearer {token}"})
+        assert f"Page {bad_url} not found" in result.get_data(as_text=True)
+
+    def file_db(self, tmp_path) -> str:
+        c.app.close_db()
+        path = str(tmp_path / "lc.db")
+        c.app.db.init(path, pragmas=c.app.db_pragmas())
+        m.create_tables()
+        return path
+
+    def hammer(self, threads=8, requests=20):
+        """
+        Make a lot of requests at once, a mix of reads and writes,
+        and return any that didn't succeed
+        """
+        u = self.mk_user()
+        _, token = m.User.login(r.User(name=u.name, password="foo"))
+        headers = {"Authorization": f"Bearer {token}"}
+        # the requests should manage their own connections
+        c.app.close_db()
+        failures = []
+
+        def run(n):
+            client = a.app.test_client()
+            for i in range(requests):
+                if i % 4 == 0:
+                    result = client.post(
+                        f"/u/{u.name}/l",
+                        json={
+                            "url": f"http://{n}-{i}.com",
+                            "name": f"link {n}-{i}",
+                            "description": "",
+                            "private": False,
+                            "tags": [f"thread/{n}", "shared"],
+                        },
+                        headers=headers,
+                    )
+                elif i % 4 == 1:
+                    result = client.get(f"/u/{u.name}/t/shared", headers=headers)
+                else:
+                    result = client.get("/")
+                if result.status_code != 200:
+                    failures.append((n, i, result.status))
+
+        workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        assert m.Link.select().count() == threads * requests // 4
+        assert m.User.by_slug(u.name).link_count == threads * requests // 4
+        return failures
+
+    def test_concurrent_requests(self, tmp_path):
+        self.file_db(tmp_path)
+        assert self.hammer() == []
+
+    def test_concurrent_requests_with_pool(self, tmp_path):
+        path = self.file_db(tmp_path)
+        c.app.close_db()
+        db = c.app.db
+        # fewer connections than threads, so requests have to wait
+        pool = playhouse.pool.PooledSqliteExtDatabase(
+            path,
+            max_connections=4,
+            timeout=10,
+            pragmas=c.app.db_pragmas(),
+            check_same_thread=False,
+        )
+        c.app.db = pool
+        try:
+            with pool.bind_ctx(m.MODELS):
+                assert self.hammer() == []
+                pool.close()
+                assert pool._in_use == {}
+                pool.close_all()
+        finally:
+            c.app.db = db
+
+    def test_fork_safety(self, tmp_path):
+        self.file_db(tmp_path)
+        conn = c.app.db.connection()
+        pid = os.fork()
+        if pid == 0:
+            # the child mustn't use or close the parent's connection
+            ok = c.app.db.is_closed() and c.app.db.connection() is not conn
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+        assert c.app.db.connection() is conn
+
+    def test_template_reloading(self, tmp_path):
+        templates = web.Templates(str(tmp_path))
+        (tmp_path / "page.mustache").write_text("<p>{{> part}}</p>")
+        (tmp_path / "part.mustache").write_text("{{token}}")
+        assert templates.render_name("page", v.AddUser("one")) == "<p>one</p>"
+
+        # a changed template is only read again in debug mode
+        (tmp_path / "part.mustache").write_text("[{{token}}]")
+        os.utime(tmp_path / "part.mustache", (0, 0))
+        assert templates.render_name("page", v.AddUser("two")) == "<p>two</p>"
+        debug = c.app.app.debug
+        try:
+            c.app.app.debug = True
+            assert templates.render_name("page", v.AddUser("two")) == "<p>[two]</p>"
+        finally:
+            c.app.app.debug = debug
+
+    def test_server_timing(self, monkeypatch):
+        u = self.mk_user(password="foo")
+        m.Link.from_request(
+            u, r.Link("http://example.com", "example", "", False, ["tag"])
+        )
+        assert "Server-Timing" not in self.app.get(f"/u/{u.name}").headers
+
+        monkeypatch.setattr(c.app.config, "timing", True)
+        monkeypatch.setattr(c.app.config, "timing_log", True)
+        self.app.post("/auth", json={"name": u.name, "password": "foo"})
+        lines: List[str] = []
+        monkeypatch.setattr(c, "log", lines.append)
+        result = self.app.get(f"/u/{u.name}")
+        assert result.status == "200 OK"
+        metrics = {
+            metric.split(";")[0]: metric
+            for metric in result.headers["Server-Timing"].split(", ")
+        }
+        assert set(metrics) == {
+            "sql",
+            "auth",
+            "render.linklist",
+            "render.main",
+            "total",
+        }
+        assert 'desc="1 renders"' in metrics["render.main"]
+
+        logged = json.loads(lines[-1])
+        assert logged["method"] == "GET"
+        assert logged["path"] == f"/u/{u.name}"
+        assert logged["status"] == 200
+        assert logged["queries"] == int(metrics["sql"].split('desc="')[1].split()[0])
+        assert logged["queries"] > 0
+        assert set(logged["render_ms"]) == {"linklist", "main"}
+
+    def test_slow_query_log(self, monkeypatch):
+        u = self.mk_user(password="foo")
+        u.set_as_admin()
+        self.app.post("/auth", json={"name": u.name, "password": "foo"})
+        lines: List[str] = []
+        monkeypatch.setattr(c, "log", lines.append)
+        monkeypatch.setattr(c.app.config, "slow_query_ms", 1e-9)
+        monkeypatch.setattr(c.app.config, "query_stats", True)
+        c.app.query_log.clear()
+
+        m.Link.from_request(
+            u, r.Link("http://example.com", "example", "", False, ["a/b", "c"])
+        )
+        result = self.app.get(f"/u/{u.name}/config")
+        assert result.status == "200 OK"
+
+        logged = [json.loads(line) for line in lines]
+        lookups = [q for q in logged if q["endpoint"] == "GetUserConfig"]
+        assert lookups
+        for query in lookups:
+            assert query["ms"] > 0
+            # parameters are users' data, so only their types are shown
+            assert set(query["params"]) <= {"int", "str", "float", "bool"}
+        assert any(
+            query["slow_query"].startswith("SELECT") and query["plan"]
+            for query in lookups
+        )
+        # only statements which read tables have plans
+        begins = [q for q in logged if q["slow_query"].startswith("BEGIN")]
+        assert begins and all(q["plan"] == [] for q in begins)
+
+        # lists of placeholders are counted as one kind of statement
+        assert c.normalize("a IN (?, ?,?)  AND b = ?") == "a IN (?, ...) AND b = ?"
+        top = c.app.query_log.top()
+        assert top == sorted(top, key=lambda t: t[2], reverse=True)
+        page = result.data.decode()
+        assert "Statements that have taken longest" in page
+        assert any(sql.replace('"', "&quot;") in page for sql, _, _ in top)